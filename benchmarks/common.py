@@ -0,0 +1,176 @@
+"""
+Спільне для бенчмарків: шлях до коду, тестові бази SQLite, перцентилі і JSON-звіти
+"""
+import os
+import sys
+import json
+import time
+import random
+import sqlite3
+import platform
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+# Бенчмарки завжди працюють з локальним SQLite, а не з продакшн Postgres
+os.environ.pop('DATABASE_URL', None)
+os.environ.setdefault('BOT_TOKEN', '123456:benchmark')
+os.environ.setdefault('WEBAPP_URL', 'https://example.com/')
+
+DATA_DIR = os.path.join(ROOT, '.bench')
+
+WORDS = ('худі', 'футболка', 'кросівки', 'кеди', 'штани', 'куртка', 'світшот', 'шорти',
+         'oversize', 'basic', 'чорний', 'білий', 'сірий', 'nike', 'adidas', 'puma', 'vintage', 'cargo')
+SIZES = {'одяг': 'S, M, L, XL', 'взуття': '39, 40, 41, 42, 43'}
+
+
+def generate_products(count, seed=42):
+    """Детерміновані рядки товарів у порядку PRODUCT_COLUMNS"""
+    rng = random.Random(seed)
+    for i in range(count):
+        product_type = rng.choice(('одяг', 'взуття'))
+        name = ' '.join(rng.sample(WORDS, 3)).capitalize()
+        yield (
+            f"{name} {i}",
+            f"Опис товару {i}: {' '.join(rng.sample(WORDS, 6))}",
+            float(rng.randint(500, 6000)),
+            f"https://example.com/img/{i}.jpg",
+            rng.choice(('чоловіче', 'жіноче')),
+            product_type,
+            SIZES[product_type],
+        )
+
+
+def seeded_db(products, data_dir=DATA_DIR, name='catalog'):
+    """
+    Шлях до файлу SQLite з products товарами (створюється один раз і перевикористовується).
+    Після виклику database працює з цим файлом.
+    """
+    import database
+
+    os.makedirs(data_dir, exist_ok=True)
+    path = os.path.join(data_dir, f'{name}_{products}.db')
+    database.DB_FILE = path
+
+    if os.path.exists(path):
+        try:
+            count = database.execute_query('SELECT COUNT(*) AS n FROM products', fetchone=True)['n']
+        except sqlite3.Error:
+            # Битий файл або неповна схема - створюємо заново
+            count = None
+        if count == products:
+            # Схема могла змінитись з часу створення файлу - міграції init_db ідемпотентні
+            database.init_db()
+            return path
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(path + suffix):
+                os.remove(path + suffix)
+
+    database.init_db()
+    database.add_products_bulk(generate_products(products))
+    return path
+
+
+def percentile(sorted_values, q):
+    """Перцентиль q (0..100) з уже відсортованого списку, лінійна інтерполяція"""
+    if not sorted_values:
+        return None
+    position = (len(sorted_values) - 1) * q / 100
+    lower = int(position)
+    upper = min(lower + 1, len(sorted_values) - 1)
+    return sorted_values[lower] + (sorted_values[upper] - sorted_values[lower]) * (position - lower)
+
+
+def latency_summary(seconds):
+    """Латентності в секундах -> словник у мілісекундах"""
+    values = sorted(seconds)
+    if not values:
+        return {'p50': None, 'p95': None, 'p99': None, 'max': None, 'mean': None}
+    return {
+        'p50': round(percentile(values, 50) * 1000, 3),
+        'p95': round(percentile(values, 95) * 1000, 3),
+        'p99': round(percentile(values, 99) * 1000, 3),
+        'max': round(values[-1] * 1000, 3),
+        'mean': round(sum(values) / len(values) * 1000, 3),
+    }
+
+
+def run_meta():
+    """Де і на чому запускався бенчмарк - щоб порівнювати звіти між собою"""
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT,
+                                capture_output=True, text=True, timeout=5).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        commit = None
+    return {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'commit': commit,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+    }
+
+
+def write_report(path, benchmark, results, **extra):
+    """Записати JSON-звіт (або вивести в stdout, якщо path - '-')"""
+    report = {'benchmark': benchmark, 'meta': run_meta(), **extra, 'results': results}
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if path == '-':
+        print(text)
+    else:
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(text + '\n')
+        print(f"📝 Report: {path}")
+    return report
+
+
+def compare_reports(current, baseline, key_fields, metrics, threshold=0.2):
+    """
+    Порівняти результати з baseline. metrics - {поле: 'higher' | 'lower'} (що краще).
+    Повертає список регресій гірших за threshold (частка).
+    """
+    def key(row):
+        return tuple(row.get(field) for field in key_fields)
+
+    previous = {key(row): row for row in baseline.get('results', [])}
+    regressions = []
+    for row in current:
+        old = previous.get(key(row))
+        if not old:
+            continue
+        for metric, better in metrics.items():
+            new_value, old_value = _lookup(row, metric), _lookup(old, metric)
+            if not new_value or not old_value:
+                continue
+            change = (new_value - old_value) / old_value
+            if (better == 'higher' and change < -threshold) or (better == 'lower' and change > threshold):
+                regressions.append({
+                    **{field: row.get(field) for field in key_fields},
+                    'metric': metric,
+                    'baseline': old_value,
+                    'current': new_value,
+                    'change': round(change, 3),
+                })
+    return regressions
+
+
+def _lookup(row, dotted):
+    value = row
+    for part in dotted.split('.'):
+        if not isinstance(value, dict):
+            return None
+        value = value.get(part)
+    return value
+
+
+def print_regressions(regressions, threshold):
+    if not regressions:
+        print(f"✅ No regressions beyond {threshold:.0%}")
+        return
+    print(f"⚠️ {len(regressions)} regression(s) beyond {threshold:.0%}:")
+    for item in regressions:
+        where = ', '.join(f"{k}={v}" for k, v in item.items()
+                          if k not in ('metric', 'baseline', 'current', 'change'))
+        print(f"   {where}: {item['metric']} {item['baseline']} -> {item['current']} ({item['change']:+.0%})")
@@ -0,0 +1,279 @@
+"""
+Мікробенчмарки шару даних (SQLite): get_all_products, get_product, get_recent_orders,
+save_user, add_order на базах зростаючого розміру.
+
+Для кожної функції міряється варіант з database.py як є (нове з'єднання на кожен виклик,
+рядки-словники) і альтернативи з тим самим SQL (запити імпортуються з database.py):
+  читання - з'єднання на виклик / одне постійне з'єднання × dict / tuple рядки;
+  запис   - по одному рядку з commit / пачка в одній транзакції. Для add_order це повна
+            транзакція database.insert_order + upsert'и зведень sales_daily*.
+
+Результати порівнюються з baseline-файлом (.bench/db_baseline.json), регресії позначаються.
+
+    python benchmarks/db_micro.py --save-baseline
+    python benchmarks/db_micro.py --sizes 1000,10000,100000
+"""
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import sqlite3
+import argparse
+from datetime import datetime, timedelta
+
+from common import DATA_DIR, seeded_db, latency_summary, write_report, compare_reports, print_regressions
+import database
+
+BASELINE = os.path.join(DATA_DIR, 'db_baseline.json')
+
+SQL = {
+    'get_all_products': ('SELECT * FROM products ORDER BY created_at DESC', 'all'),
+    'get_product': ('SELECT * FROM products WHERE id = ?', 'one'),
+}
+# get_recent_orders: гарячі замовлення, архів - за тим самим правилом, що в database._recent_orders
+RECENT_ORDERS = database.RECENT_ORDERS_QUERY.format(columns=database.ORDER_COLUMNS, table='orders', where='')
+RECENT_ARCHIVED_ORDERS = database.RECENT_ORDERS_QUERY.format(columns=database.ORDER_COLUMNS,
+                                                             table='orders_archive', where='')
+# Той самий upsert, що виконує database.save_user
+INSERT_USER = database.SAVE_USER_QUERY
+
+
+def seed_orders(path, count, seed=3):
+    """Дозаповнити orders до count рядків (за останні 90 днів)"""
+    conn = sqlite3.connect(path)
+    existing = conn.execute('SELECT COUNT(*) FROM orders').fetchone()[0]
+    if existing < count:
+        rng = random.Random(seed)
+        now = datetime.now()
+        rows = []
+        for _ in range(count - existing):
+            created = now - timedelta(seconds=rng.randint(0, 90 * 86400))
+            rows.append((rng.randint(1, 50000), 'bench', order_products(rng), float(rng.randint(500, 9000)),
+                         rng.choice(('pending', 'paid', 'done')), rng.choice(('card', 'cash', 'crypto')),
+                         created.strftime('%Y-%m-%d %H:%M:%S')))
+        conn.executemany('''INSERT INTO orders (user_id, username, products, total_price, status, payment_method,
+                                                created_at) VALUES (?, ?, ?, ?, ?, ?, ?)''', rows)
+        conn.commit()
+    conn.close()
+
+
+def order_products(rng):
+    return json.dumps([{'id': rng.randint(1, 1000), 'name': 'Худі', 'size': 'M', 'price': 1200, 'quantity': 1}])
+
+
+def measure(call, duration, min_calls=3):
+    """Викликати call() поки не мине duration секунд (мінімум min_calls разів)"""
+    latencies = []
+    started = time.perf_counter()
+    while len(latencies) < min_calls or time.perf_counter() - started < duration:
+        begin = time.perf_counter()
+        call()
+        latencies.append(time.perf_counter() - begin)
+    elapsed = time.perf_counter() - started
+    return {
+        'calls': len(latencies),
+        'ops_per_s': round(len(latencies) / elapsed, 1),
+        'latency_ms': latency_summary(latencies),
+    }
+
+
+class RawReader:
+    """Той самий SQL, що й у database.py, з вибором з'єднання і формату рядків"""
+
+    def __init__(self, path, pooled, as_dict):
+        self.path = path
+        self.as_dict = as_dict
+        self.conn = self._connect() if pooled else None
+        # database.py кешує найновіший created_at архіву на ARCHIVE_HORIZON_TTL - тут на весь прогін
+        row = self._execute(database.ARCHIVE_HORIZON_QUERY, (), 'one')
+        self.horizon = row['newest'] if as_dict else row[0]
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path)
+        if self.as_dict:
+            conn.row_factory = sqlite3.Row
+        return conn
+
+    def query(self, name, params=()):
+        sql, mode = SQL[name]
+        return self._execute(sql, params, mode)
+
+    def recent_orders(self, limit):
+        rows = self._execute(RECENT_ORDERS, (limit,), 'all')
+        created_at = (lambda row: row['created_at']) if self.as_dict else (lambda row: row[-1])
+        if self.horizon is None or (len(rows) == limit and created_at(rows[-1]) > self.horizon):
+            return rows
+        rows += self._execute(RECENT_ARCHIVED_ORDERS, (limit,), 'all')
+        order_id = (lambda row: row['id']) if self.as_dict else (lambda row: row[0])
+        rows.sort(key=lambda row: (created_at(row), order_id(row)), reverse=True)
+        return rows[:limit]
+
+    def _execute(self, sql, params, mode):
+        conn = self.conn or self._connect()
+        try:
+            cursor = conn.execute(sql, params)
+            if mode == 'one':
+                row = cursor.fetchone()
+                return dict(row) if row is not None and self.as_dict else row
+            rows = cursor.fetchall()
+            return [dict(row) for row in rows] if self.as_dict else rows
+        finally:
+            if conn is not self.conn:
+                conn.close()
+
+    def close(self):
+        if self.conn is not None:
+            self.conn.close()
+
+
+def bench_reads(database, path, products, duration):
+    rng = random.Random(11)
+    shipped = {
+        'get_all_products': lambda: database.get_all_products(),
+        'get_product': lambda: database.get_product(rng.randint(1, products)),
+        'get_recent_orders': lambda: database.get_recent_orders(10),
+    }
+    raw = {
+        'get_all_products': lambda reader: reader.query('get_all_products'),
+        'get_product': lambda reader: reader.query('get_product', (rng.randint(1, products),)),
+        'get_recent_orders': lambda reader: reader.recent_orders(10),
+    }
+
+    for name, call in shipped.items():
+        yield name, 'database.py', measure(call, duration)
+        for pooled in (False, True):
+            for as_dict in (True, False):
+                reader = RawReader(path, pooled, as_dict)
+                variant = f"{'pooled' if pooled else 'per_call'}/{'dict' if as_dict else 'tuple'}"
+                try:
+                    yield name, variant, measure(lambda: raw[name](reader), duration)
+                finally:
+                    reader.close()
+
+
+def write_users(c, rows):
+    c.executemany(INSERT_USER, rows)
+
+
+def write_orders(c, rows):
+    """Та сама транзакція, що в database.add_order: вставка + зведення (один upsert на пачку)"""
+    database.begin_write(c)
+    sales = database.SalesDelta()
+    for row in rows:
+        database.insert_order(c, sales, *row)
+    sales.write(c)
+
+
+def bench_writes(database, duration, batch):
+    """Записи йдуть у копію бази, щоб не роздувати seeded файл між прогонами"""
+    rng = random.Random(13)
+
+    def user_row():
+        user_id = rng.randint(1, 100000)
+        return user_id, f'user{user_id}', 'Bench', None, 0
+
+    def order_row():
+        return rng.randint(1, 50000), 'bench', order_products(rng), 1200.0, 'pending', 'card'
+
+    writes = {
+        'save_user': (lambda: database.save_user(*user_row()), write_users, user_row),
+        'add_order': (lambda: database.add_order(*order_row()), write_orders, order_row),
+    }
+
+    # Постійне з'єднання з тими ж налаштуваннями (dict рядки), що й у database.py
+    conn = database.get_connection()
+    c = conn.cursor()
+    try:
+        for name, (shipped, write, make_row) in writes.items():
+            yield name, 'database.py', measure(shipped, duration)
+
+            def single():
+                write(c, [make_row()])
+                conn.commit()
+            yield name, 'pooled/single', measure(single, duration)
+
+            def batched():
+                write(c, [make_row() for _ in range(batch)])
+                conn.commit()
+            result = measure(batched, duration)
+            # Нормуємо на один рядок, щоб порівнювати з single
+            result['rows_per_call'] = batch
+            result['rows_per_s'] = round(result['ops_per_s'] * batch, 1)
+            yield name, f'pooled/batch{batch}', result
+    finally:
+        conn.close()
+
+
+def run(args):
+    results = []
+    for products in args.sizes:
+        orders = products * args.orders_per_product
+        started = time.perf_counter()
+        path = seeded_db(products, args.data_dir, name='db_micro')
+        seed_orders(path, orders)
+        print(f"📦 {products} products / {orders} orders ({time.perf_counter() - started:.1f}s)")
+
+        def record(function, variant, result):
+            row = {'function': function, 'variant': variant, 'products': products, 'orders': orders, **result}
+            results.append(row)
+            rate = f"{row['rows_per_s']:>10} rows/s" if 'rows_per_s' in row else f"{row['ops_per_s']:>10} ops/s"
+            print(f"   {function:18} {variant:16} {rate}  p50={row['latency_ms']['p50']}ms  "
+                  f"p99={row['latency_ms']['p99']}ms")
+
+        database.DB_FILE = path
+        for item in bench_reads(database, path, products, args.duration):
+            record(*item)
+
+        scratch = path.replace('.db', '_scratch.db')
+        shutil.copyfile(path, scratch)
+        database.DB_FILE = scratch
+        try:
+            for item in bench_writes(database, args.duration, args.batch):
+                record(*item)
+        finally:
+            database.DB_FILE = path
+            for suffix in ('', '-wal', '-shm'):
+                if os.path.exists(scratch + suffix):
+                    os.remove(scratch + suffix)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="database.py microbenchmarks")
+    parser.add_argument('--sizes', type=lambda v: [int(x) for x in v.split(',') if x.strip()],
+                        default=[1000, 10000, 100000], help="catalog sizes (products)")
+    parser.add_argument('--orders-per-product', type=int, default=2)
+    parser.add_argument('--duration', type=float, default=1.0, help="seconds per case")
+    parser.add_argument('--batch', type=int, default=100, help="rows per batched write")
+    parser.add_argument('--data-dir', default=DATA_DIR)
+    parser.add_argument('--output', default=os.path.join(DATA_DIR, 'db_micro.json'), help="JSON report ('-' = stdout)")
+    parser.add_argument('--baseline', default=BASELINE, help="baseline to compare against")
+    parser.add_argument('--save-baseline', action='store_true', help="write this run as the new baseline")
+    parser.add_argument('--threshold', type=float, default=0.2, help="allowed regression (0.2 = 20%%)")
+    args = parser.parse_args()
+
+    os.makedirs(args.data_dir, exist_ok=True)
+    results = run(args)
+    write_report(args.output, 'db_micro', results, config={'duration_s': args.duration, 'batch': args.batch})
+
+    if args.save_baseline:
+        write_report(args.baseline, 'db_micro', results, config={'duration_s': args.duration, 'batch': args.batch})
+        return
+
+    if not os.path.exists(args.baseline):
+        print(f"ℹ️ No baseline at {args.baseline} - run with --save-baseline first")
+        return
+
+    with open(args.baseline, encoding='utf-8') as f:
+        baseline = json.load(f)
+    regressions = compare_reports(results, baseline, ('function', 'variant', 'products'),
+                                  {'ops_per_s': 'higher', 'latency_ms.p95': 'lower'}, args.threshold)
+    print_regressions(regressions, args.threshold)
+    if regressions:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,295 @@
+"""
+Пропускна здатність dispatcher: синтетичні апдейти (/start, кошик з міні-додатку,
+payment_* callback, контакти) через dp.feed_update з підміненою сесією бота.
+
+Кожен checkout - 4 апдейти від одного користувача. Сесія бота нічого не надсилає,
+а тільки рахує вихідні виклики, тому міряється саме наш код: middleware, фільтри,
+хендлери, FSM і SQLite. Результат - JSON з updates/s, латентністю хендлерів
+і ростом пам'яті (RSS і записи MemoryStorage) по ходу прогону.
+
+    python benchmarks/dispatcher.py --checkouts 250000 --concurrency 20
+    python benchmarks/dispatcher.py --users 1000 --tracemalloc
+"""
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import asyncio
+import argparse
+import tempfile
+import tracemalloc
+import contextvars
+from collections import Counter
+
+from common import seeded_db, latency_summary, write_report, compare_reports, print_regressions
+
+PAYMENT_METHODS = ('cash', 'card', 'crypto')
+
+
+def rss_mb():
+    """Поточний RSS процесу (Linux), інакше пікове значення з getrusage"""
+    try:
+        with open('/proc/self/statm') as f:
+            return round(int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 1024 / 1024, 1)
+    except (OSError, ValueError, IndexError):
+        import resource
+        return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+
+def install_stub_session(bot):
+    """Замінити сесію бота на заглушку, що рахує виклики. Повертає Counter методів"""
+    from aiogram import types
+    from aiogram.client.session.base import BaseSession
+    from aiogram.methods import SendMessage, EditMessageText
+
+    calls = Counter()
+
+    class RecordingSession(BaseSession):
+        async def close(self):
+            pass
+
+        async def stream_content(self, *args, **kwargs):
+            yield b''
+
+        async def make_request(self, bot, method, timeout=None):
+            calls[type(method).__name__] += 1
+            if isinstance(method, (SendMessage, EditMessageText)):
+                return types.Message(
+                    message_id=1, date=0, text=method.text,
+                    chat=types.Chat(id=method.chat_id or 1, type='private'),
+                )
+            return True
+
+    # Middleware сесії (заміри Telegram API) переносимо на заглушку
+    middleware = bot.session.middleware
+    bot.session = RecordingSession()
+    bot.session.middleware = middleware
+    return calls
+
+
+class UpdateFactory:
+    """Генератор апдейтів для одного checkout"""
+
+    def __init__(self, products, seed=7):
+        from aiogram import types
+        self.types = types
+        self.products = products
+        self.rng = random.Random(seed)
+        self.update_id = 0
+
+    def _next_id(self):
+        self.update_id += 1
+        return self.update_id
+
+    def _user(self, user_id):
+        return self.types.User(id=user_id, is_bot=False, first_name='Bench', username=f'bench{user_id}')
+
+    def _message(self, user_id, **fields):
+        update_id = self._next_id()
+        return self.types.Update(update_id=update_id, message=self.types.Message(
+            message_id=update_id, date=0, chat=self.types.Chat(id=user_id, type='private'),
+            from_user=self._user(user_id), **fields,
+        ))
+
+    def _cart(self):
+        items = []
+        for product in self.rng.sample(self.products, self.rng.randint(1, 3)):
+            sizes = [size.strip() for size in product['sizes'].split(',')]
+            items.append({'id': product['id'], 'name': product['name'],
+                          'size': self.rng.choice(sizes), 'price': product['price']})
+        return json.dumps({'products': items, 'total': sum(item['price'] for item in items)})
+
+    def checkout(self, user_id):
+        """[(назва кроку, Update)] - повний шлях покупця"""
+        callback_id = self._next_id()
+        payment = self.rng.choice(PAYMENT_METHODS)
+        return [
+            ('start', self._message(user_id, text='/start')),
+            ('web_app_data', self._message(user_id, web_app_data=self.types.WebAppData(
+                data=self._cart(), button_text='Оформити'))),
+            ('payment', self.types.Update(update_id=callback_id, callback_query=self.types.CallbackQuery(
+                id=str(callback_id), chat_instance='bench', from_user=self._user(user_id),
+                data=f'payment_{payment}',
+                message=self.types.Message(message_id=callback_id, date=0, text='🛒',
+                                           chat=self.types.Chat(id=user_id, type='private')),
+            ))),
+            ('contact', self._message(user_id, text='+380501234567, Київ, НП 1')),
+        ]
+
+
+# Крок checkout, апдейт якого зараз проходить через dispatcher
+current_step = contextvars.ContextVar('current_step', default=None)
+
+
+def remove_throttling(dp):
+    """Зняти anti-flood з dispatcher: він мовчки відкидає повторні /start і callback
+    від одного користувача (ліміти з прапорців хендлерів не залежать від THROTTLE_*)"""
+    from middlewares import ThrottlingMiddleware
+
+    for observer in (dp.message, dp.callback_query):
+        for middleware in list(observer.middleware):
+            if isinstance(middleware, ThrottlingMiddleware):
+                observer.middleware.unregister(middleware)
+
+
+async def run(args):
+    import metrics
+    from aiogram.dispatcher.middlewares.base import BaseMiddleware
+    from database import get_all_products
+    import bot as bot_module
+
+    dp, bot = bot_module.dp, bot_module.bot
+    remove_throttling(dp)
+    calls = install_stub_session(bot)
+    products = [dict(product) for product in get_all_products()]
+    factory = UpdateFactory(products)
+
+    handler_timings = {}
+    sent = Counter()
+    handled = Counter()
+
+    class HandlerLatency(BaseMiddleware):
+        async def __call__(self, handler, event, data):
+            handled[current_step.get()] += 1
+            started = time.perf_counter()
+            try:
+                return await handler(event, data)
+            finally:
+                name = data['handler'].callback.__name__
+                timing = handler_timings.get(name)
+                if timing is None:
+                    timing = handler_timings[name] = metrics.Timing(window=args.samples)
+                timing.add(time.perf_counter() - started)
+
+    for observer in (dp.message, dp.callback_query):
+        observer.middleware(HandlerLatency())
+
+    step_timings = {}
+    update_timing = metrics.Timing(window=args.samples)
+    checkpoints = []
+    done = 0
+    started = time.perf_counter()
+    last = (started, 0)
+
+    def checkpoint():
+        nonlocal last
+        now = time.perf_counter()
+        interval = now - last[0]
+        point = {
+            'updates': done,
+            'elapsed_s': round(now - started, 3),
+            'updates_per_s': round((done - last[1]) / interval, 1) if interval else None,
+            'rss_mb': rss_mb(),
+            'fsm_records': len(dp.storage.storage),
+        }
+        if args.tracemalloc:
+            point['traced_mb'] = round(tracemalloc.get_traced_memory()[0] / 1024 / 1024, 2)
+        checkpoints.append(point)
+        last = (now, done)
+        print(f"   {done:>9} updates  {point['updates_per_s']:>8} upd/s  RSS {point['rss_mb']} MB  "
+              f"FSM records {point['fsm_records']}")
+
+    next_checkout = 0
+
+    async def shopper():
+        nonlocal done, next_checkout
+        while next_checkout < args.checkouts:
+            index = next_checkout
+            next_checkout += 1
+            user_id = 10_000_000 + (index % args.users if args.users else index)
+            for step, update in factory.checkout(user_id):
+                current_step.set(step)
+                sent[step] += 1
+                begin = time.perf_counter()
+                await dp.feed_update(bot, update)
+                elapsed = time.perf_counter() - begin
+                update_timing.add(elapsed)
+                timing = step_timings.get(step)
+                if timing is None:
+                    timing = step_timings[step] = metrics.Timing(window=args.samples)
+                timing.add(elapsed)
+                done += 1
+                if done % args.checkpoint == 0:
+                    checkpoint()
+
+    if args.tracemalloc:
+        tracemalloc.start()
+    checkpoint()
+    await asyncio.gather(*(shopper() for _ in range(args.concurrency)))
+    total = time.perf_counter() - started
+    if done % args.checkpoint:
+        checkpoint()
+
+    def summary(timing):
+        return {'count': timing.count, **latency_summary(list(timing.samples))}
+
+    return {
+        'checkouts': args.checkouts,
+        'updates': done,
+        'concurrency': args.concurrency,
+        'users': args.users or args.checkouts,
+        'duration_s': round(total, 3),
+        'updates_per_s': round(done / total, 1),
+        'checkouts_per_s': round(args.checkouts / total, 1),
+        'update_latency_ms': summary(update_timing),
+        'steps': {name: summary(timing) for name, timing in step_timings.items()},
+        'handlers': {name: summary(timing) for name, timing in handler_timings.items()},
+        'telegram_calls': dict(calls),
+        'memory': checkpoints,
+        'fsm_records': len(dp.storage.storage),
+        'dropped': {step: count - handled[step] for step, count in sent.items() if handled[step] != count},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Dispatcher throughput benchmark")
+    parser.add_argument('--checkouts', type=int, default=25000, help="checkouts (4 updates each)")
+    parser.add_argument('--concurrency', type=int, default=10, help="shoppers in flight")
+    parser.add_argument('--users', type=int, default=0,
+                        help="distinct user ids to cycle through (0 = new user per checkout)")
+    parser.add_argument('--products', type=int, default=1000, help="catalog size")
+    parser.add_argument('--checkpoint', type=int, default=10000, help="updates between memory samples")
+    parser.add_argument('--samples', type=int, default=100000, help="latency samples kept per metric")
+    parser.add_argument('--tracemalloc', action='store_true', help="also track Python heap (slower)")
+    parser.add_argument('--output', default='-', help="JSON report path ('-' = stdout)")
+    parser.add_argument('--baseline', help="previous JSON report to compare against")
+    parser.add_argument('--threshold', type=float, default=0.2, help="allowed regression (0.2 = 20%%)")
+    args = parser.parse_args()
+
+    # Окремий прогін з новою базою
+    data_dir = tempfile.mkdtemp(prefix='driphype-dispatcher-')
+    os.environ['DB_FILE'] = os.path.join(data_dir, f'dispatcher_{args.products}.db')
+    import logging
+    logging.disable(logging.INFO)
+
+    try:
+        seeded_db(args.products, data_dir, name='dispatcher')
+        print(f"🚀 {args.checkouts} checkouts, concurrency {args.concurrency}, {args.products} products")
+        result = asyncio.run(run(args))
+    finally:
+        shutil.rmtree(data_dir, ignore_errors=True)
+
+    print(f"📊 {result['updates_per_s']} updates/s, {result['checkouts_per_s']} checkouts/s, "
+          f"p95 {result['update_latency_ms']['p95']} ms")
+    write_report(args.output, 'dispatcher', [result])
+
+    # Кожен надісланий апдейт має дійти до свого хендлера, інакше заміри нічого не варті
+    if result['dropped']:
+        print(f"❌ Updates not handled: {result['dropped']}")
+        sys.exit(1)
+
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+        regressions = compare_reports([result], baseline, ('concurrency', 'users'),
+                                      {'updates_per_s': 'higher', 'update_latency_ms.p95': 'lower'},
+                                      args.threshold)
+        print_regressions(regressions, args.threshold)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
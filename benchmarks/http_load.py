@@ -0,0 +1,222 @@
+"""
+Навантажувальний бенчмарк HTTP API: main.create_app() (aiohttp) і api_server.app (Flask)
+на SQLite з каталогом від 10 до 100k товарів.
+
+Сервер запускається в окремому процесі, клієнт (aiohttp) тримає задану кількість
+одночасних запитів протягом --duration секунд. Результат - JSON з throughput і p50/p95/p99.
+
+    python benchmarks/http_load.py --sizes 10,1000,10000,100000 --concurrency 1,10,50
+    python benchmarks/http_load.py --output new.json --baseline old.json
+"""
+import os
+import sys
+import json
+import time
+import random
+import socket
+import asyncio
+import argparse
+import multiprocessing
+
+import aiohttp
+
+from common import DATA_DIR, seeded_db, latency_summary, write_report, compare_reports, print_regressions
+
+ROUTES = {
+    'products': '/api/products',
+    'product': '/api/products/{id}',
+    'health': '/health',
+}
+
+# Обидва сервери міряються на однаковому наборі маршрутів
+SERVERS = {
+    'aiohttp': ('products', 'product', 'health'),
+    'flask': ('products', 'product', 'health'),
+}
+READY_PATH = {'aiohttp': '/health', 'flask': '/health'}
+
+
+def serve(server, db_file, port):
+    """Точка входу процесу-сервера"""
+    import logging
+    os.environ['DB_FILE'] = db_file
+
+    if server == 'aiohttp':
+        from aiohttp import web
+        import main
+        app = main.create_app()
+        # Без webhook і фонових тасків - тільки HTTP API
+        app.on_startup.remove(main.on_startup)
+        logging.getLogger('aiohttp.access').setLevel(logging.WARNING)
+        web.run_app(app, host='127.0.0.1', port=port, print=None, access_log=None)
+    else:
+        from werkzeug.serving import make_server
+        import api_server
+        logging.getLogger('werkzeug').setLevel(logging.WARNING)
+        make_server('127.0.0.1', port, api_server.app, threaded=True).serve_forever()
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+class ServerProcess:
+    """Контекст: сервер у дочірньому процесі, чекаємо поки відповість"""
+
+    def __init__(self, server, db_file, startup_timeout=60):
+        self.server = server
+        self.db_file = db_file
+        self.port = free_port()
+        self.base_url = f'http://127.0.0.1:{self.port}'
+        self.startup_timeout = startup_timeout
+        self.process = None
+
+    async def __aenter__(self):
+        context = multiprocessing.get_context('spawn')
+        self.process = context.Process(target=serve, args=(self.server, self.db_file, self.port), daemon=True)
+        self.process.start()
+
+        deadline = time.monotonic() + self.startup_timeout
+        async with aiohttp.ClientSession() as session:
+            while time.monotonic() < deadline:
+                if not self.process.is_alive():
+                    raise RuntimeError(f"{self.server} server exited with code {self.process.exitcode}")
+                try:
+                    async with session.get(self.base_url + READY_PATH[self.server]) as response:
+                        if response.status == 200:
+                            return self
+                except aiohttp.ClientError:
+                    pass
+                await asyncio.sleep(0.2)
+        raise TimeoutError(f"{self.server} server did not start in {self.startup_timeout}s")
+
+    async def __aexit__(self, *exc):
+        self.process.terminate()
+        self.process.join(10)
+        if self.process.is_alive():
+            self.process.kill()
+
+
+async def load(base_url, route, products, concurrency, duration, warmup=1.0, seed=1):
+    """Тримати concurrency одночасних запитів duration секунд, повернути метрики"""
+    template = ROUTES[route]
+    rng = random.Random(seed)
+    latencies = []
+    errors = 0
+    received = 0
+
+    async def worker(session, deadline, record):
+        nonlocal errors, received
+        while time.monotonic() < deadline:
+            path = template.format(id=rng.randint(1, products))
+            started = time.perf_counter()
+            try:
+                async with session.get(base_url + path) as response:
+                    body = await response.read()
+                    ok = response.status == 200
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                ok, body = False, b''
+            elapsed = time.perf_counter() - started
+            if not record:
+                continue
+            if ok:
+                latencies.append(elapsed)
+                received += len(body)
+            else:
+                errors += 1
+
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    timeout = aiohttp.ClientTimeout(total=300)
+    async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+        if warmup:
+            deadline = time.monotonic() + warmup
+            await asyncio.gather(*(worker(session, deadline, False) for _ in range(concurrency)))
+
+        started = time.monotonic()
+        deadline = started + duration
+        await asyncio.gather(*(worker(session, deadline, True) for _ in range(concurrency)))
+        elapsed = time.monotonic() - started
+
+    return {
+        'requests': len(latencies),
+        'errors': errors,
+        'duration_s': round(elapsed, 3),
+        'rps': round(len(latencies) / elapsed, 2),
+        'mb_per_s': round(received / elapsed / 1024 / 1024, 3),
+        'latency_ms': latency_summary(latencies),
+    }
+
+
+async def run(args):
+    results = []
+    for products in args.sizes:
+        started = time.perf_counter()
+        db_file = seeded_db(products, args.data_dir)
+        print(f"📦 {products} products: {db_file} ({time.perf_counter() - started:.1f}s)")
+
+        for server in args.servers:
+            routes = [route for route in args.routes if route in SERVERS[server]]
+            if not routes:
+                continue
+            async with ServerProcess(server, db_file) as process:
+                for route in routes:
+                    for concurrency in args.concurrency:
+                        row = {
+                            'server': server,
+                            'route': ROUTES[route],
+                            'products': products,
+                            'concurrency': concurrency,
+                            **await load(process.base_url, route, products, concurrency,
+                                         args.duration, args.warmup),
+                        }
+                        latency = row['latency_ms']
+                        print(f"   {server:8} {ROUTES[route]:20} c={concurrency:<4} "
+                              f"{row['rps']:>9.1f} req/s  p50={latency['p50']}ms  p95={latency['p95']}ms  "
+                              f"p99={latency['p99']}ms  errors={row['errors']}")
+                        results.append(row)
+    return results
+
+
+def csv_list(cast=str):
+    return lambda value: [cast(item) for item in value.split(',') if item.strip()]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="HTTP load test for the shop API")
+    parser.add_argument('--servers', type=csv_list(), default=list(SERVERS), help="aiohttp,flask")
+    parser.add_argument('--sizes', type=csv_list(int), default=[10, 1000, 10000, 100000],
+                        help="catalog sizes (products)")
+    parser.add_argument('--routes', type=csv_list(), default=list(ROUTES), help=','.join(ROUTES))
+    parser.add_argument('--concurrency', type=csv_list(int), default=[1, 10, 50])
+    parser.add_argument('--duration', type=float, default=5.0, help="seconds per case")
+    parser.add_argument('--warmup', type=float, default=1.0, help="seconds of warm-up per case")
+    parser.add_argument('--data-dir', default=DATA_DIR, help="where seeded SQLite files are kept")
+    parser.add_argument('--output', default=os.path.join(DATA_DIR, 'http_load.json'), help="JSON report ('-' = stdout)")
+    parser.add_argument('--baseline', help="previous JSON report to compare against")
+    parser.add_argument('--threshold', type=float, default=0.2, help="allowed regression (0.2 = 20%%)")
+    args = parser.parse_args()
+
+    unknown = set(args.servers) - set(SERVERS) or set(args.routes) - set(ROUTES)
+    if unknown:
+        parser.error(f"unknown: {', '.join(sorted(unknown))}")
+
+    os.makedirs(args.data_dir, exist_ok=True)
+    results = asyncio.run(run(args))
+    write_report(args.output, 'http_load', results, config={
+        'duration_s': args.duration, 'warmup_s': args.warmup,
+    })
+
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+        regressions = compare_reports(results, baseline, ('server', 'route', 'products', 'concurrency'),
+                                      {'rps': 'higher', 'latency_ms.p95': 'lower'}, args.threshold)
+        print_regressions(regressions, args.threshold)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
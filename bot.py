@@ -1,14 +1,20 @@
 import os
+import re
+import hmac
 import json
+import time
 import logging
+import tempfile
 from datetime import datetime
+from html import escape
 from aiohttp import web
 from dotenv import load_dotenv
 from aiogram import Bot, Dispatcher, types, F
-from aiogram.filters import Command
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.filters import Command, CommandObject
 from aiogram.types import (
     InlineKeyboardMarkup, InlineKeyboardButton, WebAppInfo,
-    ReplyKeyboardMarkup, KeyboardButton
+    ReplyKeyboardMarkup, KeyboardButton, FSInputFile
 )
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
@@ -16,9 +22,19 @@ from aiogram.fsm.storage.memory import MemoryStorage
 from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
 import asyncio
 
+import metrics
+from middlewares import setup_throttling, setup_timing
+from pricing import price_cart
+from catalog import parse_sizes
+from exports import EXPORT_FORMATS, parse_export_range, write_order_export
+from catalog_import import MAX_IMPORT_BYTES, detect_format, import_products
 from database import (
-    init_db, get_all_products, get_product, add_product,
-    delete_product, add_order, get_recent_orders, save_user
+    init_db, get_product, get_products_page, search_products, add_product,
+    delete_product, add_order, get_recent_orders, save_user,
+    get_order, get_orders_by_status, update_order_status, ORDER_TRANSITIONS,
+    get_sales_stats, rebuild_sales_rollups, get_user_orders,
+    get_stock, set_stock, reserve_stock, release_reservations,
+    confirm_reservations, release_expired_reservations, archive_orders, ORDER_ARCHIVE_DAYS
 )
 
 # =======================
@@ -27,6 +43,8 @@ from database import (
 load_dotenv()
 logging.basicConfig(level=logging.INFO)
 
+PROCESS_STARTED = time.perf_counter()
+
 BOT_TOKEN = os.getenv("BOT_TOKEN")
 WEBHOOK_URL = os.getenv("WEBHOOK_URL")  # https://driphype-api.onrender.com
 WEBAPP_URL = os.getenv("WEBAPP_URL")
@@ -45,6 +63,13 @@ ORDERS_GROUP_ID = os.getenv("ORDERS_GROUP_ID", "")  # ID групи для за
 bot = Bot(BOT_TOKEN)
 storage = MemoryStorage()
 dp = Dispatcher(storage=storage)
+# Throttling реєструємо першим - відкинуті апдейти не потрапляють в час хендлерів
+setup_throttling(dp)
+setup_timing(dp, bot)
+
+# Ліміти для окремих хендлерів (токенів за секунду / розмір пачки)
+START_RATE_LIMIT = {"rate": 0.2, "burst": 2}
+ADMIN_RATE_LIMIT = {"rate": 1, "burst": 3}
 
 # =======================
 # FSM
@@ -70,6 +95,15 @@ class OrderCheckout(StatesGroup):
 def is_admin(user_id: int) -> bool:
     return user_id == ADMIN_ID
 
+# Токен для адмінських endpoint'ів (Authorization: Bearer <token>); без нього вони вимкнені
+ADMIN_API_TOKEN = os.getenv('ADMIN_API_TOKEN', '')
+
+def is_admin_request(request):
+    """Перевірка адмінського токена з заголовка Authorization"""
+    header = request.headers.get('Authorization', '')
+    token = header[len('Bearer '):] if header.startswith('Bearer ') else ''
+    return bool(ADMIN_API_TOKEN) and hmac.compare_digest(token, ADMIN_API_TOKEN)
+
 # =======================
 # KEYBOARDS
 # =======================
@@ -77,7 +111,7 @@ def get_main_keyboard(is_admin_user: bool = False):
     """Постійна клавіатура внизу екрану"""
     keyboard = [
         [KeyboardButton(text="🛍️ Магазин", web_app=WebAppInfo(url=WEBAPP_URL))],
-        [KeyboardButton(text="ℹ️ Інформація")]
+        [KeyboardButton(text="📦 Мої замовлення"), KeyboardButton(text="ℹ️ Інформація")]
     ]
     
     if is_admin_user:
@@ -102,6 +136,36 @@ def get_admin_keyboard():
         ]
     ])
 
+# Статуси замовлень і кнопки переходів для адміна
+ORDER_STATUS_LABELS = {
+    "pending": "🕓 Очікує",
+    "paid": "💰 Оплачено",
+    "shipped": "🚚 Відправлено",
+    "done": "✅ Виконано",
+    "cancelled": "❌ Скасовано",
+}
+
+ORDER_ACTION_LABELS = {
+    "paid": "💰 Оплачено",
+    "shipped": "🚚 Відправити",
+    "done": "✅ Виконано",
+    "cancelled": "❌ Скасувати",
+}
+
+def get_order_status_keyboard(order_id, status):
+    """Поточний статус + кнопки дозволених переходів: ost:<id>:<з>:<в>"""
+    keyboard = [[InlineKeyboardButton(
+        text=f"Статус: {ORDER_STATUS_LABELS.get(status, status)}",
+        callback_data=f"ost:{order_id}"
+    )]]
+    actions = [
+        InlineKeyboardButton(text=ORDER_ACTION_LABELS[to_status], callback_data=f"ost:{order_id}:{status}:{to_status}")
+        for to_status in ORDER_TRANSITIONS.get(status, ())
+    ]
+    if actions:
+        keyboard.append(actions)
+    return InlineKeyboardMarkup(inline_keyboard=keyboard)
+
 def get_category_keyboard():
     """Вибір категорії товару"""
     return InlineKeyboardMarkup(inline_keyboard=[
@@ -147,7 +211,7 @@ def get_payment_method_keyboard():
 # =======================
 # START & MAIN MENU
 # =======================
-@dp.message(Command("start"))
+@dp.message(Command("start"), flags={"rate_limit": START_RATE_LIMIT})
 async def cmd_start(message: types.Message):
     user_id = message.from_user.id
     save_user(
@@ -338,6 +402,7 @@ async def add_product_type(callback: types.CallbackQuery, state: FSMContext):
 @dp.message(AddProduct.sizes)
 async def finish_product(message: types.Message, state: FSMContext):
     data = await state.get_data()
+    sizes = ", ".join(parse_sizes(message.text))
     
     try:
         product_id = add_product(
@@ -347,7 +412,7 @@ async def finish_product(message: types.Message, state: FSMContext):
             data["image_url"], 
             data["category"], 
             data.get("product_type", "одяг"),  # Використовуємо збережений тип
-            message.text
+            sizes
         )
         
         success_text = (
@@ -357,7 +422,7 @@ async def finish_product(message: types.Message, state: FSMContext):
             f"💰 Ціна: {data['price']} грн\n"
             f"📁 Категорія: {data['category']}\n"
             f"🏷️ Тип: {data.get('product_type', 'одяг')}\n"
-            f"📏 Розміри: {message.text}"
+            f"📏 Розміри: {sizes}"
         )
         
         await message.answer(success_text, parse_mode="HTML")
@@ -384,27 +449,67 @@ async def cancel_add_product(callback: types.CallbackQuery, state: FSMContext):
 # =======================
 # WEB APP ORDERS
 # =======================
-@dp.message(F.content_type == types.ContentType.WEB_APP_DATA)
+@dp.message(F.content_type == types.ContentType.WEB_APP_DATA, flags={"rate_limit": False})
 async def web_app_data(message: types.Message, state: FSMContext):
     try:
         data = json.loads(message.web_app_data.data)
         
+        # Ціни і сума від клієнта не довіряємо - перераховуємо за каталогом
+        pricing = price_cart(data["products"], data.get("total"))
+        
+        if not pricing["items"]:
+            await message.answer(
+                "❌ <b>Товари з кошика більше недоступні</b>\n\n"
+                "Оновіть магазин і спробуйте ще раз",
+                parse_mode="HTML"
+            )
+            return
+        
+        # Резервуємо розміри на час оформлення (попередній резерв користувача знімаємо)
+        previous = await state.get_data()
+        release_reservations(previous.get("reservation_ids", []))
+        reservation_ids, unavailable = reserve_stock(
+            message.from_user.id,
+            [(item["id"], item.get("size", ""), item["quantity"]) for item in pricing["items"]]
+        )
+        
+        if unavailable:
+            await state.update_data(reservation_ids=[])
+            names = {item["id"]: item["name"] for item in pricing["items"]}
+            sold_out = "".join(
+                f"• {names.get(product_id, 'Товар')} (Розмір: {size})\n"
+                for product_id, size in unavailable
+            )
+            await message.answer(
+                "❌ <b>Немає в наявності:</b>\n\n"
+                f"{sold_out}\n"
+                "Оберіть інший розмір у магазині",
+                parse_mode="HTML"
+            )
+            return
+        
         # Зберігаємо дані замовлення в FSM
         await state.update_data(
-            products=data["products"],
-            total=data["total"],
+            products=pricing["items"],
+            total=pricing["total"],
+            reservation_ids=reservation_ids,
             user_id=message.from_user.id,
             username=message.from_user.username
         )
         
         # Формуємо деталі замовлення
         order_details = "🛒 <b>Ваше замовлення:</b>\n\n"
-        for item in data["products"]:
+        for item in pricing["items"]:
             order_details += f"• {item.get('name', 'Товар')}\n"
             order_details += f"  Розмір: {item.get('size', 'N/A')} | Кількість: {item.get('quantity', 1)}\n"
             order_details += f"  Ціна: {item.get('price', 0)} грн\n\n"
         
-        order_details += f"💰 <b>Загальна сума:</b> {data['total']} грн\n\n"
+        if pricing["removed"]:
+            order_details += "⚠️ <i>Деякі товари більше недоступні і прибрані з замовлення</i>\n"
+        elif pricing["corrected"]:
+            order_details += "💡 <i>Ціни оновлено за актуальним каталогом</i>\n"
+        
+        order_details += f"💰 <b>Загальна сума:</b> {pricing['total']} грн\n\n"
         order_details += "Оберіть спосіб оплати:"
         
         # Переходимо до вибору оплати
@@ -516,7 +621,7 @@ async def process_pre_checkout_query(pre_checkout_query: types.PreCheckoutQuery)
     """Обробка pre-checkout запиту"""
     await bot.answer_pre_checkout_query(pre_checkout_query.id, ok=True)
 
-@dp.message(F.successful_payment)
+@dp.message(F.successful_payment, flags={"rate_limit": False})
 async def process_successful_payment(message: types.Message, state: FSMContext):
     """Обробка успішної оплати через Telegram Payment"""
     data = await state.get_data()
@@ -526,8 +631,11 @@ async def process_successful_payment(message: types.Message, state: FSMContext):
         message.from_user.id,
         message.from_user.username,
         json.dumps(data.get('products', [])),
-        message.successful_payment.total_amount / 100
+        message.successful_payment.total_amount / 100,
+        status='paid',
+        payment_method='telegram'
     )
+    confirm_reservations(data.get('reservation_ids', []), order_id)
     
     success_message = (
         "✅ <b>Оплата успішна!</b>\n\n"
@@ -548,7 +656,11 @@ async def process_successful_payment(message: types.Message, state: FSMContext):
             f"💳 Telegram Payment\n"
         )
         try:
-            await bot.send_message(ADMIN_ID, admin_msg, parse_mode="HTML")
+            await bot.send_message(
+                ADMIN_ID, admin_msg,
+                reply_markup=get_order_status_keyboard(order_id, "paid"),
+                parse_mode="HTML"
+            )
         except:
             pass
     
@@ -590,9 +702,14 @@ async def process_contact_info(message: types.Message, state: FSMContext):
             data['user_id'],
             data.get('username'),
             json.dumps(data['products']),
-            data['total']
+            data['total'],
+            payment_method=payment_method
         )
         
+        # Резерв стає списанням; якщо він встиг закінчитись - попереджаємо адміна
+        reservation_ids = data.get('reservation_ids', [])
+        stock_confirmed = confirm_reservations(reservation_ids, order_id) == len(reservation_ids)
+        
         # Відправляємо підтвердження користувачу
         await message.answer(
             summary,
@@ -613,6 +730,9 @@ async def process_contact_info(message: types.Message, state: FSMContext):
         else:
             admin_notification += "💵 Оплата: При отриманні\n\n"
         
+        if not stock_confirmed:
+            admin_notification += "⚠️ Резерв товару закінчився - перевірте наявність\n\n"
+        
         admin_notification += f"📞 <b>Контактні дані:</b>\n{message.text}\n\n"
         admin_notification += "📦 <b>Товари:</b>\n"
         
@@ -622,7 +742,11 @@ async def process_contact_info(message: types.Message, state: FSMContext):
         # Відправляємо адміну особисто
         if ADMIN_ID:
             try:
-                await bot.send_message(ADMIN_ID, admin_notification, parse_mode="HTML")
+                await bot.send_message(
+                    ADMIN_ID, admin_notification,
+                    reply_markup=get_order_status_keyboard(order_id, "pending"),
+                    parse_mode="HTML"
+                )
                 
                 # Пересилаємо всі фото/документи які надіслав клієнт
                 if message.photo:
@@ -645,7 +769,11 @@ async def process_contact_info(message: types.Message, state: FSMContext):
         if ORDERS_GROUP_ID:
             try:
                 group_id = int(ORDERS_GROUP_ID)
-                await bot.send_message(group_id, admin_notification, parse_mode="HTML")
+                await bot.send_message(
+                    group_id, admin_notification,
+                    reply_markup=get_order_status_keyboard(order_id, "pending"),
+                    parse_mode="HTML"
+                )
                 
                 if message.photo:
                     await bot.send_photo(
@@ -674,6 +802,8 @@ async def process_contact_info(message: types.Message, state: FSMContext):
 
 @dp.callback_query(F.data == "cancel_order")
 async def cancel_order(callback: types.CallbackQuery, state: FSMContext):
+    data = await state.get_data()
+    release_reservations(data.get("reservation_ids", []))
     await state.clear()
     await callback.message.edit_text(
         "❌ <b>Замовлення скасовано</b>\n\n"
@@ -685,118 +815,143 @@ async def cancel_order(callback: types.CallbackQuery, state: FSMContext):
 # =======================
 # LIST PRODUCTS
 # =======================
-@dp.callback_query(F.data == "list_products")
+PRODUCTS_PAGE_SIZE = 10
+
+def build_products_page_callback(mode, direction, cursor, category, product_type):
+    """callback_data для сторінки каталогу: pp:<режим>:<напрям>:<курсор>:<категорія>:<тип>"""
+    return f"pp:{mode}:{direction}:{cursor}:{category or ''}:{product_type or ''}"
+
+def get_products_filter_row(mode, category, product_type):
+    """Кнопки фільтрів за категорією та типом"""
+    def button(text, cat, ptype):
+        active = cat == category and ptype == product_type
+        return InlineKeyboardButton(
+            text=f"• {text}" if active else text,
+            callback_data=build_products_page_callback(mode, "n", 0, cat, ptype)
+        )
+
+    return [
+        [
+            button("Всі", None, None),
+            button("👨", "чоловіче", product_type),
+            button("👩", "жіноче", product_type)
+        ],
+        [
+            button("👕 Одяг", category, "одяг"),
+            button("👟 Взуття", category, "взуття")
+        ]
+    ]
+
+async def show_products_page(callback: types.CallbackQuery, mode="l", direction="n", cursor=0,
+                             category=None, product_type=None):
+    """Показати сторінку товарів (mode: l - перегляд, d - видалення)"""
+    before_id = cursor if direction == "n" and cursor else None
+    after_id = cursor if direction == "p" and cursor else None
+
+    products, has_more = get_products_page(
+        PRODUCTS_PAGE_SIZE, before_id=before_id, after_id=after_id,
+        category=category, product_type=product_type
+    )
+
+    # Сторінка могла спорожніти після видалення - повертаємось на першу
+    if not products and cursor:
+        return await show_products_page(callback, mode, category=category, product_type=product_type)
+
+    if direction == "p":
+        has_prev, has_next = has_more, True
+    else:
+        has_prev, has_next = bool(cursor), has_more
+
+    keyboard_buttons = get_products_filter_row(mode, category, product_type)
+
+    if mode == "d":
+        title = "🗑️ <b>Видалення товару</b>\n\n"
+        if products:
+            products_text = title + "Оберіть товар для видалення:"
+        else:
+            products_text = title + "📦 Немає товарів для видалення"
+        for p in products:
+            product_type_emoji = "👟" if p.get('product_type') == "взуття" else "👕"
+            keyboard_buttons.append([
+                InlineKeyboardButton(
+                    text=f"{product_type_emoji} {p.get('name', 'N/A')} (#{p['id']})",
+                    callback_data=f"delete_{p['id']}"
+                )
+            ])
+    else:
+        products_text = "📦 <b>Список товарів:</b>\n\n"
+        if not products:
+            products_text = "📦 <b>Список товарів порожній</b>"
+        for p in products:
+            product_type_emoji = "👟" if p.get('product_type') == "взуття" else "👕"
+            products_text += (
+                f"{product_type_emoji} <b>{p.get('name', 'N/A')}</b>\n"
+                f"🆔 ID: #{p['id']} | 💰 {p.get('price', 0)} грн\n"
+                f"📁 {p.get('category', 'N/A')} | 📏 {p.get('sizes', 'N/A')}\n\n"
+            )
+
+    nav_row = []
+    if has_prev and products:
+        nav_row.append(InlineKeyboardButton(
+            text="⬅️ Попередні",
+            callback_data=build_products_page_callback(mode, "p", products[0]['id'], category, product_type)
+        ))
+    if has_next and products:
+        nav_row.append(InlineKeyboardButton(
+            text="Наступні ➡️",
+            callback_data=build_products_page_callback(mode, "n", products[-1]['id'], category, product_type)
+        ))
+    if nav_row:
+        keyboard_buttons.append(nav_row)
+
+    keyboard_buttons.append([InlineKeyboardButton(text="🔙 Назад", callback_data="admin")])
+
+    await callback.message.edit_text(
+        products_text,
+        reply_markup=InlineKeyboardMarkup(inline_keyboard=keyboard_buttons),
+        parse_mode="HTML"
+    )
+    await callback.answer()
+
+@dp.callback_query(F.data == "list_products", flags={"rate_limit": ADMIN_RATE_LIMIT})
 async def list_products_handler(callback: types.CallbackQuery):
     if not is_admin(callback.from_user.id):
         return await callback.answer("❌ Немає доступу", show_alert=True)
     
     try:
-        products = get_all_products()
-        
-        if not products:
-            await callback.message.edit_text(
-                "📦 <b>Список товарів порожній</b>",
-                reply_markup=get_admin_keyboard(),
-                parse_mode="HTML"
-            )
-            return await callback.answer()
-        
-        products_text = "📦 <b>Список товарів:</b>\n\n"
-        for p in products[:15]:  # Показуємо перші 15
-            # Перевіряємо чи це словник чи кортеж
-            if isinstance(p, dict):
-                product_id = p.get('id', 'N/A')
-                name = p.get('name', 'N/A')
-                price = p.get('price', 0)
-                category = p.get('category', 'N/A')
-                product_type = p.get('product_type', 'одяг')
-                sizes = p.get('sizes', 'N/A')
-            else:
-                product_id = p[0] if len(p) > 0 else 'N/A'
-                name = p[1] if len(p) > 1 else 'N/A'
-                price = p[3] if len(p) > 3 else 0
-                category = p[5] if len(p) > 5 else 'N/A'
-                product_type = p[6] if len(p) > 6 else 'одяг'
-                sizes = p[7] if len(p) > 7 else 'N/A'
-            
-            product_type_emoji = "👟" if product_type == "взуття" else "👕"
-            products_text += (
-                f"{product_type_emoji} <b>{name}</b>\n"
-                f"🆔 ID: #{product_id} | 💰 {price} грн\n"
-                f"📁 {category} | 📏 {sizes}\n\n"
-            )
-        
-        if len(products) > 15:
-            products_text += f"\n<i>... та ще {len(products) - 15} товарів</i>"
-        
-        back_keyboard = InlineKeyboardMarkup(inline_keyboard=[
-            [InlineKeyboardButton(text="🔙 Назад", callback_data="admin")]
-        ])
-        
-        await callback.message.edit_text(
-            products_text,
-            reply_markup=back_keyboard,
-            parse_mode="HTML"
+        await show_products_page(callback, mode="l")
+    except Exception as e:
+        logging.error(f"Error listing products: {e}")
+        await callback.answer("❌ Помилка при завантаженні товарів", show_alert=True)
+
+@dp.callback_query(F.data.startswith("pp:"), flags={"rate_limit": ADMIN_RATE_LIMIT})
+async def products_page_handler(callback: types.CallbackQuery):
+    if not is_admin(callback.from_user.id):
+        return await callback.answer("❌ Немає доступу", show_alert=True)
+    
+    try:
+        _, mode, direction, cursor, category, product_type = callback.data.split(":")
+        await show_products_page(
+            callback, mode, direction, int(cursor),
+            category or None, product_type or None
         )
+    except TelegramBadRequest:
+        # Той самий фільтр натиснули ще раз - текст не змінився
         await callback.answer()
     except Exception as e:
-        logging.error(f"Error listing products: {e}")
+        logging.error(f"Error paging products: {e}")
         await callback.answer("❌ Помилка при завантаженні товарів", show_alert=True)
 
 # =======================
 # DELETE PRODUCT
 # =======================
-@dp.callback_query(F.data == "delete_product_menu")
+@dp.callback_query(F.data == "delete_product_menu", flags={"rate_limit": ADMIN_RATE_LIMIT})
 async def delete_product_menu_handler(callback: types.CallbackQuery):
     if not is_admin(callback.from_user.id):
         return await callback.answer("❌ Немає доступу", show_alert=True)
     
     try:
-        products = get_all_products()
-        
-        if not products:
-            await callback.message.edit_text(
-                "📦 <b>Немає товарів для видалення</b>",
-                reply_markup=get_admin_keyboard(),
-                parse_mode="HTML"
-            )
-            return await callback.answer()
-        
-        # Створюємо кнопки для кожного товару
-        keyboard_buttons = []
-        for p in products[:20]:  # Показуємо до 20 товарів
-            if isinstance(p, dict):
-                product_id = p.get('id', 0)
-                name = p.get('name', 'N/A')
-                product_type = p.get('product_type', 'одяг')
-            else:
-                product_id = p[0] if len(p) > 0 else 0
-                name = p[1] if len(p) > 1 else 'N/A'
-                product_type = p[6] if len(p) > 6 else 'одяг'
-            
-            product_type_emoji = "👟" if product_type == "взуття" else "👕"
-            button_text = f"{product_type_emoji} {name} (#{product_id})"
-            keyboard_buttons.append([
-                InlineKeyboardButton(
-                    text=button_text,
-                    callback_data=f"delete_{product_id}"
-                )
-            ])
-        
-        # Додаємо кнопку назад
-        keyboard_buttons.append([
-            InlineKeyboardButton(text="🔙 Назад", callback_data="admin")
-        ])
-        
-        delete_keyboard = InlineKeyboardMarkup(inline_keyboard=keyboard_buttons)
-        
-        await callback.message.edit_text(
-            "🗑️ <b>Видалення товару</b>\n\n"
-            "Оберіть товар для видалення:",
-            reply_markup=delete_keyboard,
-            parse_mode="HTML"
-        )
-        await callback.answer()
+        await show_products_page(callback, mode="d")
     except Exception as e:
         logging.error(f"Error showing delete menu: {e}")
         await callback.answer("❌ Помилка при завантаженні", show_alert=True)
@@ -877,55 +1032,479 @@ async def delete_product_confirmed(callback: types.CallbackQuery):
 # =======================
 # LIST ORDERS
 # =======================
-@dp.callback_query(F.data == "list_orders")
+def get_orders_filter_keyboard(status=None):
+    """Фільтр черги замовлень за статусом: orders:<статус>"""
+    buttons = [
+        InlineKeyboardButton(
+            text=("• " if code == status else "") + label,
+            callback_data=f"orders:{code}"
+        )
+        for code, label in ORDER_STATUS_LABELS.items()
+    ]
+    return InlineKeyboardMarkup(inline_keyboard=[
+        buttons[:3],
+        buttons[3:],
+        [InlineKeyboardButton(text="📊 Всі останні", callback_data="list_orders")],
+        [InlineKeyboardButton(text="🔙 Назад", callback_data="admin")]
+    ])
+
+async def show_orders(callback: types.CallbackQuery, status=None):
+    """Останні замовлення (всі або в одному статусі)"""
+    if status:
+        orders = get_orders_by_status(status, 10)
+        title = f"📊 <b>Замовлення: {ORDER_STATUS_LABELS[status]}</b>"
+    else:
+        orders = get_recent_orders(10)
+        title = "📊 <b>Останні замовлення:</b>"
+    
+    if not orders:
+        orders_text = f"{title}\n\nЗамовлень немає"
+    else:
+        orders_text = f"{title}\n\n"
+        for o in orders:
+            orders_text += (
+                f"🆔 #{o['id']} | @{o.get('username') or 'Unknown'}\n"
+                f"💰 {o.get('total_price', 0)} грн | {ORDER_STATUS_LABELS.get(o.get('status'), o.get('status'))}\n"
+                f"📅 {o.get('created_at', 'N/A')}\n\n"
+            )
+    
+    await callback.message.edit_text(
+        orders_text,
+        reply_markup=get_orders_filter_keyboard(status),
+        parse_mode="HTML"
+    )
+
+@dp.callback_query(F.data == "list_orders", flags={"rate_limit": ADMIN_RATE_LIMIT})
 async def list_orders_handler(callback: types.CallbackQuery):
     if not is_admin(callback.from_user.id):
         return await callback.answer("❌ Немає доступу", show_alert=True)
     
     try:
-        orders = get_recent_orders(10)
+        await show_orders(callback)
+        await callback.answer()
+    except Exception as e:
+        logging.error(f"Error listing orders: {e}")
+        await callback.answer("❌ Помилка при завантаженні замовлень", show_alert=True)
+
+@dp.callback_query(F.data.startswith("orders:"), flags={"rate_limit": ADMIN_RATE_LIMIT})
+async def orders_by_status_handler(callback: types.CallbackQuery):
+    if not is_admin(callback.from_user.id):
+        return await callback.answer("❌ Немає доступу", show_alert=True)
+    
+    status = callback.data.split(":", 1)[1]
+    if status not in ORDER_STATUS_LABELS:
+        return await callback.answer()
+    
+    try:
+        await show_orders(callback, status)
+        await callback.answer()
+    except TelegramBadRequest:
+        # Той самий фільтр натиснули ще раз - текст не змінився
+        await callback.answer()
+    except Exception as e:
+        logging.error(f"Error listing orders: {e}")
+        await callback.answer("❌ Помилка при завантаженні замовлень", show_alert=True)
+
+# =======================
+# ORDER STATUS
+# =======================
+# Повідомлення клієнту при зміні статусу
+ORDER_STATUS_CUSTOMER_MESSAGES = {
+    "paid": "💰 Оплату замовлення #{order_id} підтверджено!",
+    "shipped": "🚚 Замовлення #{order_id} відправлено!",
+    "done": "✅ Замовлення #{order_id} виконано. Дякуємо за покупку!",
+    "cancelled": "❌ Замовлення #{order_id} скасовано. Якщо це помилка - зв'яжіться з підтримкою.",
+}
+
+@dp.callback_query(F.data.startswith("ost:"), flags={"rate_limit": ADMIN_RATE_LIMIT})
+async def order_status_handler(callback: types.CallbackQuery):
+    """ost:<id> - оновити кнопки, ost:<id>:<з>:<в> - змінити статус"""
+    if not is_admin(callback.from_user.id):
+        return await callback.answer("❌ Немає доступу", show_alert=True)
+    
+    parts = callback.data.split(":")
+    try:
+        order_id = int(parts[1])
+    except (IndexError, ValueError):
+        return await callback.answer("❌ Невірні дані", show_alert=True)
+    
+    try:
+        changed = False
+        if len(parts) == 4:
+            from_status, to_status = parts[2], parts[3]
+            # Compare-and-set: якщо статус вже змінив хтось інший, UPDATE нічого не зачепить
+            changed = update_order_status(order_id, from_status, to_status)
         
-        if not orders:
-            await callback.message.edit_text(
-                "📊 <b>Замовлень поки немає</b>",
-                reply_markup=get_admin_keyboard(),
-                parse_mode="HTML"
-            )
-            return await callback.answer()
+        order = get_order(order_id)
+        if order is None:
+            return await callback.answer("❌ Замовлення не знайдено", show_alert=True)
         
-        orders_text = "📊 <b>Останні замовлення:</b>\n\n"
-        for o in orders:
-            # Перевіряємо чи це словник чи кортеж
-            if isinstance(o, dict):
-                order_id = o.get('id', 'N/A')
-                username = o.get('username', 'Unknown')
-                total = o.get('total', 0)
-                created_at = o.get('created_at', 'N/A')
-            else:
-                order_id = o[0] if len(o) > 0 else 'N/A'
-                username = o[2] if len(o) > 2 else 'Unknown'
-                total = o[4] if len(o) > 4 else 0
-                created_at = o[5] if len(o) > 5 else 'N/A'
-            
-            orders_text += (
-                f"🆔 #{order_id} | @{username or 'Unknown'}\n"
-                f"💰 {total} грн\n"
-                f"📅 {created_at}\n\n"
+        status = order['status']
+        try:
+            await callback.message.edit_reply_markup(reply_markup=get_order_status_keyboard(order_id, status))
+        except TelegramBadRequest:
+            pass  # Кнопки вже актуальні
+        
+        if len(parts) == 4 and not changed:
+            return await callback.answer(
+                f"⚠️ Статус вже змінено: {ORDER_STATUS_LABELS.get(status, status)}",
+                show_alert=True
             )
         
-        back_keyboard = InlineKeyboardMarkup(inline_keyboard=[
-            [InlineKeyboardButton(text="🔙 Назад", callback_data="admin")]
-        ])
+        await callback.answer(f"Статус: {ORDER_STATUS_LABELS.get(status, status)}")
         
-        await callback.message.edit_text(
-            orders_text,
-            reply_markup=back_keyboard,
+        if changed and status in ORDER_STATUS_CUSTOMER_MESSAGES:
+            try:
+                await bot.send_message(
+                    order['user_id'],
+                    ORDER_STATUS_CUSTOMER_MESSAGES[status].format(order_id=order_id)
+                )
+            except Exception as e:
+                logging.error(f"Failed to notify customer about order {order_id}: {e}")
+    except Exception as e:
+        logging.error(f"Error updating order status: {e}")
+        await callback.answer("❌ Помилка при зміні статусу", show_alert=True)
+
+# =======================
+# MY ORDERS
+# =======================
+MY_ORDERS_PAGE_SIZE = 5
+
+def format_user_order(order):
+    """Одне замовлення в історії клієнта"""
+    try:
+        items = json.loads(order["products"])
+    except (TypeError, ValueError):
+        items = []
+    
+    lines = [
+        f"🆔 <b>#{order['id']}</b> | {ORDER_STATUS_LABELS.get(order['status'], order['status'])}",
+        f"📅 {str(order['created_at'])[:16]} | 💰 {order['total_price']} грн",
+    ]
+    for item in items[:5]:
+        lines.append(f"• {escape(str(item.get('name', 'Товар')))} ({escape(str(item.get('size', 'N/A')))})")
+    if len(items) > 5:
+        lines.append(f"• ... і ще {len(items) - 5}")
+    return "\n".join(lines)
+
+async def show_user_orders(user_id, before_id=None):
+    """Текст і клавіатура сторінки історії замовлень"""
+    orders, has_more = await asyncio.to_thread(get_user_orders, user_id, MY_ORDERS_PAGE_SIZE, before_id)
+    
+    if not orders:
+        text = "📦 <b>Замовлень поки немає</b>\n\nВідкрийте магазин, щоб зробити перше замовлення!"
+        return text, None
+    
+    text = "📦 <b>Ваші замовлення</b>\n\n" + "\n\n".join(format_user_order(o) for o in orders)
+    buttons = []
+    if before_id is not None:
+        buttons.append(InlineKeyboardButton(text="⏮️ Найновіші", callback_data="myo:"))
+    if has_more:
+        buttons.append(InlineKeyboardButton(text="Старіші ➡️", callback_data=f"myo:{orders[-1]['id']}"))
+    return text, InlineKeyboardMarkup(inline_keyboard=[buttons]) if buttons else None
+
+@dp.message(Command("orders"))
+@dp.message(F.text == "📦 Мої замовлення")
+async def my_orders(message: types.Message):
+    text, keyboard = await show_user_orders(message.from_user.id)
+    await message.answer(text, reply_markup=keyboard, parse_mode="HTML")
+
+@dp.callback_query(F.data.startswith("myo:"))
+async def my_orders_page(callback: types.CallbackQuery):
+    cursor = callback.data.split(":", 1)[1]
+    before_id = int(cursor) if cursor.isdigit() else None
+    text, keyboard = await show_user_orders(callback.from_user.id, before_id)
+    try:
+        await callback.message.edit_text(text, reply_markup=keyboard, parse_mode="HTML")
+    except TelegramBadRequest:
+        pass  # Сторінка не змінилась
+    await callback.answer()
+
+# =======================
+# STOCK
+# =======================
+@dp.message(Command("stock"), flags={"rate_limit": ADMIN_RATE_LIMIT})
+async def stock_command(message: types.Message, command: CommandObject):
+    """/stock <id> - переглянути залишки, /stock <id> S=5 M=3 - встановити"""
+    if not is_admin(message.from_user.id):
+        return await message.answer("❌ Доступ заборонено")
+    
+    args = [arg for arg in re.split(r"[\s,]+", command.args or "") if arg]
+    if not args or not args[0].isdigit():
+        return await message.answer(
+            "📦 <b>Залишки</b>\n\n"
+            "<code>/stock 12</code> - переглянути\n"
+            "<code>/stock 12 S=5 M=3 L=0</code> - встановити",
             parse_mode="HTML"
         )
-        await callback.answer()
+    
+    product_id = int(args[0])
+    try:
+        for pair in args[1:]:
+            size, _, qty = pair.partition("=")
+            set_stock(product_id, size, max(0, int(qty)))
+    except ValueError:
+        return await message.answer("❌ Формат: <code>РОЗМІР=КІЛЬКІСТЬ</code>", parse_mode="HTML")
+    
+    sizes = get_stock(product_id).get(product_id, {})
+    stock_text = "\n".join(f"📏 {size}: {qty} шт." for size, qty in sizes.items()) or "Залишки не задано (без обмежень)"
+    await message.answer(f"📦 <b>Залишки товару #{product_id}</b>\n\n{stock_text}", parse_mode="HTML")
+
+# =======================
+# STATS
+# =======================
+PAYMENT_METHOD_LABELS = {
+    "card": "💳 Карта",
+    "crypto": "🌐 Crypto",
+    "cash": "💵 При отриманні",
+    "telegram": "💳 Telegram Payment",
+}
+
+@dp.message(Command("stats"), flags={"rate_limit": ADMIN_RATE_LIMIT})
+async def stats_command(message: types.Message, command: CommandObject):
+    """/stats [днів] - продажі з денних зведень (orders не сканується)"""
+    if not is_admin(message.from_user.id):
+        return await message.answer("❌ Доступ заборонено")
+    
+    days = int(command.args) if command.args and command.args.strip().isdigit() else 7
+    days = max(1, min(days, 365))
+    stats = await asyncio.to_thread(get_sales_stats, days)
+    totals = stats["totals"]
+    
+    stats_text = (
+        f"📈 <b>Продажі за {days} дн.</b> (з {stats['since']})\n\n"
+        f"🛒 Замовлень: {totals['orders']}\n"
+        f"📦 Одиниць: {totals['units']}\n"
+        f"💰 Виручка: {totals['revenue']} грн\n"
+    )
+    
+    if stats["daily"]:
+        today = stats["daily"][-1]
+        stats_text += f"📅 Останній день ({today['day']}): {today['orders']} зам. / {today['revenue']} грн\n"
+    
+    if stats["top_products"]:
+        stats_text += "\n🏆 <b>Топ товарів:</b>\n"
+        for row in stats["top_products"]:
+            name = escape(row["name"] or f"#{row['product_id']}")
+            stats_text += f"• {name}: {row['units']} шт. / {row['revenue']} грн\n"
+    
+    if stats["categories"]:
+        stats_text += "\n🗂 <b>Категорії:</b>\n"
+        for row in stats["categories"]:
+            stats_text += f"• {escape(row['category'] or 'без категорії')}: {row['units']} шт. / {row['revenue']} грн\n"
+    
+    if stats["sizes"]:
+        stats_text += "\n📏 <b>Розміри:</b> " + ", ".join(
+            f"{escape(row['size'] or '-')}: {row['units']}" for row in stats["sizes"]
+        ) + "\n"
+    
+    if stats["payments"]:
+        stats_text += "\n💳 <b>Оплата:</b>\n"
+        for row in stats["payments"]:
+            label = PAYMENT_METHOD_LABELS.get(row["payment_method"], row["payment_method"])
+            stats_text += f"• {label}: {row['orders']} зам. / {row['revenue']} грн\n"
+    
+    await message.answer(stats_text, parse_mode="HTML")
+
+@dp.message(Command("rebuild_stats"), flags={"rate_limit": ADMIN_RATE_LIMIT})
+async def rebuild_stats_command(message: types.Message):
+    """Перерахувати зведення з таблиці замовлень (backfill)"""
+    if not is_admin(message.from_user.id):
+        return await message.answer("❌ Доступ заборонено")
+    
+    started = time.perf_counter()
+    count = await asyncio.to_thread(rebuild_sales_rollups)
+    await message.answer(
+        f"✅ Зведення перераховано: {count} замовлень за {time.perf_counter() - started:.2f} с"
+    )
+
+# =======================
+# EXPORT
+# =======================
+@dp.message(Command("export"), flags={"rate_limit": ADMIN_RATE_LIMIT})
+async def export_command(message: types.Message, command: CommandObject):
+    """/export [csv|ndjson] [з YYYY-MM-DD] [по YYYY-MM-DD] - замовлення документом"""
+    if not is_admin(message.from_user.id):
+        return await message.answer("❌ Доступ заборонено")
+    
+    args = (command.args or "").split()
+    fmt = args.pop(0) if args and args[0] in EXPORT_FORMATS else "csv"
+    try:
+        date_from, date_to = parse_export_range(*args[:2])
+    except (TypeError, ValueError):
+        return await message.answer(
+            "📤 <b>Вивантаження замовлень</b>\n\n"
+            "<code>/export</code> - всі замовлення в CSV\n"
+            "<code>/export ndjson 2025-01-01 2025-01-31</code> - за період",
+            parse_mode="HTML"
+        )
+    
+    # Файл пишеться на диск порціями - вибірка не завантажується в пам'ять цілком
+    extension = EXPORT_FORMATS[fmt][1]
+    fd, path = tempfile.mkstemp(suffix=f".{extension}")
+    os.close(fd)
+    try:
+        size = await asyncio.to_thread(write_order_export, path, fmt, date_from, date_to)
+        period = " - ".join(args[:2]) or "весь час"
+        await message.answer_document(
+            FSInputFile(path, filename=f"orders_{datetime.now():%Y%m%d}.{extension}"),
+            caption=f"📤 Замовлення ({period}), {size / 1024:.1f} KB"
+        )
     except Exception as e:
-        logging.error(f"Error listing orders: {e}")
-        await callback.answer("❌ Помилка при завантаженні замовлень", show_alert=True)
+        logging.error(f"Error exporting orders: {e}")
+        await message.answer("❌ Помилка при вивантаженні замовлень")
+    finally:
+        os.remove(path)
+
+# =======================
+# BULK IMPORT
+# =======================
+def format_import_report(report):
+    """Звіт імпорту для адміна: підсумок і перші помилки по рядках"""
+    if report["dry_run"]:
+        text = f"🔎 <b>Перевірка файлу</b>\n\n✅ Валідних товарів: {report['imported']}\n"
+    else:
+        text = f"📥 <b>Імпорт товарів</b>\n\n✅ Додано: {report['imported']}\n"
+    if report["failed"]:
+        text += f"❌ Пропущено: {report['failed']}\n"
+    
+    shown = report["errors"][:20]
+    if shown:
+        text += "\n<b>Помилки:</b>\n"
+        for line, error in shown:
+            prefix = f"Рядок {line}: " if line is not None else ""
+            text += f"• {prefix}{escape(error)}\n"
+    
+    hidden = report["failed"] - sum(1 for line, _ in shown if line is not None)
+    if hidden > 0:
+        text += f"... і ще {hidden}\n"
+    return text
+
+@dp.message(F.document.file_name.regexp(r"(?i).+\.(csv|json|jsonl|ndjson)$"), flags={"rate_limit": ADMIN_RATE_LIMIT})
+async def import_products_document(message: types.Message):
+    """Адмін надсилає CSV/JSON з товарами; підпис "dry_run" - тільки перевірка"""
+    if not is_admin(message.from_user.id):
+        return await message.answer("❌ Доступ заборонено")
+    
+    document = message.document
+    if document.file_size and document.file_size > MAX_IMPORT_BYTES:
+        return await message.answer("❌ Файл завеликий (максимум 20 MB)")
+    
+    fmt = detect_format(document.file_name, document.mime_type)
+    dry_run = "dry_run" in (message.caption or "").lower()
+    
+    fd, path = tempfile.mkstemp()
+    os.close(fd)
+    try:
+        # Файл качається на диск і розбирається потоком у фоновому потоці
+        await bot.download(document, destination=path)
+        started = time.perf_counter()
+        
+        def run_import():
+            with open(path, "rb") as f:
+                return import_products(f, fmt, dry_run=dry_run)
+        
+        report = await asyncio.to_thread(run_import)
+        text = format_import_report(report) + f"\n⏱️ {time.perf_counter() - started:.2f} с"
+        await message.answer(text, parse_mode="HTML")
+    except Exception as e:
+        logging.error(f"Error importing products: {e}")
+        await message.answer("❌ Помилка при імпорті товарів")
+    finally:
+        os.remove(path)
+
+# =======================
+# INLINE SEARCH
+# =======================
+# Inline режим потрібно увімкнути в @BotFather (/setinline)
+INLINE_PAGE_SIZE = 20
+INLINE_CACHE_TTL = 60  # секунд, кеш результатів на стороні бота
+INLINE_CACHE_TIME = 30  # секунд, кеш на стороні Telegram
+INLINE_CACHE_MAX = 512
+INLINE_SEARCH_TIMEOUT = 3  # Telegram чекає відповідь обмежений час
+
+inline_cache = {}
+
+def _search_inline(query: str, offset: int):
+    """Пошук товарів для inline режиму (виконується в executor)"""
+    if query:
+        return search_products(query, limit=INLINE_PAGE_SIZE, offset=offset)
+    # Порожній запит - показуємо новинки
+    if offset == 0:
+        products, _ = get_products_page(INLINE_PAGE_SIZE)
+        return products
+    return []
+
+async def get_inline_results(query: str, offset: int):
+    """Результати пошуку з коротким TTL кешем по (query, offset)"""
+    key = (query, offset)
+    now = time.monotonic()
+    cached = inline_cache.pop(key, None)
+    if cached and cached[0] > now:
+        inline_cache[key] = cached
+        return cached[1]
+
+    # to_thread копіює контекст - час запиту потрапляє в метрики апдейту
+    products = await asyncio.wait_for(
+        asyncio.to_thread(_search_inline, query, offset),
+        timeout=INLINE_SEARCH_TIMEOUT
+    )
+
+    if len(inline_cache) >= INLINE_CACHE_MAX:
+        # Словник впорядкований за часом вставки - видаляємо найстаріший запис
+        inline_cache.pop(next(iter(inline_cache)))
+    inline_cache[key] = (now + INLINE_CACHE_TTL, products)
+    return products
+
+def build_inline_result(product):
+    """Картка товару для inline відповіді"""
+    name = escape(product.get('name') or 'Товар')
+    price = product.get('price', 0)
+    category = product.get('category') or ''
+    message_text = (
+        f"🛍️ <b>{name}</b>\n"
+        f"💰 {price} грн\n"
+        f"📁 {escape(category)} | 📏 {escape(product.get('sizes') or 'N/A')}"
+    )
+    if product.get('description'):
+        message_text += f"\n\n{escape(product['description'])}"
+
+    return types.InlineQueryResultArticle(
+        id=str(product['id']),
+        title=product.get('name') or 'Товар',
+        description=f"{price} грн · {category}",
+        thumbnail_url=product.get('image_url') or None,
+        input_message_content=types.InputTextMessageContent(
+            message_text=message_text,
+            parse_mode="HTML"
+        ),
+        reply_markup=InlineKeyboardMarkup(inline_keyboard=[
+            [InlineKeyboardButton(text="🛍️ Відкрити магазин", url=WEBAPP_URL)]
+        ]) if WEBAPP_URL else None
+    )
+
+@dp.inline_query()
+async def inline_search(inline_query: types.InlineQuery):
+    query = inline_query.query.strip().lower()
+    # offset приходить від клієнта - будь-яке сміття означає першу сторінку
+    try:
+        offset = max(0, int(inline_query.offset or 0))
+    except ValueError:
+        offset = 0
+
+    try:
+        products = await get_inline_results(query, offset)
+    except Exception as e:
+        logging.error(f"Error in inline search: {e}")
+        # Відповідаємо вчасно хоча б порожнім результатом, без довгого кешу
+        return await inline_query.answer([], cache_time=1)
+
+    next_offset = str(offset + INLINE_PAGE_SIZE) if query and len(products) == INLINE_PAGE_SIZE else ""
+    await inline_query.answer(
+        [build_inline_result(p) for p in products],
+        cache_time=INLINE_CACHE_TIME,
+        next_offset=next_offset
+    )
 
 # =======================
 # WEBHOOK APP
@@ -934,6 +1513,155 @@ async def list_orders_handler(callback: types.CallbackQuery):
 # Глобальна змінна для контролю фонового таску
 background_tasks = set()
 
+# Поріг pending updates, після якого вмикається catch-up режим
+CATCHUP_THRESHOLD = int(os.getenv("CATCHUP_THRESHOLD", "30"))
+CATCHUP_BATCH_SIZE = 100  # максимум, який дозволяє getUpdates
+
+catchup_lock = asyncio.Lock()
+
+# Типи оновлень, які отримує webhook
+ALLOWED_UPDATES = ["message", "callback_query", "inline_query"]
+
+# Статистика останнього запуску (для /status)
+startup_stats = {}
+
+def _update_owner(update: types.Update):
+    """Ключ для впорядкування: оновлення одного користувача обробляються послідовно"""
+    event = update.event
+    user = getattr(event, "from_user", None)
+    return user.id if user else update.update_id
+
+async def _process_batch(updates):
+    """Обробити пачку оновлень: різні користувачі паралельно, один користувач - по черзі"""
+    groups = {}
+    for update in updates:
+        groups.setdefault(_update_owner(update), []).append(update)
+
+    async def run_group(group):
+        for update in group:
+            try:
+                await dp.feed_update(bot, update)
+            except Exception as e:
+                logging.error(f"❌ Помилка обробки update {update.update_id}: {e}", exc_info=True)
+
+    await asyncio.gather(*(run_group(group) for group in groups.values()))
+
+async def catch_up_pending_updates(webhook_url: str, allowed_updates=ALLOWED_UPDATES) -> int:
+    """
+    Catch-up режим: тимчасово знімаємо webhook, вичитуємо backlog через getUpdates
+    і обробляємо все через dispatcher, після чого повертаємо webhook.
+    Нічого не відкидається - наступна пачка завантажується поки обробляється поточна.
+    """
+    if catchup_lock.locked():
+        logging.info("⏳ Catch-up вже виконується")
+        return 0
+
+    async with catchup_lock:
+        processed = 0
+        previous_batch = None
+        offset = None
+        # Без drop_pending_updates - оновлення залишаються в черзі Telegram
+        await bot.delete_webhook(drop_pending_updates=False)
+        try:
+            while True:
+                updates = await bot.get_updates(offset=offset, limit=CATCHUP_BATCH_SIZE, timeout=0)
+                # Попередня пачка оброблялась поки йшов запит - чекаємо її,
+                # щоб оновлення одного користувача не обганяли одне одне
+                if previous_batch:
+                    await previous_batch
+                    previous_batch = None
+                if not updates:
+                    break
+                # Наступний get_updates з новим offset підтверджує цю пачку в Telegram,
+                # вона вже в пам'яті і обробляється паралельно з завантаженням наступної
+                offset = updates[-1].update_id + 1
+                previous_batch = asyncio.create_task(_process_batch(updates))
+                processed += len(updates)
+        finally:
+            if previous_batch:
+                await previous_batch
+            if offset is not None:
+                # Підтверджуємо останню оброблену пачку, інакше після set_webhook
+                # Telegram доставить її повторно (дублікати замовлень)
+                try:
+                    await bot.get_updates(offset=offset, limit=1, timeout=0)
+                except Exception as e:
+                    logging.error(f"❌ Не вдалося підтвердити offset {offset}: {e}")
+            await bot.set_webhook(
+                url=webhook_url,
+                drop_pending_updates=False,
+                allowed_updates=allowed_updates
+            )
+
+        logging.info(f"✅ Catch-up завершено: оброблено {processed} updates, webhook відновлено")
+        return processed
+
+async def ensure_webhook(webhook_url: str, allowed_updates=ALLOWED_UPDATES):
+    """
+    Ідемпотентне налаштування webhook: змінюємо тільки якщо конфіг відрізняється.
+    Повертає (webhook_info, changed).
+    """
+    webhook_info = await bot.get_webhook_info()
+    current_updates = set(webhook_info.allowed_updates or [])
+
+    if webhook_info.url == webhook_url and current_updates == set(allowed_updates):
+        return webhook_info, False
+
+    # set_webhook замінює конфіг атомарно, pending updates не відкидаємо
+    await bot.set_webhook(
+        url=webhook_url,
+        drop_pending_updates=False,
+        allowed_updates=allowed_updates
+    )
+    return webhook_info, True
+
+async def fast_startup(webhook_url: str):
+    """Паралельно ініціалізуємо БД і перевіряємо webhook, час готовності пишемо в startup_stats"""
+    started = time.perf_counter()
+    loop = asyncio.get_running_loop()
+
+    _, (webhook_info, changed) = await asyncio.gather(
+        loop.run_in_executor(None, init_db),
+        ensure_webhook(webhook_url)
+    )
+
+    startup_stats["ready_in"] = time.perf_counter() - started
+    startup_stats["since_process_start"] = time.perf_counter() - PROCESS_STARTED
+    startup_stats["webhook_changed"] = changed
+    return webhook_info, changed
+
+RESERVATION_SWEEP_INTERVAL = 60  # секунд
+
+async def reservation_sweeper():
+    """Повертає на склад резерви, термін яких минув"""
+    while True:
+        try:
+            await asyncio.sleep(RESERVATION_SWEEP_INTERVAL)
+            released = await asyncio.to_thread(release_expired_reservations)
+            if released:
+                logging.info(f"📦 Повернуто на склад прострочених резервів: {released}")
+        except asyncio.CancelledError:
+            break
+        except Exception as e:
+            logging.error(f"❌ Помилка при звільненні резервів: {e}")
+
+ORDER_ARCHIVE_INTERVAL = 24 * 3600  # секунд
+
+async def order_archiver():
+    """Раз на добу переносить старі завершені замовлення в orders_archive"""
+    if ORDER_ARCHIVE_DAYS <= 0:
+        return
+    while True:
+        try:
+            await asyncio.sleep(ORDER_ARCHIVE_INTERVAL)
+            archived = await asyncio.to_thread(archive_orders)
+            if archived:
+                logging.info(f"🗄 Перенесено в архів замовлень: {archived}")
+        except asyncio.CancelledError:
+            break
+        except Exception as e:
+            logging.error(f"❌ Помилка при архівації замовлень: {e}")
+
 # Фоновий таск для автоматичної перевірки webhook
 async def webhook_monitor():
     """Перевіряє та оновлює webhook кожні 3 хвилини"""
@@ -950,18 +1678,18 @@ async def webhook_monitor():
             # Перевіряємо чи webhook встановлений правильно
             if not webhook_info.url or webhook_info.url != expected_url:
                 logging.warning(f"⚠️ Webhook URL неправильний! Очікуємо: {expected_url}, Поточний: {webhook_info.url}")
-                await bot.delete_webhook(drop_pending_updates=True)
-                await asyncio.sleep(2)
-                await bot.set_webhook(url=expected_url, drop_pending_updates=True)
+                # set_webhook замінює URL без видалення - pending updates зберігаються
+                await bot.set_webhook(
+                    url=expected_url,
+                    drop_pending_updates=False,
+                    allowed_updates=ALLOWED_UPDATES
+                )
                 logging.info(f"✅ Webhook автоматично оновлено на {expected_url}")
-                
-            elif webhook_info.pending_update_count > 30:
-                # Якщо накопичилось багато оновлень - перезапускаємо webhook
-                logging.warning(f"⚠️ Багато pending updates: {webhook_info.pending_update_count}")
-                await bot.delete_webhook(drop_pending_updates=True)
-                await asyncio.sleep(2)
-                await bot.set_webhook(url=expected_url, drop_pending_updates=True)
-                logging.info("✅ Webhook автоматично перезапущено через pending updates")
+
+            elif webhook_info.pending_update_count > CATCHUP_THRESHOLD:
+                # Якщо накопичилось багато оновлень - вичитуємо їх в catch-up режимі
+                logging.warning(f"⚠️ Багато pending updates: {webhook_info.pending_update_count}, вмикаємо catch-up")
+                await catch_up_pending_updates(expected_url, ALLOWED_UPDATES)
                 
             else:
                 logging.info(f"✅ Webhook перевірено: OK (pending: {webhook_info.pending_update_count})")
@@ -979,43 +1707,27 @@ async def on_startup(app: web.Application):
     """Виконується при старті додатку"""
     logging.info("🚀 Запуск бота...")
     
-    # Ініціалізуємо базу даних
-    init_db()
-    
     webhook_url = f"{WEBHOOK_URL}/webhook/bot"
     
     try:
-        # Отримуємо інфо про поточний webhook
-        webhook_info = await bot.get_webhook_info()
-        logging.info(f"📡 Поточний webhook: {webhook_info.url or 'НЕ ВСТАНОВЛЕНО'}")
-        
-        # Завжди видаляємо старий webhook при старті
-        if webhook_info.url:
-            await bot.delete_webhook(drop_pending_updates=True)
-            logging.info("🗑️ Старий webhook видалено")
-            await asyncio.sleep(2)  # Даємо час Telegram обробити
-        
-        # Встановлюємо новий webhook
-        result = await bot.set_webhook(
-            url=webhook_url,
-            drop_pending_updates=True,
-            allowed_updates=["message", "callback_query"]
-        )
+        # БД і webhook налаштовуємо паралельно, webhook змінюємо тільки якщо конфіг інший
+        webhook_info, changed = await fast_startup(webhook_url)
         
-        if result:
-            logging.info(f"✅ Webhook успішно встановлено на {webhook_url}")
+        if changed:
+            logging.info(f"✅ Webhook встановлено на {webhook_url} (був: {webhook_info.url or 'НЕ ВСТАНОВЛЕНО'})")
         else:
-            logging.error("❌ Не вдалось встановити webhook!")
-        
-        # Перевіряємо що встановилось
-        await asyncio.sleep(1)
-        new_webhook_info = await bot.get_webhook_info()
-        logging.info(f"📋 Webhook статус: URL={new_webhook_info.url}, Pending={new_webhook_info.pending_update_count}")
+            logging.info(f"✅ Webhook вже налаштовано: {webhook_url}")
+        logging.info(f"📋 Pending updates: {webhook_info.pending_update_count}")
+        logging.info(
+            f"⏱️ Готово за {startup_stats['ready_in']:.2f}s "
+            f"(від старту процесу: {startup_stats['since_process_start']:.2f}s)"
+        )
         
-        # Запускаємо фоновий моніторинг webhook
-        task = asyncio.create_task(webhook_monitor())
-        background_tasks.add(task)
-        task.add_done_callback(background_tasks.discard)
+        # Запускаємо фоновий моніторинг webhook і звільнення резервів
+        for coro in (webhook_monitor(), reservation_sweeper(), order_archiver()):
+            task = asyncio.create_task(coro)
+            background_tasks.add(task)
+            task.add_done_callback(background_tasks.discard)
         
         logging.info("🔄 Автоматичний моніторинг webhook запущено (перевірка кожні 3 хвилини)")
         
@@ -1034,10 +1746,10 @@ async def on_shutdown(app: web.Application):
     if background_tasks:
         await asyncio.gather(*background_tasks, return_exceptions=True)
     
+    # Webhook не видаляємо: при деплої новий інстанс вже працює з тим самим URL
     try:
-        await bot.delete_webhook()
         await bot.session.close()
-        logging.info("✅ Webhook видалено, сесія закрита")
+        logging.info("✅ Сесія закрита")
     except Exception as e:
         logging.error(f"❌ Помилка при shutdown: {e}")
 
@@ -1052,6 +1764,7 @@ async def api_info(request):
             "/api/products/{id}": "GET - Отримати товар за ID",
             "/webhook/bot": "POST - Telegram webhook",
             "/status": "GET - Bot status dashboard",
+            "/metrics": "GET - Метрики часу обробки (admin)",
             "/update-webhook": "GET - Force update webhook"
         }
     })
@@ -1064,6 +1777,10 @@ async def health_check(request):
         
         # Перевіряємо чи працює моніторинг
         monitor_status = "🟢 Активний" if len(background_tasks) > 0 else "🔴 Не запущено"
+        ready_in = (
+            f"{startup_stats['ready_in']:.2f}s (від старту процесу {startup_stats['since_process_start']:.2f}s)"
+            if startup_stats else "—"
+        )
         
         html = f"""
         <html>
@@ -1154,6 +1871,10 @@ async def health_check(request):
                     <strong>Background Tasks:</strong> {len(background_tasks)}
                 </div>
                 
+                <div class="status-item">
+                    <strong>Startup Time:</strong> {ready_in}
+                </div>
+                
                 <a href="/update-webhook" class="btn">🔄 Force Update Webhook</a>
                 
                 <div class="footer">
@@ -1177,7 +1898,7 @@ async def force_update_webhook(request):
         result = await bot.set_webhook(
             url=webhook_url,
             drop_pending_updates=True,
-            allowed_updates=["message", "callback_query", "inline_query"]
+            allowed_updates=ALLOWED_UPDATES
         )
         
         webhook_info = await bot.get_webhook_info()
@@ -1229,6 +1950,12 @@ async def status_handler(request):
 async def health_handler(request):
     return await health_check(request)
 
+@routes.get('/metrics')
+async def metrics_handler(request):
+    if not is_admin_request(request):
+        return web.json_response({'error': 'Forbidden'}, status=403)
+    return web.json_response(metrics.snapshot())
+
 @routes.get('/update-webhook')
 async def update_get_handler(request):
     return await force_update_webhook(request)
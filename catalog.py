@@ -0,0 +1,188 @@
+"""
+Каталог у пам'яті: компактні товари (__slots__) з уже розібраними розмірами, інтернованими
+категоріями/типами і індексами по id, категорії та типу. Один знімок на catalog_version -
+спільна основа для кешів і індексів (ціни, схожі товари)
+"""
+import sys
+import json
+import time
+import hashlib
+import threading
+from datetime import datetime
+
+import metrics
+import database
+from database import get_all_products, on_catalog_change
+
+# Страховка на випадок змін каталогу з іншого процесу
+CATALOG_TTL = 300
+
+
+def _intern(value):
+    return sys.intern(value) if isinstance(value, str) else value
+
+
+# Однакові набори розмірів ('S, M, L, XL' ...) - один кортеж на всі товари
+_size_sets = {}
+
+
+def parse_sizes(value):
+    """'S, M,L' -> ('S', 'M', 'L'); рядки і самі кортежі розмірів спільні для всіх товарів"""
+    if not value:
+        return ()
+    sizes = tuple(sys.intern(size.strip()) for size in value.split(',') if size.strip())
+    return _size_sets.setdefault(sizes, sizes)
+
+
+class Product:
+    """Товар каталогу: sizes - кортеж, category/product_type - інтерновані рядки"""
+    __slots__ = ('id', 'name', 'description', 'price', 'image_url', 'category', 'product_type',
+                 'sizes', 'created_at')
+
+    def __init__(self, row):
+        self.id = row['id']
+        self.name = row['name']
+        self.description = row.get('description')
+        self.price = float(row['price'])
+        self.image_url = row.get('image_url')
+        self.category = _intern(row.get('category'))
+        self.product_type = _intern(row.get('product_type'))
+        self.sizes = parse_sizes(row.get('sizes'))
+        self.created_at = row.get('created_at')
+
+    def as_dict(self):
+        """Словник у форматі рядка таблиці products (для відповідей API) + розібрані sizes_list"""
+        return {
+            'id': self.id,
+            'name': self.name,
+            'description': self.description,
+            'price': self.price,
+            'image_url': self.image_url,
+            'category': self.category,
+            'product_type': self.product_type,
+            'sizes': ', '.join(self.sizes),
+            'sizes_list': list(self.sizes),
+            'created_at': self.created_at,
+        }
+
+
+def _json_default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f'{type(value).__name__} is not JSON serializable')
+
+
+def _group(products, attribute):
+    groups = {}
+    for product in products:
+        groups.setdefault(getattr(product, attribute), []).append(product)
+    return {key: tuple(group) for key, group in groups.items()}
+
+
+class Catalog:
+    """
+    Незмінний знімок каталогу однієї версії. Товари в групах - у порядку каталогу
+    (новіші першими); зміни створюють новий знімок, тому читати можна без блокувань.
+    """
+    __slots__ = ('version', 'by_id', 'by_category', 'by_type', '_json')
+
+    def __init__(self, version, products, by_category=None, by_type=None):
+        self.version = version
+        self._json = None
+        self.by_id = products if isinstance(products, dict) else {product.id: product for product in products}
+        values = self.by_id.values()
+        self.by_category = _group(values, 'category') if by_category is None else by_category
+        self.by_type = _group(values, 'product_type') if by_type is None else by_type
+
+    def __len__(self):
+        return len(self.by_id)
+
+    def get(self, product_id):
+        return self.by_id.get(product_id)
+
+    def json(self):
+        """
+        (version, body, etag) відповіді /api/products: весь знімок (as_dict) готовими байтами.
+        Кодується один раз на знімок, тобто на версію каталогу; etag - від вмісту, тому
+        збігається між процесами і після рестарту.
+        """
+        cached = self._json
+        if cached is None:
+            started = time.perf_counter()
+            body = json.dumps([product.as_dict() for product in self.by_id.values()],
+                              default=_json_default).encode()
+            cached = self._json = (self.version, body, '"%s"' % hashlib.blake2b(body, digest_size=16).hexdigest())
+            metrics.observe('catalog', 'json', time.perf_counter() - started)
+        return cached
+
+    def with_product(self, product, version):
+        """Новий знімок з доданим товаром (перебудовуються лише його групи)"""
+        by_id = {product.id: product, **self.by_id}
+        by_category = dict(self.by_category)
+        by_category[product.category] = (product,) + by_category.get(product.category, ())
+        by_type = dict(self.by_type)
+        by_type[product.product_type] = (product,) + by_type.get(product.product_type, ())
+        return Catalog(version, by_id, by_category, by_type)
+
+    def without(self, product_id, version):
+        """Новий знімок без товару product_id"""
+        product = self.by_id.get(product_id)
+        if product is None:
+            return Catalog(version, self.by_id, self.by_category, self.by_type)
+        by_id = dict(self.by_id)
+        del by_id[product_id]
+        by_category = dict(self.by_category)
+        by_category[product.category] = tuple(p for p in by_category[product.category] if p.id != product_id)
+        by_type = dict(self.by_type)
+        by_type[product.product_type] = tuple(p for p in by_type[product.product_type] if p.id != product_id)
+        return Catalog(version, by_id, by_category, by_type)
+
+
+class CatalogCache:
+    """Поточний знімок каталогу: завантажується одним запитом, оновлюється з write path"""
+
+    def __init__(self, ttl=CATALOG_TTL):
+        self.ttl = ttl
+        self._catalog = None
+        self._loaded_at = 0.0
+        self._lock = threading.Lock()
+
+    def _is_fresh(self):
+        catalog = self._catalog
+        return (catalog is not None and catalog.version == database.catalog_version
+                and time.monotonic() - self._loaded_at < self.ttl)
+
+    def get(self):
+        """Знімок каталогу (завантажується при першому зверненні, після TTL або пропущеної зміни)"""
+        if not self._is_fresh():
+            with self._lock:
+                if not self._is_fresh():
+                    started = time.perf_counter()
+                    version = database.catalog_version
+                    self._catalog = Catalog(version, (Product(row) for row in get_all_products()))
+                    self._loaded_at = time.monotonic()
+                    metrics.observe('catalog', 'build', time.perf_counter() - started)
+        return self._catalog
+
+    def peek(self):
+        """Знімок без завантаження (None, якщо його ще немає)"""
+        return self._catalog
+
+    def invalidate(self):
+        self._catalog = None
+
+    def on_catalog_change(self, action, product_id, product=None):
+        with self._lock:
+            catalog = self._catalog
+            if catalog is None:
+                return
+            if action == 'add' and product_id is not None:
+                self._catalog = catalog.with_product(Product(product), database.catalog_version)
+            elif action == 'delete':
+                self._catalog = catalog.without(product_id, database.catalog_version)
+            else:
+                self.invalidate()
+
+
+catalog = CatalogCache()
+on_catalog_change(catalog.on_catalog_change)
@@ -0,0 +1,184 @@
+"""
+Масовий імпорт товарів з CSV / JSON (масив або NDJSON) - потоковий розбір і валідація
+"""
+import io
+import csv
+import json
+import itertools
+
+from database import PRODUCT_COLUMNS, add_products_bulk
+
+CATEGORIES = ('чоловіче', 'жіноче')
+PRODUCT_TYPES = ('одяг', 'взуття')
+
+IMPORT_FORMATS = ('csv', 'json')
+MAX_IMPORT_BYTES = 20 * 1024 * 1024  # ліміт Telegram на завантаження файлів ботом
+MAX_NAME_LENGTH = 200
+MAX_REPORTED_ERRORS = 100
+
+
+def detect_format(filename='', content_type=''):
+    """csv / json за розширенням файлу або Content-Type (None якщо не вдалося)"""
+    filename = (filename or '').lower()
+    content_type = (content_type or '').lower()
+    if filename.endswith('.csv') or 'csv' in content_type:
+        return 'csv'
+    if filename.endswith(('.json', '.jsonl', '.ndjson')) or 'json' in content_type:
+        return 'json'
+    return None
+
+
+def iter_csv_rows(stream):
+    """(номер рядка, dict) з бінарного потоку CSV; роздільник ',' або ';' (експорт з Excel)"""
+    text = io.TextIOWrapper(stream, encoding='utf-8-sig', newline='')
+    header = text.readline()
+    delimiter = ';' if header.count(';') > header.count(',') else ','
+    fieldnames = [name.strip().lower() for name in next(csv.reader([header], delimiter=delimiter), [])]
+
+    reader = csv.DictReader(text, fieldnames=fieldnames, delimiter=delimiter)
+    for row in reader:
+        if any(value and value.strip() for value in row.values() if isinstance(value, str)):
+            yield reader.line_num + 1, row
+
+
+def iter_json_rows(stream, chunk_size=65536):
+    """
+    (номер, dict) з бінарного потоку JSON: масив об'єктів розбирається по одному об'єкту
+    через raw_decode, NDJSON - по рядку. Весь документ в пам'ять не завантажується.
+    """
+    text = io.TextIOWrapper(stream, encoding='utf-8-sig')
+    buffer = text.read(chunk_size)
+    stripped = buffer.lstrip()
+
+    if not stripped.startswith('['):
+        # NDJSON: один об'єкт на рядок; дочитуємо рядок, обрізаний на межі шматка
+        head = io.StringIO(buffer + text.readline())
+        for number, line in enumerate(itertools.chain(head, text), 1):
+            if line.strip():
+                yield number, _decode_object(line)
+        return
+
+    decoder = json.JSONDecoder()
+    position = len(buffer) - len(stripped) + 1
+    index = 0
+    eof = False
+    while True:
+        # Пропускаємо пробіли і коми між об'єктами
+        while True:
+            while position < len(buffer) and buffer[position] in ' \t\r\n,':
+                position += 1
+            if position < len(buffer) or eof:
+                break
+            buffer, position = text.read(chunk_size), 0
+            eof = not buffer
+
+        if position >= len(buffer) or buffer[position] == ']':
+            return
+
+        try:
+            item, position = decoder.raw_decode(buffer, position)
+        except json.JSONDecodeError:
+            if eof:
+                raise
+            # Об'єкт обрізаний на межі шматка - дочитуємо
+            chunk = text.read(chunk_size)
+            eof = not chunk
+            buffer, position = buffer[position:] + chunk, 0
+            continue
+
+        index += 1
+        yield index, item
+
+
+def _decode_object(line):
+    try:
+        return json.loads(line)
+    except json.JSONDecodeError as e:
+        return ValueError(f"невірний JSON: {e.msg}")
+
+
+def validate_product(row):
+    """dict -> кортеж у порядку PRODUCT_COLUMNS; ValueError з описом помилки"""
+    if isinstance(row, Exception):
+        raise row
+    if not isinstance(row, dict):
+        raise ValueError("очікується об'єкт з полями товару")
+
+    def text(field):
+        value = row.get(field)
+        return '' if value is None else str(value).strip()
+
+    name = text('name')
+    if not name:
+        raise ValueError("не вказано name")
+    if len(name) > MAX_NAME_LENGTH:
+        raise ValueError(f"name довше {MAX_NAME_LENGTH} символів")
+
+    try:
+        price = float(text('price').replace(',', '.').replace(' ', ''))
+    except ValueError:
+        raise ValueError(f"невірна ціна: {text('price')!r}")
+    if not price > 0:
+        raise ValueError("ціна має бути більше 0")
+
+    category = text('category').lower()
+    if category not in CATEGORIES:
+        raise ValueError(f"category має бути одним з: {', '.join(CATEGORIES)}")
+
+    product_type = text('product_type').lower() or 'одяг'
+    if product_type not in PRODUCT_TYPES:
+        raise ValueError(f"product_type має бути одним з: {', '.join(PRODUCT_TYPES)}")
+
+    sizes = row.get('sizes')
+    if isinstance(sizes, (list, tuple)):
+        sizes = [str(size).strip() for size in sizes]
+    else:
+        sizes = [size.strip() for size in text('sizes').replace(';', ',').split(',')]
+    sizes = [size for size in sizes if size]
+    if not sizes:
+        raise ValueError("не вказано sizes")
+
+    image_url = text('image_url')
+    if image_url and not image_url.startswith(('http://', 'https://')):
+        raise ValueError("image_url має починатися з http:// або https://")
+
+    values = {
+        'name': name,
+        'description': text('description'),
+        'price': round(price, 2),
+        'image_url': image_url,
+        'category': category,
+        'product_type': product_type,
+        'sizes': ', '.join(sizes),
+    }
+    return tuple(values[column] for column in PRODUCT_COLUMNS)
+
+
+def import_products(stream, fmt, dry_run=False):
+    """
+    Імпортувати товари з бінарного потоку. Валідні рядки вставляються однією транзакцією,
+    невалідні пропускаються і потрапляють у звіт.
+    Повертає {'imported', 'failed', 'errors': [(рядок, помилка)], 'dry_run'}.
+    """
+    if fmt not in IMPORT_FORMATS:
+        raise ValueError(f"Unknown import format: {fmt}")
+
+    report = {'imported': 0, 'failed': 0, 'errors': [], 'dry_run': dry_run}
+
+    def valid_rows():
+        rows = iter_csv_rows(stream) if fmt == 'csv' else iter_json_rows(stream)
+        for number, row in rows:
+            try:
+                yield validate_product(row)
+            except ValueError as e:
+                report['failed'] += 1
+                if len(report['errors']) < MAX_REPORTED_ERRORS:
+                    report['errors'].append((number, str(e)))
+
+    try:
+        report['imported'] = add_products_bulk(valid_rows(), dry_run=dry_run)
+    except (UnicodeDecodeError, csv.Error, json.JSONDecodeError) as e:
+        # Файл зламаний посередині - транзакція відкочена, нічого не імпортовано
+        report['imported'] = 0
+        report['errors'].append((None, f"не вдалося прочитати файл: {e}"))
+    return report
@@ -2,23 +2,206 @@
 Database helper - підтримує як SQLite (локально) так і PostgreSQL (production)
 """
 import os
+import re
+import json
+import time
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+from datetime import datetime, timedelta, timezone
 from urllib.parse import urlparse
 
+from metrics import track_db, normalize_sql, observe_query, record_slow_query
+
 # Перевіряємо чи є DATABASE_URL (Render автоматично додає для PostgreSQL)
 DATABASE_URL = os.getenv('DATABASE_URL')
 
+# Репліка для читання каталогу і звітів (опціонально); замовлення і користувачі - тільки primary
+DATABASE_READ_URL = os.getenv('DATABASE_READ_URL')
+
+# Після зміни каталогу стільки секунд читаємо каталог з primary - репліка може відставати
+REPLICA_STICKY_SECONDS = float(os.getenv('REPLICA_STICKY_SECONDS', '10'))
+_primary_until = 0.0
+
+
+def _replica_allowed():
+    """Чи можна зараз читати з репліки (read-your-writes після змін каталогу)"""
+    return time.monotonic() >= _primary_until
+
+# Стиль плейсхолдерів поточного бекенду (psycopg2 - %s, sqlite3 - ?)
+PLACEHOLDER = '%s' if DATABASE_URL else '?'
+
+
+@lru_cache(maxsize=None)
+def statement(query):
+    """SQL з плейсхолдерами '?' -> текст для поточного бекенду (перетворюється один раз)"""
+    return query.replace('?', '%s') if DATABASE_URL else query
+
+
+@lru_cache(maxsize=None)
+def _returning_id(query):
+    return query + ' RETURNING id'
+
+# Запити довші за поріг потрапляють в slow-query лог разом з планом виконання
+SLOW_QUERY_MS = float(os.getenv('SLOW_QUERY_MS', '200'))
+# План одного й того самого запиту знімаємо не частіше ніж раз на EXPLAIN_INTERVAL секунд
+EXPLAIN_INTERVAL = 600
+_explained_at = {}
+
+
+def _record_query(c, query, params, elapsed):
+    """Статистика запиту; для повільних SELECT - ще й EXPLAIN на тому самому з'єднанні"""
+    observe_query(query, elapsed)
+    if elapsed * 1000 < SLOW_QUERY_MS:
+        return
+    
+    plan = None
+    key = normalize_sql(query)
+    now = time.monotonic()
+    explain_due = now - _explained_at.get(key, -EXPLAIN_INTERVAL) >= EXPLAIN_INTERVAL
+    if explain_due and re.match(r'\s*(SELECT|WITH)\b', query, re.IGNORECASE):
+        _explained_at[key] = now
+        try:
+            c.execute(('EXPLAIN ' if DATABASE_URL else 'EXPLAIN QUERY PLAN ') + query, params or ())
+            # Останній стовпець: 'QUERY PLAN' у PostgreSQL, 'detail' у SQLite
+            plan = [list(dict(row).values())[-1] for row in c.fetchall()]
+        except Exception as e:
+            plan = [f'EXPLAIN failed: {e}']
+    
+    record_slow_query(query, params, elapsed, plan)
+    print(f"🐢 Slow query ({elapsed * 1000:.0f} ms): {key[:200]}")
+
+
+class TrackedCursor:
+    """
+    Курсор, що потрапляє в статистику SQL кожним execute/executemany, а не тільки через
+    execute_query. Час запиту - виконання плюс вибірка його рядків, тому запис робиться
+    при наступному execute або закритті з'єднання. Решта атрибутів - від справжнього курсора.
+    """
+    __slots__ = ('cursor', '_pending')
+
+    def __init__(self, cursor):
+        object.__setattr__(self, 'cursor', cursor)
+        object.__setattr__(self, '_pending', None)  # [query, params, elapsed]
+
+    def __getattr__(self, name):
+        return getattr(self.cursor, name)
+
+    def __setattr__(self, name, value):
+        # c.itersize = ... і подібне - для справжнього курсора
+        setattr(self.cursor, name, value)
+
+    def _timed(self, method, query, params):
+        self.flush()
+        started = time.perf_counter()
+        if params is None:
+            method(query)
+        else:
+            method(query, params)
+        object.__setattr__(self, '_pending', [query, params, time.perf_counter() - started])
+        return self
+
+    def execute(self, query, params=None):
+        return self._timed(self.cursor.execute, query, params)
+
+    def executemany(self, query, params):
+        return self._timed(self.cursor.executemany, query, params)
+
+    def record(self, query, params, elapsed):
+        """Записати запит, виконаний в обхід execute (напр. psycopg2 execute_values)"""
+        self.flush()
+        object.__setattr__(self, '_pending', [query, params, elapsed])
+
+    def _fetch(self, method, *args):
+        started = time.perf_counter()
+        try:
+            return method(*args)
+        finally:
+            if self._pending is not None:
+                self._pending[2] += time.perf_counter() - started
+
+    def fetchone(self):
+        return self._fetch(self.cursor.fetchone)
+
+    def fetchmany(self, size=None):
+        return self._fetch(self.cursor.fetchmany, size or self.cursor.arraysize)
+
+    def fetchall(self):
+        return self._fetch(self.cursor.fetchall)
+
+    def __iter__(self):
+        while True:
+            rows = self.fetchmany(500)
+            if not rows:
+                return
+            yield from rows
+
+    def flush(self):
+        """Записати останній запит (його рядки вже вибрані або більше не потрібні)"""
+        pending = self._pending
+        if pending is not None:
+            object.__setattr__(self, '_pending', None)
+            _record_query(self.cursor, *pending)
+
+    def close(self):
+        self.flush()
+        self.cursor.close()
+
+
+class TrackedConnection:
+    """З'єднання, курсори якого - TrackedCursor; close() записує останні запити"""
+    __slots__ = ('connection', '_cursors')
+
+    def __init__(self, connection):
+        object.__setattr__(self, 'connection', connection)
+        object.__setattr__(self, '_cursors', [])
+
+    def __getattr__(self, name):
+        return getattr(self.connection, name)
+
+    def __setattr__(self, name, value):
+        setattr(self.connection, name, value)
+
+    def cursor(self, *args, **kwargs):
+        cursor = TrackedCursor(self.connection.cursor(*args, **kwargs))
+        self._cursors.append(cursor)
+        return cursor
+
+    def close(self):
+        try:
+            for cursor in self._cursors:
+                cursor.flush()
+        finally:
+            self._cursors.clear()
+            self.connection.close()
+
 if DATABASE_URL:
     # Production: PostgreSQL
     import psycopg2
-    from psycopg2.extras import RealDictCursor
+    from psycopg2.extras import RealDictCursor, execute_values
+    
+    # Вираз для повнотекстового пошуку ('simple' - без стемінгу, підходить для укр. назв)
+    SEARCH_VECTOR = ("to_tsvector('simple', coalesce(name, '') || ' ' || coalesce(description, '') "
+                     "|| ' ' || coalesce(category, '') || ' ' || coalesce(product_type, ''))")
+    # Той самий текст з вагами для ранжування: назва важливіша за категорію/тип, а ті - за опис
+    SEARCH_RANK_VECTOR = ("setweight(to_tsvector('simple', coalesce(name, '')), 'A') "
+                          "|| setweight(to_tsvector('simple', coalesce(category, '') || ' ' "
+                          "|| coalesce(product_type, '')), 'B') "
+                          "|| setweight(to_tsvector('simple', coalesce(description, '')), 'D')")
     
     # Render використовує postgres://, а psycopg2 потребує postgresql://
     if DATABASE_URL.startswith("postgres://"):
         DATABASE_URL = DATABASE_URL.replace("postgres://", "postgresql://", 1)
+    if DATABASE_READ_URL and DATABASE_READ_URL.startswith("postgres://"):
+        DATABASE_READ_URL = DATABASE_READ_URL.replace("postgres://", "postgresql://", 1)
     
-    def get_connection():
-        """Отримати з'єднання з PostgreSQL"""
-        return psycopg2.connect(DATABASE_URL, cursor_factory=RealDictCursor)
+    def get_connection(read=False):
+        """Отримати з'єднання з PostgreSQL (read=True - з репліки, якщо вона є)"""
+        url = DATABASE_READ_URL if read and DATABASE_READ_URL and _replica_allowed() else DATABASE_URL
+        return TrackedConnection(psycopg2.connect(url, cursor_factory=RealDictCursor))
+    
+    def begin_write(cursor):
+        """psycopg2 відкриває транзакцію автоматично"""
     
     def init_db():
         """Ініціалізація PostgreSQL бази"""
@@ -56,56 +239,143 @@ if DATABASE_URL:
                       is_admin INTEGER DEFAULT 0,
                       created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)''')
         
+        # Індекси для фільтрів і пагінації адмін-каталогу
+        c.execute('CREATE INDEX IF NOT EXISTS idx_products_category ON products (category, id)')
+        c.execute('CREATE INDEX IF NOT EXISTS idx_products_type ON products (product_type, id)')
+        # Черги замовлень за статусом
+        c.execute('CREATE INDEX IF NOT EXISTS idx_orders_status_created ON orders (status, created_at)')
+        # Вивантаження за період
+        c.execute('CREATE INDEX IF NOT EXISTS idx_orders_created ON orders (created_at)')
+        # Історія замовлень користувача
+        c.execute('CREATE INDEX IF NOT EXISTS idx_orders_user_created ON orders (user_id, created_at)')
+        
+        # Залишки по розмірах і тимчасові резерви під час оформлення
+        c.execute('''CREATE TABLE IF NOT EXISTS stock
+                     (product_id INTEGER NOT NULL,
+                      size TEXT NOT NULL,
+                      qty INTEGER NOT NULL CHECK (qty >= 0),
+                      PRIMARY KEY (product_id, size))''')
+        
+        c.execute('''CREATE TABLE IF NOT EXISTS stock_reservations
+                     (id SERIAL PRIMARY KEY,
+                      user_id BIGINT NOT NULL,
+                      product_id INTEGER NOT NULL,
+                      size TEXT NOT NULL,
+                      qty INTEGER NOT NULL,
+                      expires_at DOUBLE PRECISION NOT NULL)''')
+        c.execute('CREATE INDEX IF NOT EXISTS idx_reservations_expires ON stock_reservations (expires_at)')
+        
+        # Спосіб оплати потрібен для зведень продажів
+        c.execute('ALTER TABLE orders ADD COLUMN IF NOT EXISTS payment_method TEXT')
+        # Що реально списано зі складу (confirm_reservations) - повертається при скасуванні
+        c.execute('ALTER TABLE orders ADD COLUMN IF NOT EXISTS stock_committed TEXT')
+        
+        # Денні зведення продажів, оновлюються разом з add_order
+        c.execute("SELECT to_regclass('sales_daily') AS name")
+        sales_exists = c.fetchone()['name'] is not None
+        c.execute('''CREATE TABLE IF NOT EXISTS sales_daily
+                     (day TEXT PRIMARY KEY,
+                      orders INTEGER NOT NULL DEFAULT 0,
+                      units INTEGER NOT NULL DEFAULT 0,
+                      revenue DOUBLE PRECISION NOT NULL DEFAULT 0)''')
+        c.execute('''CREATE TABLE IF NOT EXISTS sales_daily_products
+                     (day TEXT NOT NULL,
+                      product_id INTEGER NOT NULL,
+                      size TEXT NOT NULL,
+                      category TEXT,
+                      units INTEGER NOT NULL DEFAULT 0,
+                      revenue DOUBLE PRECISION NOT NULL DEFAULT 0,
+                      PRIMARY KEY (day, product_id, size))''')
+        c.execute('''CREATE TABLE IF NOT EXISTS sales_daily_payments
+                     (day TEXT NOT NULL,
+                      payment_method TEXT NOT NULL,
+                      orders INTEGER NOT NULL DEFAULT 0,
+                      revenue DOUBLE PRECISION NOT NULL DEFAULT 0,
+                      PRIMARY KEY (day, payment_method))''')
+        
+        # Архів завершених замовлень (archive_orders) - ті самі колонки, що й orders
+        c.execute('''CREATE TABLE IF NOT EXISTS orders_archive
+                     (id INTEGER PRIMARY KEY,
+                      user_id BIGINT NOT NULL,
+                      username TEXT,
+                      products TEXT NOT NULL,
+                      total_price REAL NOT NULL,
+                      status TEXT,
+                      payment_method TEXT,
+                      created_at TIMESTAMP,
+                      archived_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)''')
+        c.execute('CREATE INDEX IF NOT EXISTS idx_orders_archive_created ON orders_archive (created_at)')
+        c.execute('CREATE INDEX IF NOT EXISTS idx_orders_archive_status_created ON orders_archive (status, created_at)')
+        c.execute('CREATE INDEX IF NOT EXISTS idx_orders_archive_user_created ON orders_archive (user_id, created_at)')
+        
+        # Повнотекстовий індекс по виразу - оновлюється разом з рядком
+        c.execute(f'CREATE INDEX IF NOT EXISTS idx_products_search ON products USING GIN ({SEARCH_VECTOR})')
+        
         conn.commit()
         conn.close()
+        
+        if not sales_exists:
+            # Зведення для замовлень, які вже є в базі
+            rebuild_sales_rollups()
         print("✅ PostgreSQL database initialized")
     
-    def execute_query(query, params=None, fetch=False, fetchone=False):
-        """Виконати SQL запит"""
-        conn = get_connection()
-        c = conn.cursor()
+    def execute_query(query, params=None, fetch=False, fetchone=False, returning_id=False, read=False):
+        """
+        Виконати SQL запит; returning_id - id нового рядка тим самим запитом (RETURNING id),
+        read - читання, яке можна віддати репліці
+        """
+        with track_db():
+            conn = get_connection(read)
+            c = conn.cursor()
         
-        if params:
-            c.execute(query, params)
-        else:
-            c.execute(query)
+            if returning_id:
+                c.execute(_returning_id(query), params)
+            elif params:
+                c.execute(query, params)
+            else:
+                c.execute(query)
         
-        result = None
-        if fetch:
-            result = c.fetchall()
-        elif fetchone:
-            result = c.fetchone()
+            result = None
+            if fetch:
+                result = c.fetchall()
+            elif fetchone:
+                result = c.fetchone()
+            elif returning_id:
+                result = c.fetchone()['id']
         
-        if not fetch and not fetchone:
-            conn.commit()
-            # Тільки для INSERT без ON CONFLICT
-            if 'INSERT' in query.upper() and 'CONFLICT' not in query.upper() and 'RETURNING' not in query.upper():
-                try:
-                    c.execute('SELECT lastval()')
-                    result = c.fetchone()[0] if c.rowcount > 0 else None
-                except:
-                    result = None
+            if not fetch and not fetchone:
+                conn.commit()
         
-        conn.close()
+            conn.close()
         return result
 
 else:
     # Development: SQLite
     import sqlite3
     
-    DB_FILE = 'shop.db'
+    # Окремий файл для бенчмарків і локальних експериментів
+    DB_FILE = os.getenv('DB_FILE', 'shop.db')
+    # Копія бази в ролі репліки для читання (аналог DATABASE_READ_URL)
+    DB_READ_FILE = os.getenv('DB_READ_FILE')
     
-    def get_connection():
-        """Отримати з'єднання з SQLite"""
-        conn = sqlite3.connect(DB_FILE)
+    def get_connection(read=False):
+        """Отримати з'єднання з SQLite (read=True - з DB_READ_FILE, якщо він є)"""
+        conn = sqlite3.connect(DB_READ_FILE if read and DB_READ_FILE and _replica_allowed() else DB_FILE)
         conn.row_factory = sqlite3.Row
-        return conn
+        return TrackedConnection(conn)
+    
+    def begin_write(cursor):
+        """Почати транзакцію одразу з блокуванням на запис (без deadlock при upgrade)"""
+        cursor.execute('BEGIN IMMEDIATE')
     
     def init_db():
         """Ініціалізація SQLite бази"""
         conn = get_connection()
         c = conn.cursor()
         
+        # WAL: читання не блокуються записами (залишки, каталог)
+        c.execute('PRAGMA journal_mode=WAL')
+        
         # Products table
         c.execute('''CREATE TABLE IF NOT EXISTS products
                      (id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -137,95 +407,1014 @@ else:
                       is_admin INTEGER DEFAULT 0,
                       created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)''')
         
+        # Індекси для фільтрів і пагінації адмін-каталогу
+        c.execute('CREATE INDEX IF NOT EXISTS idx_products_category ON products (category, id)')
+        c.execute('CREATE INDEX IF NOT EXISTS idx_products_type ON products (product_type, id)')
+        # Черги замовлень за статусом
+        c.execute('CREATE INDEX IF NOT EXISTS idx_orders_status_created ON orders (status, created_at)')
+        # Вивантаження за період
+        c.execute('CREATE INDEX IF NOT EXISTS idx_orders_created ON orders (created_at)')
+        # Історія замовлень користувача
+        c.execute('CREATE INDEX IF NOT EXISTS idx_orders_user_created ON orders (user_id, created_at)')
+        
+        # Залишки по розмірах і тимчасові резерви під час оформлення
+        c.execute('''CREATE TABLE IF NOT EXISTS stock
+                     (product_id INTEGER NOT NULL,
+                      size TEXT NOT NULL,
+                      qty INTEGER NOT NULL CHECK (qty >= 0),
+                      PRIMARY KEY (product_id, size))''')
+        
+        c.execute('''CREATE TABLE IF NOT EXISTS stock_reservations
+                     (id INTEGER PRIMARY KEY AUTOINCREMENT,
+                      user_id INTEGER NOT NULL,
+                      product_id INTEGER NOT NULL,
+                      size TEXT NOT NULL,
+                      qty INTEGER NOT NULL,
+                      expires_at REAL NOT NULL)''')
+        c.execute('CREATE INDEX IF NOT EXISTS idx_reservations_expires ON stock_reservations (expires_at)')
+        
+        # Спосіб оплати потрібен для зведень продажів
+        order_columns = [row['name'] for row in c.execute('PRAGMA table_info(orders)')]
+        if 'payment_method' not in order_columns:
+            c.execute('ALTER TABLE orders ADD COLUMN payment_method TEXT')
+        # Що реально списано зі складу (confirm_reservations) - повертається при скасуванні
+        if 'stock_committed' not in order_columns:
+            c.execute('ALTER TABLE orders ADD COLUMN stock_committed TEXT')
+        
+        # Денні зведення продажів, оновлюються разом з add_order
+        sales_exists = c.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'sales_daily'"
+        ).fetchone()
+        c.execute('''CREATE TABLE IF NOT EXISTS sales_daily
+                     (day TEXT PRIMARY KEY,
+                      orders INTEGER NOT NULL DEFAULT 0,
+                      units INTEGER NOT NULL DEFAULT 0,
+                      revenue REAL NOT NULL DEFAULT 0)''')
+        c.execute('''CREATE TABLE IF NOT EXISTS sales_daily_products
+                     (day TEXT NOT NULL,
+                      product_id INTEGER NOT NULL,
+                      size TEXT NOT NULL,
+                      category TEXT,
+                      units INTEGER NOT NULL DEFAULT 0,
+                      revenue REAL NOT NULL DEFAULT 0,
+                      PRIMARY KEY (day, product_id, size))''')
+        c.execute('''CREATE TABLE IF NOT EXISTS sales_daily_payments
+                     (day TEXT NOT NULL,
+                      payment_method TEXT NOT NULL,
+                      orders INTEGER NOT NULL DEFAULT 0,
+                      revenue REAL NOT NULL DEFAULT 0,
+                      PRIMARY KEY (day, payment_method))''')
+        
+        # Архів завершених замовлень (archive_orders) - ті самі колонки, що й orders
+        c.execute('''CREATE TABLE IF NOT EXISTS orders_archive
+                     (id INTEGER PRIMARY KEY,
+                      user_id INTEGER NOT NULL,
+                      username TEXT,
+                      products TEXT NOT NULL,
+                      total_price REAL NOT NULL,
+                      status TEXT,
+                      payment_method TEXT,
+                      created_at TIMESTAMP,
+                      archived_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)''')
+        c.execute('CREATE INDEX IF NOT EXISTS idx_orders_archive_created ON orders_archive (created_at)')
+        c.execute('CREATE INDEX IF NOT EXISTS idx_orders_archive_status_created ON orders_archive (status, created_at)')
+        c.execute('CREATE INDEX IF NOT EXISTS idx_orders_archive_user_created ON orders_archive (user_id, created_at)')
+        
+        # FTS5 індекс для пошуку, синхронізується тригерами
+        fts_exists = c.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'products_fts'"
+        ).fetchone()
+        c.execute('''CREATE VIRTUAL TABLE IF NOT EXISTS products_fts USING fts5
+                     (name, description, category, product_type,
+                      content='products', content_rowid='id',
+                      tokenize='unicode61 remove_diacritics 2')''')
+        c.execute('''CREATE TRIGGER IF NOT EXISTS products_fts_insert AFTER INSERT ON products BEGIN
+                       INSERT INTO products_fts (rowid, name, description, category, product_type)
+                       VALUES (new.id, new.name, new.description, new.category, new.product_type);
+                     END''')
+        c.execute('''CREATE TRIGGER IF NOT EXISTS products_fts_delete AFTER DELETE ON products BEGIN
+                       INSERT INTO products_fts (products_fts, rowid, name, description, category, product_type)
+                       VALUES ('delete', old.id, old.name, old.description, old.category, old.product_type);
+                     END''')
+        c.execute('''CREATE TRIGGER IF NOT EXISTS products_fts_update AFTER UPDATE ON products BEGIN
+                       INSERT INTO products_fts (products_fts, rowid, name, description, category, product_type)
+                       VALUES ('delete', old.id, old.name, old.description, old.category, old.product_type);
+                       INSERT INTO products_fts (rowid, name, description, category, product_type)
+                       VALUES (new.id, new.name, new.description, new.category, new.product_type);
+                     END''')
+        if not fts_exists:
+            # Індексуємо товари, які вже є в базі
+            c.execute("INSERT INTO products_fts (products_fts) VALUES ('rebuild')")
+        
         conn.commit()
         conn.close()
+        
+        if not sales_exists:
+            # Зведення для замовлень, які вже є в базі
+            rebuild_sales_rollups()
         print("✅ SQLite database initialized")
     
-    def execute_query(query, params=None, fetch=False, fetchone=False):
-        """Виконати SQL запит"""
-        conn = get_connection()
-        c = conn.cursor()
+    def execute_query(query, params=None, fetch=False, fetchone=False, returning_id=False, read=False):
+        """Виконати SQL запит; returning_id - повернути id нового рядка, read - можна з репліки"""
+        with track_db():
+            conn = get_connection(read)
+            c = conn.cursor()
         
-        if params:
-            c.execute(query, params)
-        else:
-            c.execute(query)
+            if params:
+                c.execute(query, params)
+            else:
+                c.execute(query)
         
-        result = None
-        if fetch:
-            result = [dict(row) for row in c.fetchall()]
-        elif fetchone:
-            row = c.fetchone()
-            result = dict(row) if row else None
+            result = None
+            if fetch:
+                result = [dict(row) for row in c.fetchall()]
+            elif fetchone:
+                row = c.fetchone()
+                result = dict(row) if row else None
         
-        if not fetch and not fetchone:
-            conn.commit()
-            result = c.lastrowid if c.lastrowid else None
+            if not fetch and not fetchone:
+                conn.commit()
+                if returning_id:
+                    result = c.lastrowid
         
-        conn.close()
+            conn.close()
         return result
 
 
+# Слухачі змін каталогу - кеші та індекси в пам'яті оновлюються з write path
+_catalog_listeners = []
+catalog_version = 0
+
+
+def on_catalog_change(listener):
+    """Підписатися на зміни каталогу: listener(action, product_id, product)"""
+    _catalog_listeners.append(listener)
+    return listener
+
+
+def _notify_catalog_change(action, product_id=None, product=None):
+    """Повідомити слухачів про зміну каталогу (action: add / delete / reload)"""
+    global catalog_version, _primary_until
+    catalog_version += 1
+    # Адмін (і перезавантаження кешів слухачами) одразу бачить свою зміну
+    _primary_until = time.monotonic() + REPLICA_STICKY_SECONDS
+    for listener in _catalog_listeners:
+        try:
+            listener(action, product_id, product)
+        except Exception as e:
+            print(f"⚠️ Catalog listener error: {e}")
+
+
 # Загальні функції для роботи з БД
 def get_all_products():
     """Отримати всі товари"""
-    return execute_query('SELECT * FROM products ORDER BY created_at DESC', fetch=True)
+    return execute_query('SELECT * FROM products ORDER BY created_at DESC', fetch=True, read=True)
+
+
+def get_all_products_json():
+    """
+    Весь каталог (як get_all_products) одним JSON-масивом, зібраним самою базою -
+    готові UTF-8 байти для відповіді, без Python-словника на кожен рядок.
+    На SQLite < 3.44 (без ORDER BY в агрегаті) порядок елементів не гарантований:
+    на практиці json_group_array йде в порядку підзапиту, але SQLite цього не обіцяє.
+    """
+    if DATABASE_URL:
+        query = '''SELECT convert_to(coalesce(json_agg(row_to_json(p) ORDER BY p.created_at DESC), '[]')::text,
+                                     'UTF8') AS body
+                   FROM products p'''
+    else:
+        fields = ', '.join(f"'{column}', {column}" for column in ('id', *PRODUCT_COLUMNS, 'created_at'))
+        if sqlite3.sqlite_version_info >= (3, 44, 0):
+            query = f'''SELECT CAST(json_group_array(json_object({fields}) ORDER BY created_at DESC) AS BLOB) AS body
+                        FROM products'''
+        else:
+            query = f'''SELECT CAST(json_group_array(json_object({fields})) AS BLOB) AS body
+                        FROM (SELECT * FROM products ORDER BY created_at DESC)'''
+    return bytes(execute_query(query, fetchone=True, read=True)['body'])
 
 
 def get_product(product_id):
     """Отримати один товар"""
-    return execute_query('SELECT * FROM products WHERE id = %s' if DATABASE_URL else 'SELECT * FROM products WHERE id = ?', 
-                        (product_id,), fetchone=True)
+    return execute_query(statement('SELECT * FROM products WHERE id = ?'), (product_id,), fetchone=True, read=True)
+
+
+def get_products_page(limit=10, before_id=None, after_id=None, category=None, product_type=None):
+    """
+    Отримати одну сторінку товарів (keyset пагінація по id, новіші першими).
+    before_id - наступна сторінка, after_id - попередня.
+    Повертає (товари, чи є ще товари в напрямку руху).
+    """
+    placeholder = PLACEHOLDER
+    conditions = []
+    params = []
+
+    if category:
+        conditions.append(f'category = {placeholder}')
+        params.append(category)
+    if product_type:
+        conditions.append(f'product_type = {placeholder}')
+        params.append(product_type)
+
+    if after_id:
+        conditions.append(f'id > {placeholder}')
+        params.append(after_id)
+        order = 'ASC'
+    else:
+        if before_id:
+            conditions.append(f'id < {placeholder}')
+            params.append(before_id)
+        order = 'DESC'
+
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+    query = f'''SELECT id, name, price, category, product_type, sizes FROM products
+                {where} ORDER BY id {order} LIMIT {placeholder}'''
+    params.append(limit + 1)
+
+    rows = execute_query(query, tuple(params), fetch=True, read=True)
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    if after_id:
+        rows.reverse()
+    return rows, has_more
+
+
+SEARCH_MAX_TOKENS = 8
+
+
+def search_products(query, limit=20, offset=0):
+    """
+    Повнотекстовий пошук товарів по назві, опису, категорії та типу.
+    Кожне слово запиту шукається як префікс, результати відсортовані за релевантністю.
+    """
+    tokens = re.findall(r'\w+', query.lower())[:SEARCH_MAX_TOKENS]
+    if not tokens:
+        return []
+
+    if DATABASE_URL:
+        ts_query = ' & '.join(f'{token}:*' for token in tokens)
+        sql = f'''SELECT * FROM products
+                  WHERE {SEARCH_VECTOR} @@ to_tsquery('simple', %s)
+                  ORDER BY ts_rank({SEARCH_RANK_VECTOR}, to_tsquery('simple', %s)) DESC, id DESC
+                  LIMIT %s OFFSET %s'''
+        params = (ts_query, ts_query, limit, offset)
+    else:
+        fts_query = ' '.join(f'"{token}"*' for token in tokens)
+        sql = '''SELECT p.* FROM products_fts f JOIN products p ON p.id = f.rowid
+                 WHERE products_fts MATCH ?
+                 ORDER BY bm25(products_fts, 10.0, 1.0, 3.0, 3.0), p.id DESC
+                 LIMIT ? OFFSET ?'''
+        params = (fts_query, limit, offset)
+
+    return execute_query(sql, params, fetch=True, read=True)
 
 
 def add_product(name, description, price, image_url, category, product_type, sizes):
     """Додати товар"""
-    query = '''INSERT INTO products (name, description, price, image_url, category, product_type, sizes)
-               VALUES (%s, %s, %s, %s, %s, %s, %s)''' if DATABASE_URL else \
-            '''INSERT INTO products (name, description, price, image_url, category, product_type, sizes)
-               VALUES (?, ?, ?, ?, ?, ?, ?)'''
-    return execute_query(query, (name, description, price, image_url, category, product_type, sizes))
+    query = statement('''INSERT INTO products (name, description, price, image_url, category, product_type, sizes)
+                         VALUES (?, ?, ?, ?, ?, ?, ?)''')
+    product_id = execute_query(query, (name, description, price, image_url, category, product_type, sizes),
+                               returning_id=True)
+    # created_at ставить база (DEFAULT) - беремо з primary, щоб кеші мали повний рядок
+    created = execute_query(statement('SELECT created_at FROM products WHERE id = ?'), (product_id,), fetchone=True)
+    _notify_catalog_change('add', product_id, {
+        'id': product_id, 'name': name, 'description': description, 'price': price,
+        'image_url': image_url, 'category': category, 'product_type': product_type, 'sizes': sizes,
+        'created_at': created['created_at'] if created else None
+    })
+    return product_id
+
+
+PRODUCT_COLUMNS = ('name', 'description', 'price', 'image_url', 'category', 'product_type', 'sizes')
+
+
+def add_products_bulk(rows, batch_size=500, dry_run=False):
+    """
+    Додати багато товарів однією транзакцією: rows - ітерабельне кортежів у порядку PRODUCT_COLUMNS,
+    вставляються порціями по batch_size (execute_values на PostgreSQL, executemany на SQLite).
+    Кеші каталогу оновлюються один раз в кінці. dry_run - все вставити і відкотити.
+    Повертає кількість вставлених рядків.
+    """
+    columns = ', '.join(PRODUCT_COLUMNS)
+    count = 0
+
+    with track_db():
+        conn = get_connection()
+        c = conn.cursor()
+        try:
+            begin_write(c)
+            batch = []
+            for row in rows:
+                batch.append(row)
+                if len(batch) < batch_size:
+                    continue
+                _insert_products(c, columns, batch)
+                count += len(batch)
+                batch = []
+            if batch:
+                _insert_products(c, columns, batch)
+                count += len(batch)
+
+            if dry_run:
+                conn.rollback()
+                return count
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+
+    if count:
+        _notify_catalog_change('reload')
+    return count
+
+
+def _insert_products(c, columns, batch):
+    if DATABASE_URL:
+        # Одна команда INSERT ... VALUES (...), (...) на порцію замість запиту на рядок
+        query = f'INSERT INTO products ({columns}) VALUES %s'
+        started = time.perf_counter()
+        execute_values(c.cursor, query, batch, page_size=len(batch))
+        c.record(query, None, time.perf_counter() - started)
+    else:
+        c.executemany(f'INSERT INTO products ({columns}) VALUES ({", ".join("?" * len(PRODUCT_COLUMNS))})', batch)
 
 
 def delete_product(product_id):
     """Видалити товар"""
-    query = 'DELETE FROM products WHERE id = %s' if DATABASE_URL else 'DELETE FROM products WHERE id = ?'
-    execute_query(query, (product_id,))
+    execute_query(statement('DELETE FROM products WHERE id = ?'), (product_id,))
+    execute_query(statement('DELETE FROM stock WHERE product_id = ?'), (product_id,))
+    _notify_catalog_change('delete', product_id)
+
+
+# Запити add_order; їх же міряє benchmarks/db_micro.py
+INSERT_ORDER_QUERY = statement('''INSERT INTO orders (user_id, username, products, total_price, status, payment_method)
+                                  VALUES (?, ?, ?, ?, ?, ?)''')
+ORDER_CREATED_AT_QUERY = statement('SELECT created_at FROM orders WHERE id = ?')
+
 
+def insert_order(c, sales, user_id, username, products, total_price, status='pending', payment_method=None):
+    """
+    Вставити замовлення курсором c (всередині транзакції викликача) і додати його до sales.
+    Зведення записує викликач - одним sales.write(c) на всю транзакцію. Повертає id замовлення.
+    """
+    params = (user_id, username, products, total_price, status, payment_method)
+    if DATABASE_URL:
+        c.execute(_returning_id(INSERT_ORDER_QUERY), params)
+        order_id = c.fetchone()['id']
+    else:
+        c.execute(INSERT_ORDER_QUERY, params)
+        order_id = c.lastrowid
+    c.execute(ORDER_CREATED_AT_QUERY, (order_id,))
+    created_at = c.fetchone()['created_at']
 
-def add_order(user_id, username, products, total_price):
-    """Додати замовлення"""
-    query = '''INSERT INTO orders (user_id, username, products, total_price)
-               VALUES (%s, %s, %s, %s)''' if DATABASE_URL else \
-            '''INSERT INTO orders (user_id, username, products, total_price)
-               VALUES (?, ?, ?, ?)'''
-    return execute_query(query, (user_id, username, products, total_price))
+    items = json.loads(products) if isinstance(products, str) else products
+    sales.add(_sales_day(created_at), items, total_price, payment_method, _product_categories(c, items))
+    return order_id
+
+
+def add_order(user_id, username, products, total_price, status='pending', payment_method=None):
+    """Додати замовлення і оновити денні зведення продажів в одній транзакції"""
+    with track_db():
+        conn = get_connection()
+        c = conn.cursor()
+        try:
+            begin_write(c)
+            sales = SalesDelta()
+            order_id = insert_order(c, sales, user_id, username, products, total_price, status, payment_method)
+            sales.write(c)
+
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+
+    _invalidate_user_orders(user_id)
+    return order_id
+
+
+# Архів: завершені замовлення старші за ORDER_ARCHIVE_DAYS переносяться в orders_archive,
+# тому гарячі запити працюють з невеликою таблицею orders незалежно від історії
+ORDER_ARCHIVE_DAYS = int(os.getenv('ORDER_ARCHIVE_DAYS', '180'))  # 0 - не архівувати
+ARCHIVE_STATUSES = ('done', 'cancelled')
+ORDER_COLUMNS = 'id, user_id, username, products, total_price, status, payment_method, created_at'
+# Останні замовлення з orders або orders_archive (table), новіші першими; його ж міряє benchmarks/db_micro.py
+RECENT_ORDERS_QUERY = 'SELECT {columns} FROM {table}{where} ORDER BY created_at DESC, id DESC LIMIT ' + PLACEHOLDER
+# Як часто перечитувати найновіший created_at в архіві (якщо архівує інший процес)
+ARCHIVE_HORIZON_TTL = 300
+ARCHIVE_HORIZON_QUERY = 'SELECT MAX(created_at) AS newest FROM orders_archive'
+_archive_horizon_cache = [None, None]  # [найновіший created_at в архіві, коли перевіряли]
+
+
+def _archive_horizon():
+    """Найновіший created_at в архіві (None - архів порожній)"""
+    newest, checked_at = _archive_horizon_cache
+    now = time.monotonic()
+    if checked_at is None or now - checked_at >= ARCHIVE_HORIZON_TTL:
+        row = execute_query(ARCHIVE_HORIZON_QUERY, fetchone=True)
+        newest = row['newest'] if row else None
+        _archive_horizon_cache[:] = [newest, now]
+    return newest
+
+
+def _recent_orders(where, params, limit, columns=ORDER_COLUMNS, archived=True):
+    """
+    Останні limit замовлень за умовою where. Архів читається тільки якщо гарячих рядків
+    не вистачило або найстаріший з них не новіший за все, що є в архіві.
+    """
+    where = f' WHERE {where}' if where else ''
+    rows = execute_query(RECENT_ORDERS_QUERY.format(columns=columns, table='orders', where=where),
+                         (*params, limit), fetch=True)
+    if not archived:
+        return rows
+
+    horizon = _archive_horizon()
+    if horizon is None or (len(rows) == limit and rows[-1]['created_at'] > horizon):
+        return rows
+
+    rows += execute_query(RECENT_ORDERS_QUERY.format(columns=columns, table='orders_archive', where=where),
+                          (*params, limit), fetch=True)
+    rows.sort(key=lambda row: (row['created_at'], row['id']), reverse=True)
+    return rows[:limit]
 
 
 def get_recent_orders(limit=10):
     """Отримати останні замовлення"""
-    query = 'SELECT * FROM orders ORDER BY created_at DESC LIMIT %s' if DATABASE_URL else \
-            'SELECT * FROM orders ORDER BY created_at DESC LIMIT ?'
-    return execute_query(query, (limit,), fetch=True)
+    return _recent_orders('', (), limit)
+
+
+def get_order(order_id):
+    """Отримати одне замовлення (спочатку серед гарячих, потім в архіві)"""
+    order = execute_query(statement('SELECT * FROM orders WHERE id = ?'), (order_id,), fetchone=True)
+    if order is None:
+        order = execute_query(statement(f'SELECT {ORDER_COLUMNS} FROM orders_archive WHERE id = ?'),
+                              (order_id,), fetchone=True)
+    return order
+
+
+def archive_orders(older_than_days=ORDER_ARCHIVE_DAYS, batch_size=500, max_batches=None):
+    """
+    Перенести завершені замовлення, старші за older_than_days днів, в orders_archive.
+    Кожна порція - окрема транзакція (копія + видалення), тому перерваний прогін
+    безпечно продовжується наступним запуском. Повертає кількість перенесених.
+    """
+    cutoff = (datetime.now(timezone.utc) - timedelta(days=older_than_days)).strftime('%Y-%m-%d %H:%M:%S')
+    statuses = ', '.join([PLACEHOLDER] * len(ARCHIVE_STATUSES))
+    select = f'''SELECT id FROM orders WHERE status IN ({statuses}) AND created_at < {PLACEHOLDER}
+                 ORDER BY created_at, id LIMIT {PLACEHOLDER}'''
+    moved = 0
+    batches = 0
+
+    while max_batches is None or batches < max_batches:
+        with track_db():
+            conn = get_connection()
+            c = conn.cursor()
+            try:
+                begin_write(c)
+                c.execute(select, (*ARCHIVE_STATUSES, cutoff, batch_size))
+                ids = [row['id'] for row in c.fetchall()]
+                if ids:
+                    marks = ', '.join([PLACEHOLDER] * len(ids))
+                    c.execute(f'''INSERT INTO orders_archive ({ORDER_COLUMNS})
+                                  SELECT {ORDER_COLUMNS} FROM orders WHERE id IN ({marks})
+                                  ON CONFLICT (id) DO NOTHING''', ids)
+                    c.execute(f'DELETE FROM orders WHERE id IN ({marks})', ids)
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+            finally:
+                conn.close()
+
+        moved += len(ids)
+        batches += 1
+        if len(ids) < batch_size:
+            break
+
+    if moved:
+        _archive_horizon_cache[1] = None
+    return moved
+
+
+def iter_orders(date_from=None, date_to=None, batch_size=500):
+    """
+    Потоково читати замовлення за період [date_from, date_to) порціями по batch_size:
+    іменований (server-side) курсор на PostgreSQL, fetchmany по курсору на SQLite.
+    В пам'яті одночасно тільки одна порція.
+    """
+    placeholder = PLACEHOLDER
+    conditions, params = [], []
+    if date_from:
+        conditions.append(f'created_at >= {placeholder}')
+        params.append(date_from)
+    if date_to:
+        conditions.append(f'created_at < {placeholder}')
+        params.append(date_to)
+    where = f" WHERE {' AND '.join(conditions)}" if conditions else ''
+
+    conn = get_connection()
+    try:
+        if DATABASE_URL:
+            c = conn.cursor(name='orders_export')
+            c.itersize = batch_size
+        else:
+            c = conn.cursor()
+        columns = 'id, created_at, status, payment_method, total_price, user_id, username, products'
+        c.execute(f'''SELECT {columns} FROM orders{where}
+                      UNION ALL
+                      SELECT {columns} FROM orders_archive{where}
+                      ORDER BY created_at, id''', params * 2)
+        while True:
+            rows = c.fetchmany(batch_size)
+            if not rows:
+                break
+            for row in rows:
+                yield dict(row)
+    finally:
+        conn.close()
+
+
+# Кеш історії замовлень: user_id -> {(limit, before_id): (час, результат)}.
+# Скидається для користувача при add_order і зміні статусу, TTL - страховка для інших процесів.
+USER_ORDERS_CACHE_TTL = 60
+USER_ORDERS_CACHE_USERS = 1000
+_user_orders_cache = OrderedDict()
+_user_orders_lock = threading.Lock()
+
+
+def _invalidate_user_orders(user_id):
+    with _user_orders_lock:
+        _user_orders_cache.pop(user_id, None)
+
+
+def get_user_orders(user_id, limit=5, before_id=None):
+    """
+    Сторінка історії замовлень користувача, новіші першими: (rows, has_more).
+    Один range scan по індексу (user_id, created_at) з keyset курсором before_id.
+    """
+    key = (limit, before_id)
+    now = time.monotonic()
+    with _user_orders_lock:
+        pages = _user_orders_cache.get(user_id)
+        if pages is not None:
+            _user_orders_cache.move_to_end(user_id)
+            cached = pages.get(key)
+            if cached is not None and now - cached[0] < USER_ORDERS_CACHE_TTL:
+                return cached[1]
+
+    placeholder = PLACEHOLDER
+    where = f'user_id = {placeholder}'
+    params = [user_id]
+    if before_id is not None:
+        # Курсор може бути вже в архіві
+        where += f''' AND (created_at, id) < (SELECT created_at, id FROM orders
+                                                 WHERE id = {placeholder} AND user_id = {placeholder}
+                                                 UNION ALL
+                                                 SELECT created_at, id FROM orders_archive
+                                                 WHERE id = {placeholder} AND user_id = {placeholder})'''
+        params += [before_id, user_id, before_id, user_id]
+
+    rows = _recent_orders(where, params, limit + 1,
+                          columns='id, created_at, status, payment_method, total_price, products')
+    result = (rows[:limit], len(rows) > limit)
+
+    with _user_orders_lock:
+        _user_orders_cache.setdefault(user_id, {})[key] = (now, result)
+        _user_orders_cache.move_to_end(user_id)
+        while len(_user_orders_cache) > USER_ORDERS_CACHE_USERS:
+            _user_orders_cache.popitem(last=False)
+    return result
+
+
+# Дозволені переходи статусів замовлення
+ORDER_TRANSITIONS = {
+    'pending': ('paid', 'cancelled'),
+    'paid': ('shipped', 'cancelled'),
+    'shipped': ('done',),
+}
+
+
+def get_orders_by_status(status, limit=10):
+    """Черга замовлень у статусі (індекс по status, created_at)"""
+    return _recent_orders(f'status = {PLACEHOLDER}', (status,), limit, archived=status in ARCHIVE_STATUSES)
+
+
+def update_order_status(order_id, from_status, to_status):
+    """
+    Compare-and-set статусу одним UPDATE: змінюється тільки якщо замовлення досі в from_status.
+    При скасуванні на склад у тій самій транзакції повертається тільки те, що було списано
+    підтвердженими резервами (stock_committed) - прострочені резерви вже повернуті.
+    """
+    if to_status not in ORDER_TRANSITIONS.get(from_status, ()):
+        return False
+
+    with track_db():
+        conn = get_connection()
+        c = conn.cursor()
+        try:
+            begin_write(c)
+            c.execute(statement('UPDATE orders SET status = ? WHERE id = ? AND status = ?'),
+                      (to_status, order_id, from_status))
+            changed = c.rowcount == 1
+            if not changed:
+                conn.rollback()
+                return False
+
+            c.execute(statement('''SELECT user_id, products, total_price, payment_method, created_at, stock_committed
+                                   FROM orders WHERE id = ?'''), (order_id,))
+            order = c.fetchone()
+
+            if to_status == 'cancelled':
+                items = json.loads(order['products'])
+                for product_id, size, qty in json.loads(order['stock_committed'] or '[]'):
+                    c.execute(statement('UPDATE stock SET qty = qty + ? WHERE product_id = ? AND size = ?'),
+                              (qty, product_id, size))
+
+                # Скасоване замовлення більше не рахується в продажах
+                sales = SalesDelta()
+                sales.add(_sales_day(order['created_at']), items, order['total_price'],
+                          order['payment_method'], _product_categories(c, items))
+                sales.write(c, sign=-1)
+
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+
+    _invalidate_user_orders(order['user_id'])
+    return True
+
+
+# Зведення продажів: рядок на день / день+товар+розмір / день+спосіб оплати.
+# Звіти читають тільки ці таблиці і ніколи не сканують orders.
+SALES_TABLES = ('sales_daily', 'sales_daily_products', 'sales_daily_payments')
+
+
+def _sales_day(created_at):
+    """День (UTC) для зведень: 'YYYY-MM-DD' з created_at замовлення"""
+    return str(created_at)[:10]
+
+
+def _item_quantity(item):
+    try:
+        return max(1, int(item.get('quantity', 1)))
+    except (TypeError, ValueError):
+        return 1
+
+
+def _product_categories(c, items):
+    """Категорії товарів замовлення одним запитом"""
+    ids = sorted({item.get('id') for item in items if isinstance(item.get('id'), int)})
+    if not ids:
+        return {}
+    placeholder = PLACEHOLDER
+    c.execute(f'SELECT id, category FROM products WHERE id IN ({", ".join([placeholder] * len(ids))})', ids)
+    return {row['id']: row['category'] for row in c.fetchall()}
+
+
+class SalesDelta:
+    """Накопичені зміни зведень, які записуються кількома upsert'ами"""
+
+    def __init__(self):
+        self.days = {}      # day -> [orders, units, revenue]
+        self.products = {}  # (day, product_id, size) -> [category, units, revenue]
+        self.payments = {}  # (day, payment_method) -> [orders, revenue]
+
+    def add(self, day, items, total_price, payment_method, categories):
+        units = 0
+        for item in items:
+            product_id = item.get('id')
+            if product_id is None:
+                continue
+            quantity = _item_quantity(item)
+            units += quantity
+            line = self.products.setdefault(
+                (day, product_id, str(item.get('size', '')).strip()),
+                [categories.get(product_id), 0, 0.0]
+            )
+            line[1] += quantity
+            line[2] += float(item.get('price') or 0) * quantity
+
+        totals = self.days.setdefault(day, [0, 0, 0.0])
+        totals[0] += 1
+        totals[1] += units
+        totals[2] += float(total_price or 0)
+
+        payment = self.payments.setdefault((day, payment_method or 'unknown'), [0, 0.0])
+        payment[0] += 1
+        payment[1] += float(total_price or 0)
+
+    def write(self, c, sign=1):
+        """Додати (sign=1) або відняти (sign=-1) накопичене від таблиць зведень"""
+        c.executemany(statement('''INSERT INTO sales_daily (day, orders, units, revenue)
+                                    VALUES (?, ?, ?, ?)
+                                    ON CONFLICT (day) DO UPDATE SET
+                                    orders = sales_daily.orders + excluded.orders,
+                                    units = sales_daily.units + excluded.units,
+                                    revenue = sales_daily.revenue + excluded.revenue'''),
+                      [(day, sign * orders, sign * units, sign * revenue)
+                       for day, (orders, units, revenue) in self.days.items()])
+        c.executemany(statement('''INSERT INTO sales_daily_products (day, product_id, size, category, units, revenue)
+                                    VALUES (?, ?, ?, ?, ?, ?)
+                                    ON CONFLICT (day, product_id, size) DO UPDATE SET
+                                    units = sales_daily_products.units + excluded.units,
+                                    revenue = sales_daily_products.revenue + excluded.revenue'''),
+                      [(day, product_id, size, category, sign * units, sign * revenue)
+                       for (day, product_id, size), (category, units, revenue) in self.products.items()])
+        c.executemany(statement('''INSERT INTO sales_daily_payments (day, payment_method, orders, revenue)
+                                    VALUES (?, ?, ?, ?)
+                                    ON CONFLICT (day, payment_method) DO UPDATE SET
+                                    orders = sales_daily_payments.orders + excluded.orders,
+                                    revenue = sales_daily_payments.revenue + excluded.revenue'''),
+                      [(day, method, sign * orders, sign * revenue)
+                       for (day, method), (orders, revenue) in self.payments.items()])
+
+
+def rebuild_sales_rollups():
+    """
+    Перерахувати зведення з усіх нескасованих замовлень (backfill або після ручних правок).
+    Замовлення читаються курсором по одному, зведення пишуться однією транзакцією.
+    Повертає кількість врахованих замовлень.
+    """
+    with track_db():
+        conn = get_connection()
+        c = conn.cursor()
+        try:
+            begin_write(c)
+            c.execute('SELECT id, category FROM products')
+            categories = {row['id']: row['category'] for row in c.fetchall()}
+
+            sales = SalesDelta()
+            count = 0
+            c.execute('''SELECT products, total_price, payment_method, created_at
+                         FROM orders WHERE status <> 'cancelled' OR status IS NULL
+                         UNION ALL
+                         SELECT products, total_price, payment_method, created_at
+                         FROM orders_archive WHERE status <> 'cancelled' OR status IS NULL''')
+            for row in c:
+                try:
+                    items = json.loads(row['products'])
+                except (TypeError, ValueError):
+                    items = []
+                sales.add(_sales_day(row['created_at']), items, row['total_price'],
+                          row['payment_method'], categories)
+                count += 1
+
+            for table in SALES_TABLES:
+                c.execute(f'DELETE FROM {table}')
+            sales.write(c)
+
+            conn.commit()
+            return count
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+
+
+def get_sales_stats(days=7, top=5):
+    """
+    Звіт за останні days днів тільки з таблиць зведень:
+    по днях, підсумок, топ товарів, розміри, категорії, способи оплати.
+    """
+    placeholder = PLACEHOLDER
+    since = (datetime.now(timezone.utc).date() - timedelta(days=max(1, days) - 1)).isoformat()
+
+    with track_db():
+        conn = get_connection(read=True)
+        c = conn.cursor()
+        try:
+            c.execute(f'''SELECT day, orders, units, revenue FROM sales_daily
+                          WHERE day >= {placeholder} ORDER BY day''', (since,))
+            daily = [dict(row) for row in c.fetchall()]
+
+            c.execute(f'''SELECT s.product_id, p.name, SUM(s.units) AS units, SUM(s.revenue) AS revenue
+                          FROM sales_daily_products s LEFT JOIN products p ON p.id = s.product_id
+                          WHERE s.day >= {placeholder}
+                          GROUP BY s.product_id, p.name HAVING SUM(s.units) > 0
+                          ORDER BY revenue DESC LIMIT {placeholder}''', (since, top))
+            top_products = [dict(row) for row in c.fetchall()]
+
+            c.execute(f'''SELECT size, SUM(units) AS units FROM sales_daily_products
+                          WHERE day >= {placeholder} GROUP BY size HAVING SUM(units) > 0
+                          ORDER BY units DESC''', (since,))
+            sizes = [dict(row) for row in c.fetchall()]
+
+            c.execute(f'''SELECT category, SUM(units) AS units, SUM(revenue) AS revenue
+                          FROM sales_daily_products
+                          WHERE day >= {placeholder} GROUP BY category HAVING SUM(units) > 0
+                          ORDER BY revenue DESC''', (since,))
+            categories = [dict(row) for row in c.fetchall()]
+
+            c.execute(f'''SELECT payment_method, SUM(orders) AS orders, SUM(revenue) AS revenue
+                          FROM sales_daily_payments
+                          WHERE day >= {placeholder} GROUP BY payment_method HAVING SUM(orders) > 0
+                          ORDER BY revenue DESC''', (since,))
+            payments = [dict(row) for row in c.fetchall()]
+        finally:
+            conn.close()
+
+    for row in daily + top_products + categories + payments:
+        row['revenue'] = round(row['revenue'] or 0, 2)
+
+    return {
+        'since': since,
+        'daily': daily,
+        'totals': {
+            'orders': sum(row['orders'] for row in daily),
+            'units': sum(row['units'] for row in daily),
+            'revenue': round(sum(row['revenue'] for row in daily), 2),
+        },
+        'top_products': top_products,
+        'sizes': sizes,
+        'categories': categories,
+        'payments': payments,
+    }
+
+
+# Однаковий upsert для обох бекендів (SQLite >= 3.24); його ж міряє benchmarks/db_micro.py
+SAVE_USER_QUERY = statement('''INSERT INTO users (user_id, username, first_name, last_name, is_admin)
+                               VALUES (?, ?, ?, ?, ?)
+                               ON CONFLICT (user_id) DO UPDATE SET
+                               username = excluded.username,
+                               first_name = excluded.first_name,
+                               last_name = excluded.last_name,
+                               is_admin = excluded.is_admin''')
 
 
 def save_user(user_id, username, first_name, last_name, is_admin=0):
     """Зберегти користувача"""
-    if DATABASE_URL:
-        query = '''INSERT INTO users (user_id, username, first_name, last_name, is_admin)
-                   VALUES (%s, %s, %s, %s, %s)
-                   ON CONFLICT (user_id) DO UPDATE SET
-                   username = EXCLUDED.username,
-                   first_name = EXCLUDED.first_name,
-                   last_name = EXCLUDED.last_name,
-                   is_admin = EXCLUDED.is_admin'''
-    else:
-        query = '''INSERT OR REPLACE INTO users (user_id, username, first_name, last_name, is_admin)
-                   VALUES (?, ?, ?, ?, ?)'''
+    query = SAVE_USER_QUERY
     
     # Не використовуємо execute_query для upsert - виконуємо напряму
-    conn = get_connection()
-    c = conn.cursor()
-    c.execute(query, (user_id, username, first_name, last_name, is_admin))
-    conn.commit()
-    conn.close()
+    with track_db():
+        conn = get_connection()
+        c = conn.cursor()
+        c.execute(query, (user_id, username, first_name, last_name, is_admin))
+        conn.commit()
+        conn.close()
+
+
+# Залишки та резерви
+RESERVATION_TTL = int(os.getenv('RESERVATION_TTL', '1800'))  # секунд
+
+
+def set_stock(product_id, size, qty):
+    """Встановити залишок розміру товару"""
+    query = statement('''INSERT INTO stock (product_id, size, qty) VALUES (?, ?, ?)
+                         ON CONFLICT (product_id, size) DO UPDATE SET qty = excluded.qty''')
+    execute_query(query, (product_id, size.strip(), qty))
+
+
+def get_stock(product_id=None):
+    """Залишки у вигляді {product_id: {size: qty}} (один запит, без блокувань записів)"""
+    if product_id is None:
+        rows = execute_query('SELECT product_id, size, qty FROM stock', fetch=True)
+    else:
+        rows = execute_query(statement('SELECT product_id, size, qty FROM stock WHERE product_id = ?'),
+                             (product_id,), fetch=True)
+
+    stock = {}
+    for row in rows:
+        stock.setdefault(row['product_id'], {})[row['size']] = row['qty']
+    return stock
+
+
+def reserve_stock(user_id, items, ttl=RESERVATION_TTL):
+    """
+    Атомарно зарезервувати позиції кошика [(product_id, size, qty)] однією транзакцією.
+    Кожна позиція списується умовним UPDATE ... WHERE qty >= n, тому двоє покупців
+    не можуть забрати останню одиницю. Розміри без запису в stock не обмежені,
+    але мають бути серед розмірів товару (products.sizes).
+    Повертає (reservation_ids, unavailable); якщо щось недоступне - нічого не резервується.
+    """
+    wanted = {}
+    for product_id, size, qty in items:
+        key = (product_id, str(size).strip())
+        wanted[key] = wanted.get(key, 0) + qty
+
+    expires_at = time.time() + ttl
+    reservation_ids = []
+    unavailable = []
+
+    with track_db():
+        conn = get_connection()
+        c = conn.cursor()
+        try:
+            begin_write(c)
+            # Фіксований порядок блокувань - без deadlock між паралельними checkout
+            for (product_id, size), qty in sorted(wanted.items()):
+                c.execute(statement('UPDATE stock SET qty = qty - ? WHERE product_id = ? AND size = ? AND qty >= ?'),
+                          (qty, product_id, size, qty))
+                if c.rowcount == 1:
+                    insert = statement('''INSERT INTO stock_reservations (user_id, product_id, size, qty, expires_at)
+                                          VALUES (?, ?, ?, ?, ?)''')
+                    params = (user_id, product_id, size, qty, expires_at)
+                    if DATABASE_URL:
+                        c.execute(_returning_id(insert), params)
+                        reservation_ids.append(c.fetchone()['id'])
+                    else:
+                        c.execute(insert, params)
+                        reservation_ids.append(c.lastrowid)
+                    continue
+
+                c.execute(statement('SELECT qty FROM stock WHERE product_id = ? AND size = ?'), (product_id, size))
+                if c.fetchone() is not None or size not in _product_sizes(c, product_id):
+                    unavailable.append((product_id, size))
+
+            if unavailable:
+                conn.rollback()
+                return [], unavailable
+            conn.commit()
+            return reservation_ids, []
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+
+
+def _product_sizes(c, product_id):
+    """Розміри товару з products.sizes ('S, M, L' -> {'S', 'M', 'L'}); порожньо - товару немає"""
+    c.execute(statement('SELECT sizes FROM products WHERE id = ?'), (product_id,))
+    row = c.fetchone()
+    if row is None:
+        return set()
+    return {size.strip() for size in (row['sizes'] or '').split(',') if size.strip()}
+
+
+def _delete_reservations(c, reservation_ids):
+    """Видалити резерви і повернути видалені рядки (тільки ті, що ще існували)"""
+    if DATABASE_URL:
+        c.execute('''DELETE FROM stock_reservations WHERE id = ANY(%s)
+                     RETURNING product_id, size, qty''', (list(reservation_ids),))
+        return c.fetchall()
+
+    marks = ', '.join('?' * len(reservation_ids))
+    c.execute(f'SELECT product_id, size, qty FROM stock_reservations WHERE id IN ({marks})',
+              tuple(reservation_ids))
+    rows = c.fetchall()
+    c.execute(f'DELETE FROM stock_reservations WHERE id IN ({marks})', tuple(reservation_ids))
+    return rows
+
+
+def release_reservations(reservation_ids):
+    """Скасувати резерви і повернути товар на склад (ідемпотентно)"""
+    if not reservation_ids:
+        return 0
+
+    with track_db():
+        conn = get_connection()
+        c = conn.cursor()
+        try:
+            begin_write(c)
+            rows = _delete_reservations(c, reservation_ids)
+            for row in rows:
+                c.execute(statement('UPDATE stock SET qty = qty + ? WHERE product_id = ? AND size = ?'),
+                          (row['qty'], row['product_id'], row['size']))
+            conn.commit()
+            return len(rows)
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+
+
+def confirm_reservations(reservation_ids, order_id=None):
+    """
+    Підтвердити резерви після оформлення замовлення (товар залишається списаним).
+    order_id - записати в замовлення, що саме списано (для повернення при скасуванні).
+    """
+    if not reservation_ids:
+        return 0
+
+    with track_db():
+        conn = get_connection()
+        c = conn.cursor()
+        try:
+            begin_write(c)
+            rows = _delete_reservations(c, reservation_ids)
+            if order_id is not None:
+                committed = [[row['product_id'], row['size'], row['qty']] for row in rows]
+                c.execute(statement('UPDATE orders SET stock_committed = ? WHERE id = ?'),
+                          (json.dumps(committed), order_id))
+            conn.commit()
+            return len(rows)
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+
+
+def release_expired_reservations():
+    """Повернути на склад прострочені резерви"""
+    expired = execute_query(statement('SELECT id FROM stock_reservations WHERE expires_at < ?'),
+                            (time.time(),), fetch=True)
+    return release_reservations([row['id'] for row in expired])
@@ -0,0 +1,122 @@
+"""
+Потокове вивантаження замовлень у CSV / NDJSON (звірка з Monobank і USDT гаманцем)
+"""
+import io
+import csv
+import json
+import asyncio
+import threading
+from datetime import date, timedelta
+
+from database import iter_orders
+
+EXPORT_FORMATS = {
+    'csv': ('text/csv', 'csv'),
+    'ndjson': ('application/x-ndjson', 'ndjson'),
+}
+
+ORDER_EXPORT_FIELDS = ('id', 'created_at', 'status', 'payment_method', 'total_price', 'user_id', 'username', 'products')
+
+# Скільки рядків збирати в один шматок відповіді
+EXPORT_CHUNK_ROWS = 200
+
+
+def parse_export_range(date_from=None, date_to=None):
+    """
+    'YYYY-MM-DD' (обидві межі включно) -> (from, to) для iter_orders, де to - наступний день.
+    ValueError при невірній даті.
+    """
+    start = date.fromisoformat(date_from).isoformat() if date_from else None
+    end = (date.fromisoformat(date_to) + timedelta(days=1)).isoformat() if date_to else None
+    return start, end
+
+
+def iter_order_export(fmt='csv', date_from=None, date_to=None, chunk_rows=EXPORT_CHUNK_ROWS):
+    """Генератор шматків bytes: заголовок CSV і далі по chunk_rows замовлень"""
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"Unknown export format: {fmt}")
+
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    if fmt == 'csv':
+        writer.writerow(ORDER_EXPORT_FIELDS)
+
+    rows = 0
+    for order in iter_orders(date_from, date_to):
+        if fmt == 'csv':
+            writer.writerow([order[field] for field in ORDER_EXPORT_FIELDS])
+        else:
+            try:
+                order['products'] = json.loads(order['products'])
+            except (TypeError, ValueError):
+                pass
+            buffer.write(json.dumps(order, ensure_ascii=False, default=str))
+            buffer.write('\n')
+
+        rows += 1
+        if rows % chunk_rows == 0:
+            yield buffer.getvalue().encode('utf-8')
+            buffer.seek(0)
+            buffer.truncate()
+
+    if buffer.tell():
+        yield buffer.getvalue().encode('utf-8')
+
+
+def write_order_export(path, fmt='csv', date_from=None, date_to=None):
+    """Записати вивантаження у файл (для відправки документом). Повертає розмір в байтах"""
+    size = 0
+    with open(path, 'wb') as f:
+        for chunk in iter_order_export(fmt, date_from, date_to):
+            f.write(chunk)
+            size += len(chunk)
+    return size
+
+
+_DONE = object()
+
+
+async def aiter_in_thread(make_iterator, max_pending=4):
+    """
+    Асинхронно ітерувати блокуючий генератор, який повністю живе в одному потоці
+    (з'єднання SQLite не можна передавати між потоками). Черга обмежена max_pending,
+    тому повільний клієнт зупиняє читання з БД, а не накопичує дані в пам'яті.
+    """
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue(max_pending)
+    stop = threading.Event()
+
+    def put(item):
+        asyncio.run_coroutine_threadsafe(queue.put(item), loop).result()
+
+    def produce():
+        iterator = make_iterator()
+        try:
+            for item in iterator:
+                if stop.is_set():
+                    break
+                put(item)
+        except Exception as e:
+            put(e)
+        finally:
+            iterator.close()
+            put(_DONE)
+
+    task = loop.run_in_executor(None, produce)
+    try:
+        while True:
+            item = await queue.get()
+            if item is _DONE:
+                break
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        stop.set()
+        # Звільняємо чергу, щоб потік не завис на put після відключення клієнта
+        while not task.done():
+            try:
+                queue.get_nowait()
+            except asyncio.QueueEmpty:
+                await asyncio.sleep(0.01)
+        await task
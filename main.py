@@ -4,10 +4,16 @@
 import os
 import asyncio
 import json
-from datetime import datetime
+import tempfile
+from datetime import datetime, timezone
 from aiohttp import web
+from aiogram.utils.web_app import safe_parse_webapp_init_data
 from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
-from bot import dp, bot, init_db
+import metrics
+from bot import (
+    dp, bot, init_db, catch_up_pending_updates, fast_startup, reservation_sweeper, order_archiver,
+    startup_stats, ALLOWED_UPDATES, CATCHUP_THRESHOLD, is_admin_request
+)
 
 # Custom JSON encoder для datetime
 class DateTimeEncoder(json.JSONEncoder):
@@ -20,6 +26,26 @@ class DateTimeEncoder(json.JSONEncoder):
 WEBHOOK_PATH = "/webhook/bot"
 WEBHOOK_URL = os.getenv('WEBHOOK_URL', 'https://driphype-api.onrender.com/webhook/bot')
 
+# Скільки секунд дійсний initData міні-додатку
+INIT_DATA_MAX_AGE = 24 * 3600
+
+def get_webapp_user_id(request):
+    """ID користувача з підписаного Telegram initData (заголовок X-Telegram-Init-Data) або None"""
+    init_data = request.headers.get('X-Telegram-Init-Data', '')
+    if not init_data:
+        return None
+    try:
+        data = safe_parse_webapp_init_data(bot.token, init_data)
+    except ValueError:
+        return None
+    age = (datetime.now(timezone.utc) - data.auth_date).total_seconds()
+    if age > INIT_DATA_MAX_AGE or data.user is None:
+        return None
+    return data.user.id
+
+# Опціонально: каталог для /api/products серіалізує сама база (json_agg / json_group_array)
+CATALOG_JSON_IN_DB = os.getenv('CATALOG_JSON_IN_DB', '0') == '1'
+
 # Глобальна змінна для контролю фонового таску
 background_tasks = set()
 
@@ -36,24 +62,39 @@ async def home(request):
         'endpoints': {
             '/api/products': 'GET - Отримати всі товари',
             '/api/products/{id}': 'GET - Отримати товар за ID',
+            '/api/products/{id}/similar': 'GET - Схожі товари (?limit=8)',
+            '/api/stock': 'GET - Залишки по розмірах',
+            '/api/search': 'GET - Пошук товарів (?q=&limit=20&offset=0)',
+            '/api/users/{id}/orders': 'GET - Історія замовлень (Telegram initData, ?limit=10&before=)',
+            '/api/stats': 'GET - Продажі з денних зведень (admin, ?days=7)',
+            '/api/orders/export': 'GET - Вивантаження замовлень (admin, ?format=csv|ndjson&from=&to=)',
+            '/api/products/import': 'POST - Імпорт товарів з CSV/JSON (admin, ?format=csv|json&dry_run=1)',
             '/webhook/bot': 'POST - Telegram webhook',
             '/status': 'GET - Bot status dashboard',
+            '/metrics': 'GET - Метрики часу обробки (admin)',
+            '/api/db/queries': 'GET - Статистика SQL і slow-query лог (admin, ?limit=50&order=total_ms)',
+            '/api/db/queries/reset': 'POST - Скинути статистику SQL (admin)',
+            '/api/debug/profile': 'GET - Семплюючий профіль процесу (admin, ?seconds=10&interval_ms=5&format=json|collapsed)',
             '/bot/update-webhook': 'GET - Force update webhook'
         }
     })
 
 @routes.get('/api/products')
 async def get_products(request):
-    """Отримати всі товари"""
+    """Отримати всі товари (зі знімка каталогу в пам'яті, з розібраними sizes_list)"""
     try:
-        from database import get_all_products
+        from database import get_all_products_json
+        from catalog import catalog
         loop = asyncio.get_event_loop()
-        products = await loop.run_in_executor(None, get_all_products)
+        if CATALOG_JSON_IN_DB:
+            body = await loop.run_in_executor(None, get_all_products_json)
+            return web.Response(body=body, content_type='application/json', charset='utf-8')
         
-        return web.Response(
-            text=json.dumps(products, cls=DateTimeEncoder),
-            content_type='application/json'
-        )
+        # Перше звернення після зміни каталогу читає БД і кодує JSON - тому не в event loop
+        _, body, etag = await loop.run_in_executor(None, lambda: catalog.get().json())
+        if etag in request.headers.get('If-None-Match', ''):
+            return web.Response(status=304, headers={'ETag': etag})
+        return web.Response(body=body, content_type='application/json', charset='utf-8', headers={'ETag': etag})
     except Exception as e:
         import traceback
         traceback.print_exc()
@@ -81,11 +122,275 @@ async def get_product(request):
         traceback.print_exc()
         return web.json_response({'error': str(e)}, status=500)
 
+@routes.get('/api/products/{product_id}/similar')
+async def get_similar_products(request):
+    """Схожі товари з попередньо обчисленого індексу в пам'яті"""
+    from recommendations import similar_products, SIMILAR_TOP_K
+    try:
+        limit = max(1, min(int(request.query.get('limit', SIMILAR_TOP_K)), SIMILAR_TOP_K))
+    except ValueError:
+        return web.json_response({'error': 'Invalid limit'}, status=400)
+    
+    try:
+        product_id = int(request.match_info['product_id'])
+        
+        # Перше звернення будує індекс з БД - тому не в event loop
+        loop = asyncio.get_event_loop()
+        similar = await loop.run_in_executor(None, similar_products.similar, product_id, limit)
+        
+        if similar is None:
+            return web.json_response({'error': 'Product not found'}, status=404)
+        return web.Response(
+            text=json.dumps(similar, cls=DateTimeEncoder),
+            content_type='application/json'
+        )
+    except ValueError:
+        return web.json_response({'error': 'Invalid product id'}, status=400)
+    except Exception as e:
+        import traceback
+        traceback.print_exc()
+        return web.json_response({'error': str(e)}, status=500)
+
+@routes.get('/api/search')
+async def search(request):
+    """Повнотекстовий пошук товарів з пагінацією: ?q=&limit=20&offset=0"""
+    query = request.query.get('q', '').strip()[:100]
+    try:
+        limit = max(1, min(int(request.query.get('limit', 20)), 50))
+        offset = max(0, int(request.query.get('offset', 0)))
+    except ValueError:
+        return web.json_response({'error': 'Invalid limit/offset'}, status=400)
+    
+    try:
+        from database import search_products
+        results = []
+        if query:
+            # Беремо на один рядок більше, щоб знати чи є наступна сторінка
+            loop = asyncio.get_event_loop()
+            results = await loop.run_in_executor(None, search_products, query, limit + 1, offset)
+        
+        has_more = len(results) > limit
+        return web.Response(
+            text=json.dumps({
+                'query': query,
+                'results': results[:limit],
+                'offset': offset,
+                'next_offset': offset + limit if has_more else None,
+            }, cls=DateTimeEncoder),
+            content_type='application/json'
+        )
+    except Exception as e:
+        import traceback
+        traceback.print_exc()
+        return web.json_response({'error': str(e)}, status=500)
+
+@routes.get('/api/users/{user_id}/orders')
+async def get_user_orders_api(request):
+    """Історія замовлень користувача: тільки свої (initData) або будь-чиї для адміна"""
+    try:
+        user_id = int(request.match_info['user_id'])
+        limit = max(1, min(int(request.query.get('limit', 10)), 50))
+        before_id = int(request.query['before']) if request.query.get('before') else None
+    except ValueError:
+        return web.json_response({'error': 'Invalid parameters'}, status=400)
+    
+    if get_webapp_user_id(request) != user_id and not is_admin_request(request):
+        return web.json_response({'error': 'Forbidden'}, status=403)
+    
+    try:
+        from database import get_user_orders
+        loop = asyncio.get_event_loop()
+        orders, has_more = await loop.run_in_executor(None, get_user_orders, user_id, limit, before_id)
+        
+        # Копії рядків: результат get_user_orders кешується
+        items = []
+        for order in orders:
+            order = dict(order)
+            try:
+                order['products'] = json.loads(order['products'])
+            except (TypeError, ValueError):
+                pass
+            items.append(order)
+        
+        return web.Response(
+            text=json.dumps({
+                'orders': items,
+                'next_before': orders[-1]['id'] if has_more else None,
+            }, cls=DateTimeEncoder),
+            content_type='application/json'
+        )
+    except Exception as e:
+        import traceback
+        traceback.print_exc()
+        return web.json_response({'error': str(e)}, status=500)
+
+@routes.get('/api/stock')
+async def get_stock(request):
+    """Залишки по розмірах: {product_id: {size: qty}}"""
+    try:
+        from database import get_stock as db_get_stock
+        loop = asyncio.get_event_loop()
+        stock = await loop.run_in_executor(None, db_get_stock)
+        return web.json_response(stock)
+    except Exception as e:
+        import traceback
+        traceback.print_exc()
+        return web.json_response({'error': str(e)}, status=500)
+
+@routes.get('/api/stats')
+async def get_stats(request):
+    """Звіт продажів тільки з таблиць зведень (admin)"""
+    if not is_admin_request(request):
+        return web.json_response({'error': 'Forbidden'}, status=403)
+    
+    try:
+        from database import get_sales_stats
+        days = max(1, min(int(request.query.get('days', 7)), 365))
+        loop = asyncio.get_event_loop()
+        stats = await loop.run_in_executor(None, get_sales_stats, days)
+        return web.json_response(stats)
+    except ValueError:
+        return web.json_response({'error': 'Invalid days'}, status=400)
+    except Exception as e:
+        import traceback
+        traceback.print_exc()
+        return web.json_response({'error': str(e)}, status=500)
+
+@routes.get('/api/orders/export')
+async def export_orders(request):
+    """Потокове вивантаження замовлень у CSV/NDJSON за період (admin)"""
+    if not is_admin_request(request):
+        return web.json_response({'error': 'Forbidden'}, status=403)
+    
+    from exports import EXPORT_FORMATS, parse_export_range, iter_order_export, aiter_in_thread
+    fmt = request.query.get('format', 'csv')
+    if fmt not in EXPORT_FORMATS:
+        return web.json_response({'error': 'Invalid format'}, status=400)
+    try:
+        date_from, date_to = parse_export_range(request.query.get('from'), request.query.get('to'))
+    except ValueError:
+        return web.json_response({'error': 'Invalid date, expected YYYY-MM-DD'}, status=400)
+    
+    content_type, extension = EXPORT_FORMATS[fmt]
+    response = web.StreamResponse(headers={
+        'Content-Type': f'{content_type}; charset=utf-8',
+        'Content-Disposition': f'attachment; filename="orders.{extension}"',
+    })
+    await response.prepare(request)
+    
+    # Шматки читаються з курсора в окремому потоці і віддаються клієнту по мірі готовності
+    async for chunk in aiter_in_thread(lambda: iter_order_export(fmt, date_from, date_to)):
+        await response.write(chunk)
+    await response.write_eof()
+    return response
+
+@routes.post('/api/products/import')
+async def import_products_api(request):
+    """Масовий імпорт товарів з тіла запиту (CSV або JSON/NDJSON, admin)"""
+    if not is_admin_request(request):
+        return web.json_response({'error': 'Forbidden'}, status=403)
+    
+    from catalog_import import MAX_IMPORT_BYTES, detect_format, import_products
+    fmt = request.query.get('format') or detect_format(content_type=request.content_type)
+    if fmt not in ('csv', 'json'):
+        return web.json_response({'error': 'Unknown format, use ?format=csv|json'}, status=400)
+    dry_run = request.query.get('dry_run') in ('1', 'true')
+    
+    # Тіло пишеться в тимчасовий файл шматками і розбирається потоком з диска
+    with tempfile.TemporaryFile() as body:
+        size = 0
+        async for chunk in request.content.iter_chunked(65536):
+            size += len(chunk)
+            if size > MAX_IMPORT_BYTES:
+                return web.json_response({'error': 'File too large'}, status=413)
+            body.write(chunk)
+        body.seek(0)
+        
+        try:
+            loop = asyncio.get_event_loop()
+            report = await loop.run_in_executor(None, import_products, body, fmt, dry_run)
+        except Exception as e:
+            import traceback
+            traceback.print_exc()
+            return web.json_response({'error': str(e)}, status=500)
+    
+    report['errors'] = [{'line': line, 'error': error} for line, error in report['errors']]
+    return web.json_response(report)
+
 @routes.get('/health')
 async def health(request):
     """Health check"""
     return web.json_response({'status': 'healthy'})
 
+@routes.get('/metrics')
+async def get_metrics(request):
+    """Час обробки апдейтів, хендлерів, БД і Telegram API (admin)"""
+    if not is_admin_request(request):
+        return web.json_response({'error': 'Forbidden'}, status=403)
+    return web.json_response(metrics.snapshot())
+
+@routes.get('/api/db/queries')
+async def get_query_stats(request):
+    """Час запитів по нормалізованому SQL і останні повільні запити з планами (admin)"""
+    if not is_admin_request(request):
+        return web.json_response({'error': 'Forbidden'}, status=403)
+    
+    from database import SLOW_QUERY_MS
+    order_by = request.query.get('order', 'total_ms')
+    if order_by not in ('total_ms', 'count', 'avg_ms', 'max_ms', 'p95_ms'):
+        return web.json_response({'error': 'Invalid order'}, status=400)
+    try:
+        limit = max(1, min(int(request.query.get('limit', 50)), 500))
+    except ValueError:
+        return web.json_response({'error': 'Invalid limit'}, status=400)
+    
+    return web.json_response({'slow_query_ms': SLOW_QUERY_MS, **metrics.query_stats(limit, order_by)})
+
+@routes.post('/api/db/queries/reset')
+async def reset_query_stats(request):
+    """Скинути статистику SQL (admin)"""
+    if not is_admin_request(request):
+        return web.json_response({'error': 'Forbidden'}, status=403)
+    
+    metrics.reset_query_stats()
+    return web.json_response({'status': 'reset'})
+
+@routes.get('/api/debug/profile')
+async def debug_profile(request):
+    """Профіль живого процесу за N секунд: collapsed stacks або топ функцій (admin)"""
+    if not is_admin_request(request):
+        return web.json_response({'error': 'Forbidden'}, status=403)
+    
+    from profiler import MAX_PROFILE_SECONDS, ProfilerBusy, profile
+    fmt = request.query.get('format', 'json')
+    if fmt not in ('json', 'collapsed'):
+        return web.json_response({'error': 'Invalid format'}, status=400)
+    try:
+        seconds = float(request.query.get('seconds', 10))
+        interval_ms = float(request.query.get('interval_ms', 5))
+    except ValueError:
+        return web.json_response({'error': 'Invalid parameters'}, status=400)
+    if not 0 < seconds <= MAX_PROFILE_SECONDS or not 1 <= interval_ms <= 1000:
+        return web.json_response({'error': f'seconds: 0-{MAX_PROFILE_SECONDS}, interval_ms: 1-1000'}, status=400)
+    
+    try:
+        profiler = await profile(seconds, interval_ms / 1000, include_idle=request.query.get('idle') == '1')
+    except ProfilerBusy:
+        return web.json_response({'error': 'Profile is already running'}, status=409)
+    
+    if fmt == 'collapsed':
+        return web.Response(
+            text=profiler.collapsed(),
+            content_type='text/plain',
+            headers={'Content-Disposition': f'attachment; filename="profile_{datetime.now():%Y%m%d_%H%M%S}.collapsed"'}
+        )
+    return web.json_response({
+        'seconds': seconds,
+        'interval_ms': interval_ms,
+        **profiler.top(),
+        'collapsed': profiler.collapsed(),
+    })
+
 # ============================================
 # BOT STATUS DASHBOARD
 # ============================================
@@ -98,6 +403,10 @@ async def bot_status(request):
         bot_info = await bot.get_me()
         
         monitor_status = "🟢 Активний" if len(background_tasks) > 0 else "🔴 Не запущено"
+        ready_in = (
+            f"{startup_stats['ready_in']:.2f}s (від старту процесу {startup_stats['since_process_start']:.2f}s)"
+            if startup_stats else "—"
+        )
         
         html = f"""
         <html>
@@ -188,6 +497,10 @@ async def bot_status(request):
                     <strong>Background Tasks:</strong> {len(background_tasks)}
                 </div>
                 
+                <div class="status-item">
+                    <strong>Startup Time:</strong> {ready_in}
+                </div>
+                
                 <a href="/bot/update-webhook" class="btn">🔄 Force Update Webhook</a>
                 
                 <div class="footer">
@@ -212,7 +525,7 @@ async def update_webhook_manual(request):
         result = await bot.set_webhook(
             url=WEBHOOK_URL,
             drop_pending_updates=True,
-            allowed_updates=["message", "callback_query"]
+            allowed_updates=ALLOWED_UPDATES
         )
         
         webhook_info = await bot.get_webhook_info()
@@ -282,17 +595,18 @@ async def webhook_monitor():
             
             if not webhook_info.url or webhook_info.url != expected_url:
                 print(f"⚠️ Webhook URL неправильний! Очікуємо: {expected_url}, Поточний: {webhook_info.url}")
-                await bot.delete_webhook(drop_pending_updates=True)
-                await asyncio.sleep(2)
-                await bot.set_webhook(url=expected_url, drop_pending_updates=True)
+                # set_webhook замінює URL без видалення - pending updates зберігаються
+                await bot.set_webhook(
+                    url=expected_url,
+                    drop_pending_updates=False,
+                    allowed_updates=ALLOWED_UPDATES
+                )
                 print(f"✅ Webhook автоматично оновлено на {expected_url}")
-                
-            elif webhook_info.pending_update_count > 30:
-                print(f"⚠️ Багато pending updates: {webhook_info.pending_update_count}")
-                await bot.delete_webhook(drop_pending_updates=True)
-                await asyncio.sleep(2)
-                await bot.set_webhook(url=expected_url, drop_pending_updates=True)
-                print("✅ Webhook автоматично перезапущено через pending updates")
+
+            elif webhook_info.pending_update_count > CATCHUP_THRESHOLD:
+                print(f"⚠️ Багато pending updates: {webhook_info.pending_update_count}, вмикаємо catch-up")
+                processed = await catch_up_pending_updates(expected_url, ALLOWED_UPDATES)
+                print(f"✅ Catch-up завершено: оброблено {processed} updates")
                 
             else:
                 print(f"✅ Webhook перевірено: OK (pending: {webhook_info.pending_update_count})")
@@ -319,7 +633,7 @@ async def cors_middleware(request, handler):
     
     response.headers['Access-Control-Allow-Origin'] = '*'
     response.headers['Access-Control-Allow-Methods'] = 'GET, POST, OPTIONS'
-    response.headers['Access-Control-Allow-Headers'] = 'Content-Type'
+    response.headers['Access-Control-Allow-Headers'] = 'Content-Type, Authorization, X-Telegram-Init-Data'
     return response
 
 # ============================================
@@ -330,39 +644,30 @@ async def on_startup(app):
     """Налаштування webhook при старті"""
     print("🚀 Setting up webhook...")
     
-    # Ініціалізуємо БД
-    loop = asyncio.get_event_loop()
-    await loop.run_in_executor(None, init_db)
+    # БД і webhook паралельно; webhook змінюється тільки якщо конфіг відрізняється
+    check_info, changed = await fast_startup(WEBHOOK_URL)
     print("✅ Database initialized")
     
-    # Видаляємо старий webhook
-    await bot.delete_webhook(drop_pending_updates=True)
-    print("✅ Old webhook deleted")
-    await asyncio.sleep(2)
-    
-    # Встановлюємо новий webhook
-    webhook_info = await bot.set_webhook(
-        url=WEBHOOK_URL,
-        drop_pending_updates=True,
-        allowed_updates=["message", "callback_query"]
+    if changed:
+        print(f"✅ Webhook set to: {WEBHOOK_URL} (was: {check_info.url or 'not set'})")
+    else:
+        print(f"✅ Webhook already up to date: {WEBHOOK_URL}")
+    print(f"📋 Webhook status: Pending={check_info.pending_update_count}")
+    print(
+        f"⏱️ Ready in {startup_stats['ready_in']:.2f}s "
+        f"({startup_stats['since_process_start']:.2f}s since process start)"
     )
-    print(f"✅ Webhook set to: {WEBHOOK_URL}")
-    print(f"   Result: {webhook_info}")
-    
-    # Перевіряємо встановлення
-    await asyncio.sleep(1)
-    check_info = await bot.get_webhook_info()
-    print(f"📋 Webhook status: URL={check_info.url}, Pending={check_info.pending_update_count}")
     
-    # Запускаємо фоновий моніторинг
-    task = asyncio.create_task(webhook_monitor())
-    background_tasks.add(task)
-    task.add_done_callback(background_tasks.discard)
+    # Запускаємо фоновий моніторинг і звільнення прострочених резервів
+    for coro in (webhook_monitor(), reservation_sweeper(), order_archiver()):
+        task = asyncio.create_task(coro)
+        background_tasks.add(task)
+        task.add_done_callback(background_tasks.discard)
     print("🔄 Автоматичний моніторинг webhook запущено (перевірка кожні 3 хвилини)")
 
 async def on_shutdown(app):
-    """Видалення webhook при зупинці"""
-    print("🛑 Removing webhook...")
+    """Зупинка фонових тасків (webhook залишається для нового інстансу)"""
+    print("🛑 Shutting down...")
     
     # Скасовуємо всі фонові таски
     for task in background_tasks:
@@ -371,7 +676,6 @@ async def on_shutdown(app):
     if background_tasks:
         await asyncio.gather(*background_tasks, return_exceptions=True)
     
-    await bot.delete_webhook()
     await bot.session.close()
     print("✅ Shutdown complete")
 
@@ -0,0 +1,177 @@
+"""
+Метрики сервісу - час обробки апдейтів, хендлерів, запитів до БД і Telegram API
+"""
+import re
+import time
+import threading
+from collections import deque
+from functools import lru_cache
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+
+def percentile(sorted_values, q):
+    """Перцентиль q (0..100) з відсортованого списку"""
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(q / 100 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+class Timing:
+    """Агрегат часу: кількість, сума, максимум і останні заміри для перцентилів"""
+    __slots__ = ('count', 'total', 'max', 'samples')
+
+    def __init__(self, window=512):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.samples = deque(maxlen=window)
+
+    def add(self, elapsed):
+        self.count += 1
+        self.total += elapsed
+        if elapsed > self.max:
+            self.max = elapsed
+        self.samples.append(elapsed)
+
+    def snapshot(self):
+        ordered = sorted(self.samples)
+        return {
+            'count': self.count,
+            'total_ms': round(self.total * 1000, 3),
+            'avg_ms': round(self.total / self.count * 1000, 3) if self.count else 0.0,
+            'max_ms': round(self.max * 1000, 3),
+            'p50_ms': round(percentile(ordered, 50) * 1000, 3),
+            'p95_ms': round(percentile(ordered, 95) * 1000, 3),
+            'p99_ms': round(percentile(ordered, 99) * 1000, 3),
+        }
+
+
+_lock = threading.Lock()
+_timings = {}  # group -> {name: Timing}
+
+# Останні повільні апдейти з розбивкою часу
+slow_updates = deque(maxlen=50)
+
+
+def observe(group, name, elapsed):
+    """Записати замір часу (в секундах)"""
+    with _lock:
+        timing = _timings.setdefault(group, {}).get(name)
+        if timing is None:
+            timing = _timings[group][name] = Timing()
+        timing.add(elapsed)
+
+
+def snapshot():
+    """Всі метрики у вигляді словника для JSON"""
+    with _lock:
+        result = {
+            group: {name: timing.snapshot() for name, timing in timings.items()}
+            for group, timings in _timings.items()
+        }
+        result['slow_updates'] = list(slow_updates)
+    return result
+
+
+def reset():
+    """Скинути всі метрики"""
+    with _lock:
+        _timings.clear()
+        slow_updates.clear()
+
+
+# Статистика SQL: нормалізований текст запиту -> Timing, і останні повільні запити
+_queries = {}
+slow_queries = deque(maxlen=50)
+
+
+@lru_cache(maxsize=1024)
+def normalize_sql(sql):
+    """Текст запиту без літералів і зайвих пробілів - ключ для агрегації"""
+    sql = re.sub(r"'(?:[^']|'')*'", '?', sql)
+    sql = re.sub(r'\b\d+(?:\.\d+)?\b', '?', sql)
+    return ' '.join(sql.replace('%s', '?').split())
+
+
+def observe_query(sql, elapsed):
+    """Записати час виконання запиту (в секундах)"""
+    key = normalize_sql(sql)
+    with _lock:
+        timing = _queries.get(key)
+        if timing is None:
+            timing = _queries[key] = Timing()
+        timing.add(elapsed)
+
+
+def record_slow_query(sql, params, elapsed, plan=None):
+    """Додати запит у slow-query лог (з планом виконання, якщо є)"""
+    slow_queries.append({
+        'sql': normalize_sql(sql),
+        'params': repr(params)[:200] if params else None,
+        'ms': round(elapsed * 1000, 3),
+        'at': time.strftime('%Y-%m-%d %H:%M:%S'),
+        'plan': plan,
+    })
+
+
+def query_stats(limit=50, order_by='total_ms'):
+    """Запити, відсортовані за сумарним (або іншим) часом, і slow-query лог"""
+    with _lock:
+        statements = [{'sql': sql, **timing.snapshot()} for sql, timing in _queries.items()]
+        slow = list(slow_queries)
+    statements.sort(key=lambda item: item.get(order_by, 0), reverse=True)
+    return {'statements': statements[:limit], 'total_statements': len(statements), 'slow': slow}
+
+
+def reset_query_stats():
+    """Скинути статистику SQL"""
+    with _lock:
+        _queries.clear()
+        slow_queries.clear()
+
+
+class UpdateTrace:
+    """Розбивка часу одного апдейту"""
+    __slots__ = ('update_type', 'handler', 'handler_time', 'db_time', 'db_queries', 'api_time', 'api_calls')
+
+    def __init__(self, update_type):
+        self.update_type = update_type
+        self.handler = None
+        self.handler_time = 0.0
+        self.db_time = 0.0
+        self.db_queries = 0
+        self.api_time = 0.0
+        self.api_calls = 0
+
+    def as_dict(self, total):
+        return {
+            'update_type': self.update_type,
+            'handler': self.handler,
+            'total_ms': round(total * 1000, 3),
+            'handler_ms': round(self.handler_time * 1000, 3),
+            'db_ms': round(self.db_time * 1000, 3),
+            'db_queries': self.db_queries,
+            'api_ms': round(self.api_time * 1000, 3),
+            'api_calls': self.api_calls,
+        }
+
+
+# Трейс апдейту, який зараз обробляється (None поза dispatcher)
+current_trace = ContextVar('current_trace', default=None)
+
+
+@contextmanager
+def track_db():
+    """Заміряти час запиту до БД і додати його до поточного апдейту"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        observe('db', 'query', elapsed)
+        trace = current_trace.get()
+        if trace is not None:
+            trace.db_time += elapsed
+            trace.db_queries += 1
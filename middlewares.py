@@ -0,0 +1,194 @@
+"""
+Middleware для dispatcher і сесії бота - заміри часу обробки апдейтів і anti-flood
+"""
+import os
+import time
+import logging
+from typing import Any, Awaitable, Callable, Dict
+
+from aiogram import BaseMiddleware
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.dispatcher.flags import get_flag
+from aiogram.types import CallbackQuery, Message, TelegramObject, Update
+
+import metrics
+
+# Апдейти, що обробляються довше за поріг, потрапляють в slow-update лог
+SLOW_UPDATE_MS = float(os.getenv("SLOW_UPDATE_MS", "1000"))
+
+# Ліміт запитів на користувача за замовчуванням (токенів за секунду і розмір "пачки")
+THROTTLE_RATE = float(os.getenv("THROTTLE_RATE", "1"))
+THROTTLE_BURST = float(os.getenv("THROTTLE_BURST", "5"))
+
+THROTTLE_MESSAGE = "⏳ Забагато запитів, зачекайте трохи"
+
+
+class UpdateTimingMiddleware(BaseMiddleware):
+    """Outer middleware на dp.update: загальний час апдейту і slow-update лог"""
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: Update,
+        data: Dict[str, Any]
+    ) -> Any:
+        trace = metrics.UpdateTrace(event.event_type)
+        token = metrics.current_trace.set(trace)
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        finally:
+            elapsed = time.perf_counter() - started
+            metrics.current_trace.reset(token)
+            metrics.observe('update', trace.update_type, elapsed)
+
+            if elapsed * 1000 >= SLOW_UPDATE_MS:
+                breakdown = trace.as_dict(elapsed)
+                breakdown['update_id'] = event.update_id
+                metrics.slow_updates.append(breakdown)
+                logging.warning(
+                    f"🐢 Повільний update {event.update_id} ({trace.update_type} → {trace.handler}): "
+                    f"{breakdown['total_ms']:.0f} ms, handler {breakdown['handler_ms']:.0f} ms, "
+                    f"DB {breakdown['db_ms']:.0f} ms / {trace.db_queries} запитів, "
+                    f"Telegram API {breakdown['api_ms']:.0f} ms / {trace.api_calls} викликів"
+                )
+
+
+class HandlerTimingMiddleware(BaseMiddleware):
+    """Inner middleware на observers: час конкретного хендлера"""
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        handler_object = data.get('handler')
+        name = handler_object.callback.__name__ if handler_object else 'unknown'
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        finally:
+            elapsed = time.perf_counter() - started
+            metrics.observe('handler', name, elapsed)
+            trace = metrics.current_trace.get()
+            if trace is not None:
+                trace.handler = name
+                trace.handler_time += elapsed
+
+
+class TelegramTimingMiddleware(BaseRequestMiddleware):
+    """Middleware сесії бота: час кожного виклику Telegram Bot API"""
+
+    async def __call__(self, make_request, bot, method):
+        started = time.perf_counter()
+        try:
+            return await make_request(bot, method)
+        finally:
+            elapsed = time.perf_counter() - started
+            metrics.observe('telegram_api', type(method).__name__, elapsed)
+            trace = metrics.current_trace.get()
+            if trace is not None:
+                trace.api_time += elapsed
+                trace.api_calls += 1
+
+
+class TokenBucket:
+    """Bucket одного користувача: поточні токени і момент, коли він знову буде повним"""
+    __slots__ = ('tokens', 'updated', 'full_at', 'warned')
+
+    def __init__(self, tokens, now):
+        self.tokens = tokens
+        self.updated = now
+        self.full_at = now
+        self.warned = False
+
+
+class ThrottlingMiddleware(BaseMiddleware):
+    """
+    Inner middleware: per-user token bucket.
+    Ліміт хендлера задається через flags={"rate_limit": {"rate": ..., "burst": ...}},
+    flags={"rate_limit": False} вимикає обмеження (оплата, замовлення).
+    Хендлери без прапорця ділять спільний bucket користувача.
+    """
+
+    def __init__(self, rate=THROTTLE_RATE, burst=THROTTLE_BURST, sweep_every=1000):
+        self.rate = rate
+        self.burst = burst
+        self.sweep_every = sweep_every
+        self.buckets = {}  # (user_id, handler або None) -> TokenBucket
+        self._calls = 0
+
+    def _sweep(self, now):
+        """Видаляємо bucket'и, які вже повністю відновились - вони рівні новим"""
+        expired = [key for key, bucket in self.buckets.items() if bucket.full_at <= now]
+        for key in expired:
+            del self.buckets[key]
+
+    def _consume(self, key, rate, burst, now):
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            bucket = self.buckets[key] = TokenBucket(burst, now)
+        else:
+            bucket.tokens = min(burst, bucket.tokens + (now - bucket.updated) * rate)
+            bucket.updated = now
+
+        self._calls += 1
+        if self._calls % self.sweep_every == 0:
+            self._sweep(now)
+
+        if bucket.tokens >= 1:
+            bucket.tokens -= 1
+            bucket.full_at = now + (burst - bucket.tokens) / rate
+            bucket.warned = False
+            return bucket, True
+        return bucket, False
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        limit = get_flag(data, "rate_limit")
+        user = data.get("event_from_user")
+        if limit is False or user is None:
+            return await handler(event, data)
+
+        if limit:
+            key = (user.id, data["handler"].callback.__name__)
+            rate = limit.get("rate", self.rate)
+            burst = limit.get("burst", self.burst)
+        else:
+            key = (user.id, None)
+            rate, burst = self.rate, self.burst
+
+        bucket, allowed = self._consume(key, rate, burst, time.monotonic())
+        if allowed:
+            return await handler(event, data)
+
+        metrics.observe('throttled', key[1] or 'default', 0.0)
+        # Відповідаємо тільки один раз, далі мовчки відкидаємо до відновлення
+        if not bucket.warned:
+            bucket.warned = True
+            if isinstance(event, (CallbackQuery, Message)):
+                await event.answer(THROTTLE_MESSAGE)
+        return None
+
+
+def setup_timing(dp, bot):
+    """Підключити всі заміри часу до dispatcher і бота"""
+    dp.update.outer_middleware(UpdateTimingMiddleware())
+
+    handler_timing = HandlerTimingMiddleware()
+    for observer in (dp.message, dp.callback_query, dp.inline_query, dp.pre_checkout_query):
+        observer.middleware(handler_timing)
+
+    bot.session.middleware(TelegramTimingMiddleware())
+
+
+def setup_throttling(dp):
+    """Підключити anti-flood до повідомлень і callback'ів (до setup_timing)"""
+    throttling = ThrottlingMiddleware()
+    dp.message.middleware(throttling)
+    dp.callback_query.middleware(throttling)
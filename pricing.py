@@ -0,0 +1,58 @@
+"""
+Серверний розрахунок вартості замовлення за цінами зі знімка каталогу в пам'яті
+"""
+import time
+
+import metrics
+from catalog import catalog
+
+MAX_QUANTITY = 99
+
+
+def _parse_quantity(value):
+    try:
+        quantity = int(value)
+    except (TypeError, ValueError):
+        return 1
+    return max(1, min(quantity, MAX_QUANTITY))
+
+
+def price_cart(items, client_total=None):
+    """
+    Перерахувати кошик за цінами каталогу.
+    Повертає словник: items (з серверними цінами), total, removed (товари, яких немає),
+    corrected (ціни або сума від клієнта не збіглися).
+    """
+    started = time.perf_counter()
+    products = catalog.get().by_id
+
+    priced_items = []
+    removed = []
+    corrected = False
+    total = 0.0
+
+    for item in items:
+        product = products.get(item.get('id'))
+        if product is None:
+            removed.append(item)
+            continue
+
+        price, name = product.price, product.name
+        quantity = _parse_quantity(item.get('quantity', 1))
+        if item.get('price') != price or item.get('name') != name:
+            corrected = True
+
+        priced_items.append({**item, 'name': name, 'price': price, 'quantity': quantity})
+        total += price * quantity
+
+    total = round(total, 2)
+    if client_total is not None and client_total != total:
+        corrected = True
+
+    metrics.observe('pricing', 'price_cart', time.perf_counter() - started)
+    return {
+        'items': priced_items,
+        'total': total,
+        'removed': removed,
+        'corrected': corrected,
+    }
@@ -0,0 +1,143 @@
+"""
+Семплюючий профайлер для живого процесу - стеки всіх потоків (event loop і executor)
+через sys._current_frames() з окремого потоку, без залежностей і без sys.setprofile
+"""
+import os
+import sys
+import time
+import asyncio
+import threading
+from collections import Counter
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+MAX_PROFILE_SECONDS = 60
+DEFAULT_INTERVAL = 0.005
+
+# Листові функції "потік чекає роботи" - за замовчуванням не рахуються
+IDLE_LEAVES = {
+    ('selectors.py', 'select'),
+    ('threading.py', 'wait'),
+    ('queue.py', 'get'),
+    ('thread.py', '_worker'),
+}
+
+_running = threading.Lock()
+
+
+class ProfilerBusy(RuntimeError):
+    """Інший профіль вже знімається"""
+
+
+def _short_path(filename):
+    if filename.startswith(ROOT + os.sep):
+        return os.path.relpath(filename, ROOT)
+    marker = 'site-packages' + os.sep
+    if marker in filename:
+        return filename.split(marker, 1)[1]
+    return os.path.basename(filename)
+
+
+class SamplingProfiler:
+    """Знімає стеки всіх потоків кожні interval секунд, рахує однакові стеки"""
+
+    def __init__(self, interval=DEFAULT_INTERVAL, include_idle=False):
+        self.interval = interval
+        self.include_idle = include_idle
+        self.stacks = Counter()   # (назва потоку, (кадр, ...) від кореня) -> семпли
+        self.samples = 0
+        self.idle = 0
+        self._labels = {}         # code -> 'func (file:line)'
+
+    def _label(self, code):
+        label = self._labels.get(code)
+        if label is None:
+            label = self._labels[code] = f"{code.co_name} ({_short_path(code.co_filename)}:{code.co_firstlineno})"
+        return label
+
+    def sample(self, skip_thread):
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id == skip_thread:
+                continue
+            code = frame.f_code
+            if not self.include_idle and (os.path.basename(code.co_filename), code.co_name) in IDLE_LEAVES:
+                self.idle += 1
+                continue
+            stack = []
+            while frame is not None:
+                stack.append(self._label(frame.f_code))
+                frame = frame.f_back
+            stack.reverse()
+            self.stacks[(names.get(thread_id, str(thread_id)), tuple(stack))] += 1
+            self.samples += 1
+
+    def run(self, seconds):
+        """Блокуючий прогін на seconds секунд у поточному потоці"""
+        me = threading.get_ident()
+        deadline = time.perf_counter() + seconds
+        next_at = time.perf_counter()
+        while next_at < deadline:
+            self.sample(me)
+            next_at += self.interval
+            delay = next_at - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                # Не встигаємо - пропускаємо семпли, а не накопичуємо відставання
+                next_at = time.perf_counter()
+
+    def collapsed(self):
+        """Формат collapsed stacks (flamegraph.pl, speedscope): 'потік;f1;f2 N'"""
+        return ''.join(
+            f"{';'.join((thread,) + stack)} {count}\n"
+            for (thread, stack), count in sorted(self.stacks.items(), key=lambda item: -item[1])
+        )
+
+    def top(self, limit=30):
+        """Топ функцій: self (функція на вершині стеку) і total (є в стеку)"""
+        own, total, threads = Counter(), Counter(), Counter()
+        for (thread, stack), count in self.stacks.items():
+            threads[thread] += count
+            if stack:
+                own[stack[-1]] += count
+            for label in set(stack):
+                total[label] += count
+
+        def rows(counter):
+            return [{'function': label, 'samples': count, 'pct': round(count * 100 / self.samples, 2)}
+                    for label, count in counter.most_common(limit)]
+
+        return {
+            'samples': self.samples,
+            'idle_samples': self.idle,
+            'threads': dict(threads.most_common()),
+            'top_self': rows(own) if self.samples else [],
+            'top_total': rows(total) if self.samples else [],
+        }
+
+
+async def profile(seconds, interval=DEFAULT_INTERVAL, include_idle=False):
+    """
+    Зняти профіль процесу за seconds секунд, не блокуючи event loop.
+    Семплер працює в окремому потоці (не в executor - він теж профілюється).
+    ProfilerBusy, якщо профіль вже знімається.
+    """
+    if not _running.acquire(blocking=False):
+        raise ProfilerBusy("Profile is already running")
+
+    loop = asyncio.get_running_loop()
+    done = loop.create_future()
+    profiler = SamplingProfiler(interval, include_idle)
+
+    def worker():
+        try:
+            profiler.run(seconds)
+            loop.call_soon_threadsafe(lambda: done.done() or done.set_result(profiler))
+        except Exception as e:
+            loop.call_soon_threadsafe(lambda error=e: done.done() or done.set_exception(error))
+        finally:
+            _running.release()
+
+    threading.Thread(target=worker, name='profiler', daemon=True).start()
+    return await asyncio.shield(done)
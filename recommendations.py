@@ -0,0 +1,187 @@
+"""
+Схожі товари - попередньо обчислений top-K для кожного товару, зберігається в пам'яті
+"""
+import re
+import time
+import bisect
+import threading
+
+import metrics
+from database import on_catalog_change
+from catalog import catalog, Product
+
+# Страховка на випадок змін каталогу з іншого процесу
+SIMILAR_INDEX_TTL = 300
+SIMILAR_TOP_K = 8
+MIN_SIMILARITY = 3.0
+# Кандидати для порівняння: найближчі за ціною в тій самій категорії/типі
+# і товари зі спільними словами в назві (занадто поширені слова ігноруються)
+PRICE_NEIGHBOURS = 30
+MAX_TOKEN_POSTINGS = 200
+
+
+class ProductFeatures:
+    """Ознаки товару (catalog.Product) для порівняння"""
+    __slots__ = ('id', 'category', 'product_type', 'price', 'sizes', 'tokens')
+
+    def __init__(self, product):
+        self.id = product.id
+        self.category = product.category
+        self.product_type = product.product_type
+        self.price = product.price
+        self.sizes = frozenset(product.sizes)
+        self.tokens = frozenset(token for token in re.findall(r'\w+', (product.name or '').lower())
+                                if len(token) >= 3 and not token.isdigit())
+
+    @property
+    def bucket(self):
+        return self.category, self.product_type
+
+
+def similarity(a, b):
+    """Оцінка схожості: тип, категорія, спільні розміри, близька ціна, спільні слова в назві"""
+    score = 0.0
+    if a.product_type == b.product_type:
+        score += 3.0
+    if a.category == b.category:
+        score += 2.0
+    if a.sizes and b.sizes:
+        score += 2.0 * len(a.sizes & b.sizes) / len(a.sizes | b.sizes)
+    if a.price > 0 and b.price > 0:
+        ratio = min(a.price, b.price) / max(a.price, b.price)
+        if ratio > 0.5:
+            score += 2.0 * (ratio - 0.5) / 0.5
+    if a.tokens and b.tokens:
+        score += 4.0 * len(a.tokens & b.tokens) / len(a.tokens | b.tokens)
+    return score
+
+
+class SimilarProducts:
+    """
+    id товару -> список схожих (top-K), будується один раз і оновлюється з write path:
+    новий товар порівнюється тільки зі своїми кандидатами, при видаленні перераховуються
+    лише ті товари, у списках яких він був.
+    """
+
+    def __init__(self, top_k=SIMILAR_TOP_K, ttl=SIMILAR_INDEX_TTL):
+        self.top_k = top_k
+        self.ttl = ttl
+        self._lock = threading.RLock()
+        self._loaded_at = 0.0
+        self._products = None   # id -> catalog.Product (спільний зі знімком каталогу)
+        self._features = {}     # id -> ProductFeatures
+        self._buckets = {}      # (category, product_type) -> відсортований [(price, id)]
+        self._postings = {}     # слово з назви -> {id}
+        self._similar = {}      # id -> [(score, id)] за спаданням
+        self._listed_in = {}    # id -> {id товарів, у чиїх списках він є}
+
+    def _index(self, product):
+        features = ProductFeatures(product)
+        self._products[features.id] = product
+        self._features[features.id] = features
+        bisect.insort(self._buckets.setdefault(features.bucket, []), (features.price, features.id))
+        for token in features.tokens:
+            self._postings.setdefault(token, set()).add(features.id)
+        return features
+
+    def _unindex(self, product_id):
+        features = self._features.pop(product_id)
+        self._products.pop(product_id, None)
+        bucket = self._buckets.get(features.bucket, [])
+        position = bisect.bisect_left(bucket, (features.price, product_id))
+        if position < len(bucket) and bucket[position] == (features.price, product_id):
+            del bucket[position]
+        for token in features.tokens:
+            self._postings.get(token, set()).discard(product_id)
+        return features
+
+    def _candidates(self, features):
+        bucket = self._buckets.get(features.bucket, [])
+        position = bisect.bisect_left(bucket, (features.price, features.id))
+        candidates = {product_id for _, product_id in
+                      bucket[max(0, position - PRICE_NEIGHBOURS):position + PRICE_NEIGHBOURS + 1]}
+        for token in features.tokens:
+            postings = self._postings.get(token, ())
+            if len(postings) <= MAX_TOKEN_POSTINGS:
+                candidates.update(postings)
+        candidates.discard(features.id)
+        return candidates
+
+    def _set_similar(self, product_id, ranked):
+        for _, other_id in self._similar.get(product_id, ()):
+            self._listed_in.get(other_id, set()).discard(product_id)
+        self._similar[product_id] = ranked
+        for _, other_id in ranked:
+            self._listed_in.setdefault(other_id, set()).add(product_id)
+
+    def _compute(self, features):
+        scored = []
+        for other_id in self._candidates(features):
+            score = similarity(features, self._features[other_id])
+            if score >= MIN_SIMILARITY:
+                scored.append((score, other_id))
+        scored.sort(key=lambda item: (-item[0], -item[1]))
+        self._set_similar(features.id, scored[:self.top_k])
+
+    def _offer(self, product_id, score, other_id):
+        """Додати other_id у список product_id, якщо він кращий за найгірший з top-K"""
+        ranked = self._similar.get(product_id, [])
+        if len(ranked) >= self.top_k and (score, other_id) <= (ranked[-1][0], ranked[-1][1]):
+            return
+        ranked = sorted(ranked + [(score, other_id)], key=lambda item: (-item[0], -item[1]))[:self.top_k]
+        self._set_similar(product_id, ranked)
+
+    def _load(self):
+        started = time.perf_counter()
+        self._products, self._features, self._buckets = {}, {}, {}
+        self._postings, self._similar, self._listed_in = {}, {}, {}
+        for product in catalog.get().by_id.values():
+            self._index(product)
+        for features in self._features.values():
+            self._compute(features)
+        self._loaded_at = time.monotonic()
+        metrics.observe('recommendations', 'build', time.perf_counter() - started)
+
+    def similar(self, product_id, limit=None):
+        """Схожі товари (словники) для product_id; None якщо товару немає"""
+        with self._lock:
+            if self._products is None or time.monotonic() - self._loaded_at >= self.ttl:
+                self._load()
+            if product_id not in self._products:
+                return None
+            ranked = self._similar.get(product_id, [])[:limit or self.top_k]
+            return [self._products[other_id].as_dict() for _, other_id in ranked]
+
+    def invalidate(self):
+        with self._lock:
+            self._products = None
+
+    def on_catalog_change(self, action, product_id, product=None):
+        with self._lock:
+            if self._products is None:
+                return
+            if action == 'add' and product is not None:
+                # Той самий об'єкт, що вже додав у знімок catalog (його слухач перший)
+                snapshot = catalog.peek()
+                shared = snapshot.get(product_id) if snapshot is not None else None
+                features = self._index(shared or Product(product))
+                self._compute(features)
+                for other_id in self._candidates(features):
+                    score = similarity(self._features[other_id], features)
+                    if score >= MIN_SIMILARITY:
+                        self._offer(other_id, score, features.id)
+            elif action == 'delete':
+                if product_id not in self._features:
+                    return
+                self._unindex(product_id)
+                self._set_similar(product_id, [])
+                del self._similar[product_id]
+                # Списки, де був видалений товар, перераховуємо з кандидатів
+                for affected_id in self._listed_in.pop(product_id, set()):
+                    self._compute(self._features[affected_id])
+            else:
+                self.invalidate()
+
+
+similar_products = SimilarProducts()
+on_catalog_change(similar_products.on_catalog_change)
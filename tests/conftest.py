@@ -0,0 +1,29 @@
+"""
+Спільне для тестів: код з кореня репозиторію і окрема SQLite база на кожен тест
+"""
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+# Тести завжди працюють з тимчасовим SQLite, а не з продакшн Postgres
+os.environ.pop('DATABASE_URL', None)
+os.environ.pop('DATABASE_READ_URL', None)
+os.environ.pop('DB_READ_FILE', None)
+
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    """database, що працює з новим файлом tmp_path/shop.db"""
+    import database
+    from catalog import catalog
+
+    monkeypatch.setattr(database, 'DB_FILE', str(tmp_path / 'shop.db'))
+    database.init_db()
+    # Знімок каталогу з попереднього тесту належить іншій базі
+    catalog.invalidate()
+    return database
@@ -0,0 +1,46 @@
+"""
+Знімок каталогу в пам'яті: розібрані розміри і інкрементальні зміни з write path
+"""
+import json
+
+from catalog import catalog, parse_sizes
+
+
+def test_parse_sizes_shares_tuples():
+    assert parse_sizes('S, M,L ,') == ('S', 'M', 'L')
+    assert parse_sizes('S,M,L') is parse_sizes(' S , M , L')
+    assert parse_sizes(None) == ()
+
+
+def test_added_product_matches_loaded_row(db):
+    db.add_product('Худі', 'Опис', 1200.0, None, 'чоловіче', 'одяг', 'S, M')
+    catalog.get()
+
+    product_id = db.add_product('Кеди', 'Опис', 2500.0, None, 'жіноче', 'взуття', '38,39 , 40')
+    snapshot = catalog.get()
+    added = snapshot.get(product_id).as_dict()
+
+    assert snapshot.version == db.catalog_version
+    assert added['created_at'] is not None
+    assert added['created_at'] == db.get_product(product_id)['created_at']
+    assert added['sizes_list'] == ['38', '39', '40']
+    assert snapshot.by_type['взуття'][0].id == product_id
+
+    db.delete_product(product_id)
+    assert catalog.get().get(product_id) is None
+
+
+def test_products_json_is_encoded_once_per_version(db):
+    product_id = db.add_product('Худі', 'Опис', 1200.0, None, 'чоловіче', 'одяг', 'S, M')
+    snapshot = catalog.get()
+
+    version, body, etag = snapshot.json()
+    assert snapshot.json()[1] is body
+    assert version == snapshot.version
+    assert json.loads(body) == [snapshot.get(product_id).as_dict()]
+
+    db.add_product('Кеди', 'Опис', 2500.0, None, 'жіноче', 'взуття', '38, 39')
+    version, changed, changed_etag = catalog.get().json()
+    assert version == db.catalog_version
+    assert changed_etag != etag
+    assert [product['name'] for product in json.loads(changed)] == ['Кеди', 'Худі']
@@ -0,0 +1,34 @@
+"""
+Статистика SQL: запити з курсорів у транзакціях (не тільки execute_query) теж рахуються
+"""
+import metrics
+
+
+def stats_for(prefix):
+    return [item for item in metrics.query_stats(limit=1000)['statements'] if item['sql'].startswith(prefix)]
+
+
+def test_add_order_statements_are_recorded(db):
+    product_id = db.add_product('Худі', 'Опис', 1200.0, None, 'чоловіче', 'одяг', 'S, M')
+    metrics.reset_query_stats()
+
+    products = '[{"id": %d, "name": "Худі", "size": "M", "price": 1200.0}]' % product_id
+    db.add_order(1, 'buyer', products, 1200.0, payment_method='card')
+
+    inserts = stats_for('INSERT INTO orders')
+    assert len(inserts) == 1
+    assert inserts[0]['count'] == 1
+    # upsert'и зведень йдуть через executemany того самого курсора
+    assert stats_for('INSERT INTO sales_daily ')
+    assert stats_for('INSERT INTO sales_daily_payments')
+
+
+def test_execute_query_is_recorded_once(db):
+    metrics.reset_query_stats()
+
+    rows = db.get_all_products()
+
+    assert rows == []
+    selects = stats_for('SELECT * FROM products ORDER BY created_at DESC')
+    assert len(selects) == 1
+    assert selects[0]['count'] == 1
@@ -0,0 +1,69 @@
+"""
+Репліка для читання (DB_READ_FILE): каталог читається з неї, замовлення - тільки з primary,
+а після зміни каталогу читаємо з primary, поки не мине REPLICA_STICKY_SECONDS
+"""
+import shutil
+import sqlite3
+import time
+
+import pytest
+
+
+class Clock:
+    def __init__(self):
+        self.now = time.monotonic()
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def replica(db, tmp_path, monkeypatch):
+    """Копія primary з додатковим товаром, який є тільки в репліці"""
+    path = str(tmp_path / 'replica.db')
+    shutil.copyfile(db.DB_FILE, path)
+    conn = sqlite3.connect(path)
+    conn.execute("INSERT INTO products (name, price, sizes) VALUES ('Тільки в репліці', 100.0, 'M')")
+    conn.commit()
+    conn.close()
+
+    clock = Clock()
+    monkeypatch.setattr(db.time, 'monotonic', clock)
+    monkeypatch.setattr(db, 'DB_READ_FILE', path)
+    monkeypatch.setattr(db, '_primary_until', 0.0)
+    return clock
+
+
+def catalog_names(db):
+    return {product['name'] for product in db.get_all_products()}
+
+
+def test_catalog_reads_go_to_replica(db, replica):
+    assert catalog_names(db) == {'Тільки в репліці'}
+    assert db.get_product(1)['name'] == 'Тільки в репліці'
+    assert [product['name'] for product in db.search_products('репліці')] == ['Тільки в репліці']
+
+
+def test_order_and_user_reads_stay_on_primary(db, replica):
+    order_id = db.add_order(42, 'buyer', '[]', 100.0, payment_method='cash')
+    db.save_user(42, 'buyer', 'Buyer', None)
+
+    assert db.get_order(order_id)['user_id'] == 42
+    assert [order['id'] for order in db.get_recent_orders(10)] == [order_id]
+    orders, has_more = db.get_user_orders(42)
+    assert [order['id'] for order in orders] == [order_id]
+    assert not has_more
+    user = db.execute_query(db.statement('SELECT username FROM users WHERE user_id = ?'), (42,), fetchone=True)
+    assert user['username'] == 'buyer'
+
+
+def test_catalog_read_after_write_sticks_to_primary(db, replica):
+    db.add_product('Нове худі', 'Опис', 1200.0, None, 'чоловіче', 'одяг', 'S, M')
+
+    assert catalog_names(db) == {'Нове худі'}
+
+    replica.now += db.REPLICA_STICKY_SECONDS - 1
+    assert catalog_names(db) == {'Нове худі'}
+
+    replica.now += 1
+    assert catalog_names(db) == {'Тільки в репліці'}
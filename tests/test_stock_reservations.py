@@ -0,0 +1,143 @@
+"""
+Резерви складу: паралельні checkout не продають більше, ніж є, звільнення і
+підтвердження ідемпотентні, підмінений розмір не обходить ліміт
+"""
+import threading
+
+STOCK = 25
+SHOPPERS = 300
+
+
+def add_hoodie(db, sizes='S, M, L'):
+    return db.add_product('Худі', 'Опис', 1200.0, None, 'чоловіче', 'одяг', sizes)
+
+
+def stock_of(db, product_id, size):
+    return db.get_stock(product_id)[product_id][size]
+
+
+def test_concurrent_checkouts_never_oversell(db):
+    product_id = add_hoodie(db)
+    db.set_stock(product_id, 'M', STOCK)
+
+    start = threading.Barrier(SHOPPERS)
+    results = [None] * SHOPPERS
+    errors = []
+
+    def shopper(index):
+        start.wait()
+        try:
+            results[index] = db.reserve_stock(index, [(product_id, 'M', 1)])
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=shopper, args=(i,)) for i in range(SHOPPERS)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert not errors
+    reserved = [ids for ids, unavailable in results if ids]
+    rejected = [unavailable for ids, unavailable in results if not ids]
+    assert len(reserved) == STOCK
+    assert len(rejected) == SHOPPERS - STOCK
+    assert all(unavailable == [(product_id, 'M')] for unavailable in rejected)
+    assert stock_of(db, product_id, 'M') == 0
+
+    count = db.execute_query('SELECT COUNT(*) AS n, SUM(qty) AS qty FROM stock_reservations', fetchone=True)
+    assert (count['n'], count['qty']) == (STOCK, STOCK)
+
+
+def test_cart_is_reserved_all_or_nothing(db):
+    product_id = add_hoodie(db)
+    db.set_stock(product_id, 'S', 1)
+    db.set_stock(product_id, 'M', 5)
+
+    ids, unavailable = db.reserve_stock(1, [(product_id, 'M', 2), (product_id, 'S', 2)])
+
+    assert ids == []
+    assert unavailable == [(product_id, 'S')]
+    assert stock_of(db, product_id, 'M') == 5
+    assert stock_of(db, product_id, 'S') == 1
+
+
+def test_release_is_idempotent(db):
+    product_id = add_hoodie(db)
+    db.set_stock(product_id, 'M', 3)
+    ids, _ = db.reserve_stock(1, [(product_id, 'M', 2)])
+
+    assert db.release_reservations(ids) == 1
+    assert stock_of(db, product_id, 'M') == 3
+    assert db.release_reservations(ids) == 0
+    assert stock_of(db, product_id, 'M') == 3
+
+
+def test_confirm_is_idempotent(db):
+    product_id = add_hoodie(db)
+    db.set_stock(product_id, 'M', 3)
+    ids, _ = db.reserve_stock(1, [(product_id, 'M', 2)])
+
+    assert db.confirm_reservations(ids) == 1
+    assert db.confirm_reservations(ids) == 0
+    # Підтверджений резерв вже не можна звільнити назад на склад
+    assert db.release_reservations(ids) == 0
+    assert stock_of(db, product_id, 'M') == 1
+
+
+def test_unknown_size_is_rejected(db):
+    product_id = add_hoodie(db)
+    db.set_stock(product_id, 'M', 1)
+
+    ids, unavailable = db.reserve_stock(1, [(product_id, 'm', 5)])
+
+    assert ids == []
+    assert unavailable == [(product_id, 'm')]
+    assert stock_of(db, product_id, 'M') == 1
+
+
+def test_declared_size_without_stock_row_is_unlimited(db):
+    product_id = add_hoodie(db)
+
+    ids, unavailable = db.reserve_stock(1, [(product_id, 'L', 50)])
+
+    # Без ліміту нічого не резервується, але й не відмовляємо
+    assert ids == []
+    assert unavailable == []
+
+
+def test_missing_product_is_rejected(db):
+    ids, unavailable = db.reserve_stock(1, [(999, 'M', 1)])
+
+    assert ids == []
+    assert unavailable == [(999, 'M')]
+
+
+def place_order(db, product_id, reservation_ids):
+    products = '[{"id": %d, "name": "Худі", "size": "M", "price": 1200.0, "quantity": 2}]' % product_id
+    order_id = db.add_order(1, 'buyer', products, 2400.0, payment_method='cash')
+    db.confirm_reservations(reservation_ids, order_id)
+    return order_id
+
+
+def test_cancel_returns_committed_stock(db):
+    product_id = add_hoodie(db)
+    db.set_stock(product_id, 'M', 3)
+    ids, _ = db.reserve_stock(1, [(product_id, 'M', 2)])
+    order_id = place_order(db, product_id, ids)
+    assert stock_of(db, product_id, 'M') == 1
+
+    assert db.update_order_status(order_id, 'pending', 'cancelled')
+    assert stock_of(db, product_id, 'M') == 3
+
+
+def test_cancel_after_expired_reservation_does_not_restock_twice(db):
+    product_id = add_hoodie(db)
+    db.set_stock(product_id, 'M', 3)
+    ids, _ = db.reserve_stock(1, [(product_id, 'M', 2)], ttl=-1)
+    assert db.release_expired_reservations() == 1
+    assert stock_of(db, product_id, 'M') == 3
+
+    order_id = place_order(db, product_id, ids)
+    assert db.update_order_status(order_id, 'pending', 'cancelled')
+    assert stock_of(db, product_id, 'M') == 3